@@ -2,12 +2,61 @@
 from datetime import date, datetime, time, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 import calendar
+import threading
+import time as time_mod
+import uuid
+import json
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
 import os
 
+# --- (NOVO) Camada fina sobre a API (fields, paginação, backoff, transporte reutilizado) ---
+from agenda_cliente import (
+    URL_API,
+    criar_servico,
+    executar,
+    listar_paginas,
+    listar_eventos,
+    CAMPOS_EVENTO
+)
+
 # --- (NOVO) Import para limpar o DB ---
-from database import deletar_venda_por_id_google, cancelar_venda_por_id
+from database import (
+    buscar_id_venda_por_id_google,
+    db_buscar_pendentes_expirados,
+    db_remover_reservas_expiradas
+)
+
+# --- (NOVO) Import do índice local de disponibilidade ---
+from database import (
+    db_obter_sync_token,
+    db_atualizar_indice_agenda,
+    db_dias_ocupados_no_periodo,
+    db_ocupacao_no_periodo
+)
+
+# --- (NOVO) Estoque por item (várias festas no mesmo dia) ---
+from estoque import dias_que_cabem
+
+# --- (NOVO) Planejador de veículos/equipes ---
+from database import db_tarefas_logisticas
+from logistica import horarios_livres
+
+# --- (NOVO) Import do livro de reservas (claim atômico) ---
+from database import (
+    db_reservar_dia,
+    db_remarcar_reserva,
+    db_confirmar_reserva,
+    db_cancelar_reserva,
+    db_marcar_reserva_sincronizada,
+    db_reserva_para_espelho,
+    db_reservar_operacoes_espelho,
+    db_concluir_operacoes_espelho,
+    db_adiar_operacao_espelho
+)
 
 # --- CONFIGURAÇÃO ---
 project_path = os.path.dirname(os.path.abspath(__file__))
@@ -17,19 +66,68 @@ CALENDAR_ID = '174ad250bdc61e357abcffacb105c9d125a74ef5caad21f5a920609c40bb25e9@
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 HORARIOS_PADRAO_FESTA = ["10:00", "14:00", "18:00"]
 
-# --- Conexão com a API ---
-try:
-    creds = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build('calendar', 'v3', credentials=creds)
-except Exception as e:
-    print(f"Erro ao conectar com a API do Google: {e}")
-    service = None
+# (NOVO) Intervalo mínimo entre duas sincronizações incrementais com o Google.
+# Dentro desse intervalo, as consultas são respondidas só pelo índice local.
+INTERVALO_MIN_SYNC_SEGUNDOS = 15
+PRAZO_EXPIRACAO_PENDENTE = timedelta(hours=24)
+
+# (NOVO) Agendas extras (uma por grupo de equipamentos / equipe) consultadas via freeBusy.
+# Um dia só fica disponível se estiver livre na agenda principal E em todas estas.
+CALENDARIOS_EQUIPAMENTOS = []
+FUSO_AGENDA = ZoneInfo('America/Sao_Paulo')
+MAX_CALENDARIOS_FREEBUSY = 50 # Limite de agendas por chamada do freebusy.query
+JANELA_MAX_FREEBUSY = timedelta(days=90) # Janelas maiores são divididas em partes
+VALIDADE_CACHE_FREEBUSY_SEGUNDOS = 60
+
+# (NOVO) Limpeza periódica de reservas pendentes expiradas
+INTERVALO_LIMPEZA_SEGUNDOS = 15 * 60
+TAMANHO_LOTE_LIMPEZA = 50 # Limite de requisições por batch da API do Google
+
+# --- (NOVO) Conexão com a API (preguiçosa) ---
+# As credenciais e o serviço só são criados na primeira chamada que usa a Agenda,
+# a partir do documento de descoberta embutido na biblioteca (sem rede na partida).
+# Um único serviço é compartilhado pelo processo todo.
+_servico = None
+_creds = None
+_conexao_falhou = False
+_conexao_lock = threading.Lock()
+
+def _conectar():
+    """Carrega as credenciais e constrói o serviço (uma única tentativa por processo)."""
+    global _servico, _creds, _conexao_falhou
+    with _conexao_lock:
+        if _servico is not None or _conexao_falhou:
+            return
+        try:
+            if URL_API:
+                # Servidor local de testes (calendario_fake.py): não exige credenciais
+                creds = AnonymousCredentials()
+            else:
+                creds = service_account.Credentials.from_service_account_file(
+                        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            _servico = criar_servico(creds)
+            _creds = creds
+        except Exception as e:
+            print(f"Erro ao conectar com a API do Google: {e}")
+            _conexao_falhou = True
+
+def obter_servico():
+    """Serviço do Calendar v3 do processo (criado no primeiro uso). None se a conexão falhou."""
+    if _servico is None:
+        _conectar()
+    return _servico
+
+def obter_credenciais():
+    """Credenciais da conta de serviço (carregadas no primeiro uso). None se a conexão falhou."""
+    if _creds is None:
+        _conectar()
+    return _creds
 
 # --- FUNÇÕES ---
 
 def obter_eventos_do_mes(ano, mes):
-    """Função auxiliar para buscar todos os eventos de um mês de uma só vez."""
+    """Função auxiliar para buscar todos os eventos de um mês (todas as páginas)."""
+    service = obter_servico()
     if not service:
         return []
     try:
@@ -39,187 +137,625 @@ def obter_eventos_do_mes(ano, mes):
         time_min = start_of_month.isoformat() + 'Z'
         time_max = end_of_month.isoformat() + 'Z'
 
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
+        return list(listar_eventos(
+            service,
+            CALENDAR_ID,
             timeMin=time_min,
             timeMax=time_max,
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
-        return events_result.get('items', [])
+        ))
     except Exception as e:
         print(f"Erro ao obter eventos do mês {mes}/{ano}: {e}")
         return []
 
-# --- (NOVA FUNÇÃO HELPER) ---
-def _is_evento_pendente_expirado(evento) -> bool:
-    """Verifica se um evento é PENDENTE e tem mais de 24h."""
+# ==============================================================================
+# --- (NOVO) ÍNDICE LOCAL DE DISPONIBILIDADE (SINCRONIZAÇÃO INCREMENTAL) ---
+# ==============================================================================
+# O índice (tabela 'agenda_eventos') é um espelho enxuto da agenda, mantido via
+# syncToken/nextSyncToken: só o delta desde a última sincronização trafega.
+
+_sync_lock = threading.Lock()
+_ultima_sync = 0.0
+
+def _normalizar_created(created_str):
+    """Converte o 'created' do Google (UTC com 'Z') para 'YYYY-MM-DDTHH:MM:SS', comparável no SQL."""
+    if not created_str:
+        return None
+    created = datetime.fromisoformat(created_str.replace('Z', '+00:00'))
+    return created.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+def _limite_pendente_utc() -> str:
+    """Eventos PENDENTES criados antes deste instante (UTC) estão expirados."""
+    return (datetime.now(timezone.utc) - PRAZO_EXPIRACAO_PENDENTE).strftime('%Y-%m-%dT%H:%M:%S')
+
+def _propriedades_privadas(evento) -> dict:
+    """Retorna as extendedProperties privadas do evento (cpf, status, chat_id, venda_id)."""
+    return evento.get('extendedProperties', {}).get('private', {})
+
+def _status_do_evento(evento) -> str:
+    """
+    Lê o status (PENDENTE/CONFIRMADO) das extendedProperties.
+    Eventos antigos (ainda não migrados) caem no título / chave na descrição.
+    """
+    status = _propriedades_privadas(evento).get('status')
+    if status:
+        return status
     summary = evento.get('summary', '')
     description = evento.get('description', '')
-    
-    # Verifica o título ou a descrição pela chave de status
-    is_pending = "[PENDENTE]" in summary or "STATUS_KEY::PENDENTE" in description
-    
-    if not is_pending:
-        return False # É um evento confirmado, não está expirado.
+    if "[PENDENTE]" in summary or "STATUS_KEY::PENDENTE" in description:
+        return 'PENDENTE'
+    return 'CONFIRMADO'
+
+def _evento_para_indice(evento):
+    """Converte um evento do Google na tupla gravada no índice local."""
+    start = evento.get('start', {})
+    start_str = start.get('dateTime', start.get('date'))
+    if not start_str:
+        return None
+    return (
+        evento['id'],
+        start_str.split('T')[0],
+        start_str,
+        evento.get('summary', ''),
+        _status_do_evento(evento),
+        _normalizar_created(evento.get('created'))
+    )
+
+def _atualizar_indice_local(evento):
+    """Reflete imediatamente no índice um evento que acabamos de gravar na agenda."""
+    dados = _evento_para_indice(evento)
+    if dados:
+        db_atualizar_indice_agenda(CALENDAR_ID, [dados], [])
+
+def _atualizar_indice_com_eventos(eventos: list):
+    """(NOVO) Grava no índice, numa só transação, eventos que acabamos de ler da agenda."""
+    dados = [d for d in map(_evento_para_indice, eventos) if d]
+    if dados:
+        db_atualizar_indice_agenda(CALENDAR_ID, dados, [])
+
+def _remover_do_indice_local(event_id: str):
+    """Remove imediatamente do índice um evento que acabamos de deletar da agenda."""
+    db_atualizar_indice_agenda(CALENDAR_ID, [], [event_id])
+
+def _parametros_sincronizacao(sync_token) -> dict:
+    """Parâmetros do events.list da sincronização (incremental se houver token)."""
+    params = {'singleEvents': True}
+    if sync_token:
+        params['syncToken'] = sync_token
+    return params
+
+def _aplicar_paginas_no_indice(paginas, sync_token, token_lido) -> bool:
+    """
+    Aplica no índice local, numa só transação, as páginas de mudanças da agenda.
+    'token_lido' é o syncToken salvo quando a sincronização começou (o lote é descartado se mudou).
+    """
+    eventos, ids_removidos = [], []
+    novo_sync_token = None
+    for pagina in paginas:
+        for evento in pagina.get('items', []):
+            if evento.get('status') == 'cancelled':
+                ids_removidos.append(evento['id'])
+                continue
+            dados = _evento_para_indice(evento)
+            if dados:
+                eventos.append(dados)
+        # O nextSyncToken vem só na última página
+        novo_sync_token = pagina.get('nextSyncToken', novo_sync_token)
+
+    return db_atualizar_indice_agenda(
+        CALENDAR_ID,
+        eventos,
+        ids_removidos,
+        sync_token=novo_sync_token,
+        sincronizacao_completa=sync_token is None,
+        token_lido=token_lido
+    )
+
+def _executar_sincronizacao(sync_token, token_lido):
+    """Busca (paginando) as mudanças da agenda e aplica no índice local numa só transação."""
+    return _aplicar_paginas_no_indice(
+        listar_paginas(obter_servico(), CALENDAR_ID, **_parametros_sincronizacao(sync_token)),
+        sync_token,
+        token_lido
+    )
+
+def _sincronizacao_recente() -> bool:
+    """True se a última sincronização foi há menos de INTERVALO_MIN_SYNC_SEGUNDOS."""
+    return (time_mod.monotonic() - _ultima_sync) < INTERVALO_MIN_SYNC_SEGUNDOS
+
+def _registrar_sincronizacao():
+    """Marca o instante da última sincronização bem-sucedida."""
+    global _ultima_sync
+    _ultima_sync = time_mod.monotonic()
+
+def sincronizar_indice_agenda(forcar: bool = False) -> bool:
+    """
+    Atualiza o índice local com as mudanças da agenda desde o último syncToken.
+    Sem 'forcar', não faz nada se a última sincronização foi há menos de
+    INTERVALO_MIN_SYNC_SEGUNDOS. Na primeira vez (ou se o token expirar) faz a carga completa.
+    """
+    service = obter_servico()
+    if not service:
+        return False
+
+    with _sync_lock:
+        if not forcar and _sincronizacao_recente():
+            return True
+        try:
+            sync_token = db_obter_sync_token(CALENDAR_ID)
+            try:
+                sucesso = _executar_sincronizacao(sync_token, sync_token)
+            except HttpError as e:
+                # 410 GONE: o token não vale mais, o Google exige uma nova carga completa
+                if sync_token and e.resp.status == 410:
+                    print("Info: syncToken da agenda expirou. Refazendo a sincronização completa...")
+                    sucesso = _executar_sincronizacao(None, sync_token)
+                else:
+                    raise
+            if sucesso:
+                _registrar_sincronizacao()
+            return sucesso
+        except Exception as e:
+            print(f"Erro ao sincronizar o índice local da agenda: {e}")
+            return False
+
+# ==============================================================================
+# --- (NOVO) MOTOR DE DISPONIBILIDADE (FREEBUSY, VÁRIAS AGENDAS) ---
+# ==============================================================================
+# Uma única chamada ao freebusy.query cobre até 50 agendas e toda a janela pedida.
+# Os intervalos ocupados de todas elas são unidos localmente e viram dias ocupados.
+
+_cache_freebusy = {}
+_cache_freebusy_lock = threading.Lock()
+
+def _dividir_janela(inicio: datetime, fim: datetime):
+    """Quebra [inicio, fim) em partes de no máximo JANELA_MAX_FREEBUSY."""
+    partes = []
+    while inicio < fim:
+        parte_fim = min(inicio + JANELA_MAX_FREEBUSY, fim)
+        partes.append((inicio, parte_fim))
+        inicio = parte_fim
+    return partes
+
+def _corpo_freebusy(lote: list, inicio: datetime, fim: datetime) -> dict:
+    """Corpo do freebusy.query para um lote de até 50 agendas."""
+    return {
+        'timeMin': inicio.isoformat(),
+        'timeMax': fim.isoformat(),
+        'timeZone': 'America/Sao_Paulo',
+        'items': [{'id': calendario_id} for calendario_id in lote]
+    }
+
+def _intervalos_da_resposta(resposta: dict) -> list:
+    """Extrai os intervalos ocupados (datetimes) de uma resposta do freeBusy."""
+    intervalos = []
+    for calendario_id, dados in resposta.get('calendars', {}).items():
+        for erro in dados.get('errors', []):
+            print(f"AVISO: freeBusy não conseguiu ler a agenda {calendario_id}: {erro.get('reason')}")
+        for ocupado in dados.get('busy', []):
+            intervalos.append((
+                datetime.fromisoformat(ocupado['start'].replace('Z', '+00:00')),
+                datetime.fromisoformat(ocupado['end'].replace('Z', '+00:00'))
+            ))
+    return intervalos
+
+def _consultar_freebusy(calendarios: list, inicio: datetime, fim: datetime) -> list:
+    """Faz o freebusy.query (em lotes de 50 agendas) e retorna todos os intervalos ocupados."""
+    intervalos = []
+    for i in range(0, len(calendarios), MAX_CALENDARIOS_FREEBUSY):
+        lote = calendarios[i:i + MAX_CALENDARIOS_FREEBUSY]
+        resposta = executar(obter_servico().freebusy().query(
+            body=_corpo_freebusy(lote, inicio, fim),
+            fields='calendars(busy,errors)'
+        ))
+        intervalos.extend(_intervalos_da_resposta(resposta))
+    return intervalos
+
+def _unir_intervalos(intervalos: list) -> list:
+    """Ordena e junta intervalos que se sobrepõem ou se encostam."""
+    unidos = []
+    for inicio, fim in sorted(intervalos):
+        if unidos and inicio <= unidos[-1][1]:
+            unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fim))
+        else:
+            unidos.append((inicio, fim))
+    return unidos
 
+def _dias_dos_intervalos(intervalos: list) -> set:
+    """Converte intervalos ocupados em datas (ISO) no fuso da agenda; o fim é exclusivo."""
+    dias = set()
+    for inicio, fim in intervalos:
+        dia = inicio.astimezone(FUSO_AGENDA).date()
+        ultimo_dia = (fim.astimezone(FUSO_AGENDA) - timedelta(microseconds=1)).date()
+        while dia <= ultimo_dia:
+            dias.add(dia.isoformat())
+            dia += timedelta(days=1)
+    return dias
+
+def _chave_freebusy(calendarios: list, data_inicio: date, data_fim: date):
+    """Chave do cache do freeBusy (a ordem das agendas não importa)."""
+    return (tuple(sorted(calendarios)), data_inicio, data_fim)
+
+def _ler_cache_freebusy(chave):
+    """Intervalos em cache para a chave, ou None se ausentes/vencidos."""
+    with _cache_freebusy_lock:
+        em_cache = _cache_freebusy.get(chave)
+        if em_cache and time_mod.monotonic() - em_cache[0] < VALIDADE_CACHE_FREEBUSY_SEGUNDOS:
+            return em_cache[1]
+    return None
+
+def _gravar_cache_freebusy(chave, unidos: list):
+    """Guarda no cache os intervalos já unidos de uma consulta."""
+    with _cache_freebusy_lock:
+        _cache_freebusy[chave] = (time_mod.monotonic(), unidos)
+
+def _partes_da_janela(data_inicio: date, data_fim: date) -> list:
+    """Janela [data_inicio, data_fim] (dias inteiros no fuso da agenda), já dividida em partes."""
+    inicio = datetime.combine(data_inicio, time.min, FUSO_AGENDA)
+    fim = datetime.combine(data_fim + timedelta(days=1), time.min, FUSO_AGENDA)
+    return _dividir_janela(inicio, fim)
+
+def intervalos_ocupados(calendarios: list, data_inicio: date, data_fim: date) -> list:
+    """
+    Intervalos ocupados (já unidos) de todas as 'calendarios' entre 'data_inicio' e
+    'data_fim' (inclusive). Resultados ficam em cache por VALIDADE_CACHE_FREEBUSY_SEGUNDOS.
+    """
+    service = obter_servico()
+    if not service or not calendarios:
+        return []
+
+    chave = _chave_freebusy(calendarios, data_inicio, data_fim)
+    em_cache = _ler_cache_freebusy(chave)
+    if em_cache is not None:
+        return em_cache
+
+    partes = _partes_da_janela(data_inicio, data_fim)
+    if len(partes) == 1:
+        intervalos = _consultar_freebusy(list(chave[0]), *partes[0])
+    else:
+        # Janela dividida: as partes são consultadas em paralelo
+        with ThreadPoolExecutor(max_workers=len(partes)) as pool:
+            resultados = pool.map(lambda parte: _consultar_freebusy(list(chave[0]), *parte), partes)
+            intervalos = [intervalo for resultado in resultados for intervalo in resultado]
+    unidos = _unir_intervalos(intervalos)
+    _gravar_cache_freebusy(chave, unidos)
+    return unidos
+
+def dias_ocupados_nos_calendarios(data_inicio: date, data_fim: date, calendarios: list = None) -> set:
+    """Datas (ISO) com qualquer intervalo ocupado nas agendas de equipamentos/equipes."""
+    if calendarios is None:
+        calendarios = CALENDARIOS_EQUIPAMENTOS
     try:
-        # 'created' é fornecido pela API do Google em formato UTC (com 'Z')
-        created_str = evento['created'] # Ex: '2025-10-30T18:16:23.000Z'
-        created_time_utc = datetime.fromisoformat(created_str.replace('Z', '+00:00'))
-        
-        # Pega o tempo atual em UTC
-        agora_utc = datetime.now(timezone.utc)
-        
-        # Verifica se já passaram 24 horas
-        is_expired = (agora_utc - created_time_utc) > timedelta(hours=24)
-        
-        if is_expired:
-            print(f"Info: Evento {evento['id']} é PENDENTE e EXPIRADO.")
-            
-        return is_expired
+        return _dias_dos_intervalos(intervalos_ocupados(calendarios, data_inicio, data_fim))
     except Exception as e:
-        print(f"Erro ao verificar tempo de evento pendente {evento['id']}: {e}")
-        return False # Em caso de dúvida, não expira
+        print(f"Erro ao consultar freeBusy das agendas de equipamentos: {e}")
+        raise # Sem resposta do Google, não dá pra garantir que o dia está livre
 
-# --- FUNÇÃO ATUALIZADA (LÓGICA PRINCIPAL) ---
-def verificar_dias_disponiveis(ano: int, mes: int):
+def _limpar_cache_freebusy():
+    """Descarta o cache do freeBusy (depois de gravar algo numa das agendas)."""
+    with _cache_freebusy_lock:
+        _cache_freebusy.clear()
+
+def _is_dia_completamente_livre(dia: date) -> bool:
     """
-    Verifica todos os dias em um mês que estão COMPLETAMENTE livres.
-    (NOVO) Ignora eventos PENDENTES com mais de 24h.
+    Verificação final (sem cache) das agendas de equipamentos/equipes para o dia.
+    A agenda principal é decidida depois, pelo claim atômico no livro local.
     """
-    hoje = date.today()
-    dias_disponiveis = []
-    
-    # 1. Busca todos os eventos do mês de uma só vez
-    eventos_do_mes = obter_eventos_do_mes(ano, mes)
-    
-    # 2. Cria um conjunto com os dias que já estão ocupados
-    dias_ocupados = set()
-    for evento in eventos_do_mes:
-        
-        # (NOVO) Verifica se o evento está pendente e expirado
-        if _is_evento_pendente_expirado(evento):
-            print(f"Info: Ignorando evento pendente expirado {evento['id']} ao listar dias.")
-            # NÃO adiciona a dias_ocupados. O dia é considerado "disponível".
-            continue 
-            
-        # Lógica antiga (agora só roda para eventos confirmados ou pendentes válidos)
-        start_str = evento['start'].get('dateTime', evento['start'].get('date'))
-        dia_evento = date.fromisoformat(start_str.split('T')[0])
-        
-        if dia_evento.month == mes and dia_evento.year == ano:
-            dias_ocupados.add(dia_evento.day)
-        
-    num_dias_mes = calendar.monthrange(ano, mes)[1]
-    
-    # 3. Itera pelos dias do mês, verificando se estão na lista de ocupados
-    for dia_num in range(1, num_dias_mes + 1):
-        dia_atual = date(ano, mes, dia_num)
-        
-        if dia_atual < hoje:
-            continue
-            
-        if dia_num not in dias_ocupados:
-            dias_disponiveis.append(dia_num)
-            
-    return dias_disponiveis
+    if not CALENDARIOS_EQUIPAMENTOS:
+        return True
+    _limpar_cache_freebusy() # Na hora de reservar, a resposta tem que ser fresca
+    return dia.isoformat() not in dias_ocupados_nos_calendarios(dia, dia)
 
-# --- FUNÇÃO ATUALIZADA (SIMPLIFICADA) ---
-def verificar_horarios_disponiveis(dia: date):
+# --- (NOVO) MAPA DE DISPONIBILIDADE DE VÁRIOS MESES NUMA SÓ CONSULTA ---
+def mapa_disponibilidade(data_inicio: date, data_fim: date, itens: dict = None, ignorar_id: str = None) -> dict:
     """
-    Retorna a lista de horários padrão, pois o dia já foi verificado como livre.
-    Filtra horários que já passaram se o dia for hoje.
+    Consulta a janela inteira de uma vez (índice local + um freeBusy) e retorna
+    {'AAAA-MM': '0110...'}, com um caractere por dia do mês: '1' = livre, '0' = ocupado.
+    (NOVO) Com 'itens' ({nome: quantidade}), o dia é livre se o carrinho couber no
+    estoque; 'ignorar_id' desconta a própria reserva (remarcação). Sem 'itens',
+    qualquer evento ocupa o dia inteiro.
+    Dias já passados contam como ocupados. Levanta exceção se o freeBusy falhar.
     """
     hoje = date.today()
-    agora = datetime.now()
 
-    if dia == hoje:
-        return ["08:00", "17:00"] 
+    # 1. Traz só o delta da agenda (no máximo uma vez a cada INTERVALO_MIN_SYNC_SEGUNDOS)
+    sincronizar_indice_agenda()
+
+    # 2. Dias ocupados de toda a janela: índice (confirmados ou pendentes válidos) + freeBusy
+    if itens is None:
+        dias_ocupados = db_dias_ocupados_no_periodo(data_inicio.isoformat(), data_fim.isoformat(), _limite_pendente_utc())
     else:
-        return ["08:00", "17:00"]
+        dias_bloqueados, ocupacoes = db_ocupacao_no_periodo(
+            data_inicio.isoformat(), data_fim.isoformat(), itens, _limite_pendente_utc(), ignorar_id
+        )
+        dias = [data_inicio + timedelta(days=n) for n in range((data_fim - data_inicio).days + 1)]
+        dias_ocupados = {dia.isoformat() for dia in dias} - dias_que_cabem(itens, ocupacoes, dias)
+        dias_ocupados |= dias_bloqueados
+    dias_ocupados |= dias_ocupados_nos_calendarios(data_inicio, data_fim)
+
+    # 3. Monta o bitmap de cada mês
+    mapa = {}
+    mes_atual = data_inicio.replace(day=1)
+    while mes_atual <= data_fim:
+        num_dias_mes = calendar.monthrange(mes_atual.year, mes_atual.month)[1]
+        bits = []
+        for dia_num in range(1, num_dias_mes + 1):
+            dia_atual = mes_atual.replace(day=dia_num)
+            livre = data_inicio <= dia_atual <= data_fim and dia_atual >= hoje and dia_atual.isoformat() not in dias_ocupados
+            bits.append('1' if livre else '0')
+        mapa[mes_atual.strftime('%Y-%m')] = ''.join(bits)
+        mes_atual += relativedelta(months=1)
+    return mapa
 
+def dias_livres_do_mapa(bitmap: str) -> list:
+    """Converte o bitmap de um mês na lista de dias livres (números do dia)."""
+    return [dia_num for dia_num, bit in enumerate(bitmap, start=1) if bit == '1']
 
-# --- (FUNÇÃO ATUALIZADA) VERIFICAR SE O DIA ESTÁ 100% LIVRE ---
-def _is_dia_completamente_livre(dia: date):
+# --- FUNÇÃO ATUALIZADA (LÓGICA PRINCIPAL) ---
+def verificar_dias_disponiveis(ano: int, mes: int, itens: dict = None, ignorar_id: str = None):
     """
-    Função auxiliar interna.
-    Retorna True se o dia estiver livre.
-    Retorna False se tiver eventos (CONFIRMADOS ou PENDENTES VÁLIDOS).
-    (NOVO) Deleta eventos PENDENTES EXPIRADOS que encontrar.
+    Verifica todos os dias em um mês que estão livres (ou, com 'itens', em que o carrinho cabe).
+    (NOVO) Consulta o índice local (sincronizado de forma incremental), não a API.
+    As agendas de equipamentos/equipes entram com um único freeBusy para o mês.
+    Ignora eventos PENDENTES com mais de 24h.
     """
-    if not service:
-        # Se o serviço falhar, assume que não está livre para segurança
-        return False
+    num_dias_mes = calendar.monthrange(ano, mes)[1]
     try:
-        start_time_check = datetime.combine(dia, time.min).isoformat() + 'Z'
-        end_time_check = datetime.combine(dia, time.max).isoformat() + 'Z'
-        
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=start_time_check,
-            timeMax=end_time_check,
-            singleEvents=True
-        ).execute()
-        
-        eventos_do_dia = events_result.get('items', [])
-        
-        if not eventos_do_dia:
-            return True # Dia 100% livre, sem eventos.
+        mapa = mapa_disponibilidade(date(ano, mes, 1), date(ano, mes, num_dias_mes), itens, ignorar_id)
+    except Exception:
+        return []
+    return dias_livres_do_mapa(mapa[f"{ano}-{mes:02d}"])
+
+# --- FUNÇÃO ATUALIZADA (PLANEJADOR DE ENTREGAS) ---
+def verificar_horarios_disponiveis(dia: date, distancia_km: float = None, ignorar_id: str = None):
+    """
+    (NOVO) Retorna os horários de chegada ('HH:MM') em que há veículo e equipe para
+    entregar e recolher, considerando a viagem até o endereço ('distancia_km', só ida)
+    e as outras festas do dia. 'ignorar_id' desconta a própria reserva (remarcação).
+    Se o dia for hoje, só entram horários com tempo para a equipe sair.
+    """
+    try:
+        tarefas = db_tarefas_logisticas(dia.isoformat(), _limite_pendente_utc(), ignorar_id)
+    except Exception:
+        return []
+    return horarios_livres(dia, distancia_km, tarefas)
+
+
+# ==============================================================================
+# --- (NOVO) ESPELHO ASSÍNCRONO NA AGENDA GOOGLE ---
+# ==============================================================================
+# A reserva é decidida no livro local (database.reservas). Cada mudança no livro grava,
+# na mesma transação, a escrita a fazer na Agenda (tabela espelho_agenda). Uma thread de
+# fundo esvazia essa fila na partida, quando é acordada e periodicamente; a operação só
+# sai da fila depois que a API aceitou (um processo reiniciado não perde nada).
+
+INTERVALO_ESPELHO_SEGUNDOS = 30 # Varredura periódica da fila (erros esperando nova tentativa)
+PRAZO_OPERACAO_ESPELHO_SEGUNDOS = 120 # Operação pega por um processo fica reservada por esse tempo
+ESPERA_MAXIMA_ESPELHO_SEGUNDOS = 15 * 60
+_espelho_acordado = threading.Event()
+_espelho_lock = threading.Lock()
+_espelho_thread = None
+
+def _executar_operacao_espelho(operacao: str, event_id: str):
+    funcoes = {
+        'inserir': _inserir_evento_na_agenda,
+        'remarcar': _remarcar_evento_na_agenda,
+        'confirmar': _confirmar_evento_na_agenda,
+        'deletar': _deletar_evento_na_agenda,
+    }
+    funcoes[operacao](event_id)
+
+def _adiar_operacao(op_id: int, operacao: str, event_id: str, tentativas: int, erro):
+    espera = min(ESPERA_MAXIMA_ESPELHO_SEGUNDOS, 2 ** tentativas)
+    print(f"Erro no espelho da agenda ({operacao} {event_id}), tentativa {tentativas + 1}. Nova tentativa em {espera}s: {erro}")
+    db_adiar_operacao_espelho(op_id, espera, str(erro))
 
-        eventos_validos_encontrados = 0
-        ids_para_deletar = []
+def _deletar_eventos_em_lote(operacoes: list) -> int:
+    """Remoções da fila em requisições batch (a limpeza de expirados gera muitas de uma vez)."""
+    service = obter_servico()
+    por_id = {str(op[0]): op for op in operacoes}
+    concluidas = []
+    respondidas = set()
 
-        for evento in eventos_do_dia:
-            if _is_evento_pendente_expirado(evento):
-                # Este evento não conta como "ocupado" e deve ser deletado
-                ids_para_deletar.append(evento['id'])
+    def _callback(request_id, response, exception):
+        op_id, operacao, event_id, tentativas = por_id[request_id]
+        respondidas.add(op_id)
+        # 404/410: nunca chegou à Agenda ou já foi apagado
+        if exception is None or (isinstance(exception, HttpError) and exception.resp.status in (404, 410)):
+            concluidas.append(op_id)
+            _remover_do_indice_local(event_id)
+        else:
+            _adiar_operacao(op_id, operacao, event_id, tentativas, exception)
+
+    for i in range(0, len(operacoes), TAMANHO_LOTE_LIMPEZA):
+        parte = operacoes[i:i + TAMANHO_LOTE_LIMPEZA]
+        try:
+            lote = service.new_batch_http_request(callback=_callback)
+            for op_id, _, event_id, _ in parte:
+                lote.add(service.events().delete(calendarId=CALENDAR_ID, eventId=event_id, fields=''), request_id=str(op_id))
+            lote.execute()
+        except Exception as e:
+            for op_id, operacao, event_id, tentativas in parte:
+                if op_id not in respondidas:
+                    _adiar_operacao(op_id, operacao, event_id, tentativas, e)
+    db_concluir_operacoes_espelho(concluidas)
+    return len(concluidas)
+
+def processar_espelho_pendente() -> int:
+    """
+    Executa as escritas pendentes na Agenda (as que já podem rodar). Em caso de erro, a
+    operação volta para a fila com espera exponencial. Retorna quantas foram concluídas.
+    """
+    concluidas = 0
+    while True:
+        operacoes = db_reservar_operacoes_espelho(PRAZO_OPERACAO_ESPELHO_SEGUNDOS)
+        if not operacoes:
+            return concluidas
+        delecoes = [op for op in operacoes if op[1] == 'deletar']
+        if len(delecoes) > 1:
+            concluidas += _deletar_eventos_em_lote(delecoes)
+        for op_id, operacao, event_id, tentativas in operacoes:
+            if len(delecoes) > 1 and operacao == 'deletar':
+                continue
+            try:
+                _executar_operacao_espelho(operacao, event_id)
+            except Exception as e:
+                _adiar_operacao(op_id, operacao, event_id, tentativas, e)
             else:
-                # Este é um evento VÁLIDO (Confirmado ou Pendente dentro das 24h)
-                eventos_validos_encontrados += 1
-        
-        # (NOVO) Rotina de limpeza
-        if ids_para_deletar:
-            print(f"Limpando {len(ids_para_deletar)} reservas pendentes expiradas do dia {dia}...")
-            for event_id in ids_para_deletar:
-                # Deleta da Agenda E do DB
-                cancelar_evento_expirado(event_id) 
-
-        # O dia está livre SOMENTE se não houver eventos válidos
-        return eventos_validos_encontrados == 0
-        
-    except Exception as e:
-        print(f"Erro ao verificar dia livre ({dia}): {e}")
-        return False # Segurança: assume que está ocupado
+                db_concluir_operacoes_espelho([op_id])
+                concluidas += 1
+
+def _worker_espelho():
+    while True:
+        _espelho_acordado.wait(INTERVALO_ESPELHO_SEGUNDOS)
+        _espelho_acordado.clear()
+        try:
+            processar_espelho_pendente()
+        except Exception as e:
+            print(f"Erro ao processar a fila do espelho da agenda: {e}")
+
+def iniciar_espelho():
+    """Inicia (uma única vez por processo) a thread do espelho; a fila é esvaziada logo na partida."""
+    global _espelho_thread
+    with _espelho_lock:
+        if _espelho_thread is None:
+            _espelho_thread = threading.Thread(target=_worker_espelho, daemon=True)
+            _espelho_thread.start()
+    _espelho_acordado.set()
+
+def _acordar_espelho():
+    """Avisa a thread do espelho que o livro gravou uma nova operação."""
+    iniciar_espelho()
+
+def _confirmacao_do_evento(event_id: str, summary: str, propriedades: dict = None) -> dict:
+    """Título sem '[PENDENTE]' e propriedades privadas com o status CONFIRMADO (e o ID da venda)."""
+    propriedades = dict(propriedades or {}, status='CONFIRMADO')
+    venda_id = buscar_id_venda_por_id_google(event_id)
+    if venda_id is not None:
+        propriedades['venda_id'] = str(venda_id)
+    return {
+        'summary': summary.replace("[PENDENTE] ", ""),
+        'extendedProperties': {'private': propriedades}
+    }
+
+def _inserir_evento_na_agenda(event_id: str):
+    """(ESPELHO) Grava na Agenda um evento já reservado no livro local."""
+    reserva = db_reserva_para_espelho(event_id)
+    if reserva is None or reserva[0] not in ('PENDENTE', 'CONFIRMADO'):
+        print(f"Info: Reserva {event_id} foi cancelada antes de chegar à Agenda. Ignorando.")
+        return
+    status, corpo_evento, _, _, sincronizado = reserva
+    if sincronizado or corpo_evento is None:
+        return # Já gravado por uma tentativa anterior
+    evento = json.loads(corpo_evento)
+    if status == 'CONFIRMADO':
+        # Pago antes de chegar à Agenda: o evento já entra confirmado
+        propriedades = evento.get('extendedProperties', {}).get('private', {})
+        evento = dict(evento, **_confirmacao_do_evento(evento['id'], evento.get('summary', ''), propriedades))
+    try:
+        evento_criado = executar(obter_servico().events().insert(calendarId=CALENDAR_ID, body=evento, fields=CAMPOS_EVENTO))
+        _atualizar_indice_local(evento_criado)
+    except HttpError as e:
+        # 409: o ID já existe (uma tentativa anterior gravou, mas a resposta se perdeu)
+        if e.resp.status != 409:
+            raise
+        print(f"Info: Evento {evento['id']} já estava na Agenda.")
+    db_marcar_reserva_sincronizada(evento['id'])
+
+def _remarcar_evento_na_agenda(event_id: str):
+    """(ESPELHO) Move na Agenda um evento já remarcado no livro local (para a data atual do livro)."""
+    reserva = db_reserva_para_espelho(event_id)
+    if reserva is None or reserva[0] not in ('PENDENTE', 'CONFIRMADO'):
+        return # Cancelado/expirado: a remoção vem em seguida na fila
+    novo_dia = date.fromisoformat(reserva[2])
+    novo_horario_str = reserva[3]
+
+    # 1. Calcula os novos horários
+    hora, minuto = map(int, novo_horario_str.split(':'))
+    new_start_time = datetime.combine(novo_dia, time(hora, minuto))
+    new_end_time = new_start_time + timedelta(hours=4) # Mantém 4h de duração
+    
+    # 2. Envia só as novas datas (patch dispensa buscar o evento inteiro antes)
+    try:
+        evento_atualizado = executar(obter_servico().events().patch(
+            calendarId=CALENDAR_ID,
+            eventId=event_id,
+            body={
+                'start': {'dateTime': new_start_time.isoformat(), 'timeZone': 'America/Sao_Paulo'},
+                'end': {'dateTime': new_end_time.isoformat(), 'timeZone': 'America/Sao_Paulo'}
+            },
+            fields=CAMPOS_EVENTO
+        ))
+    except HttpError as e:
+        # Apagado da Agenda por fora: repetir não adianta
+        if e.resp.status not in (404, 410):
+            raise
+        print(f"ATENÇÃO: Evento {event_id} não existe mais na Agenda; remarcação feita só no livro.")
+        return
+    _atualizar_indice_local(evento_atualizado)
+    print(f"SUCESSO: Evento {event_id} remarcado na Agenda para {novo_dia} às {novo_horario_str}.")
+
+def _confirmar_evento_na_agenda(event_id: str):
+    """(ESPELHO) Marca na Agenda como CONFIRMADO um evento já pago no livro local."""
+    service = obter_servico()
+    try:
+        evento = executar(service.events().get(calendarId=CALENDAR_ID, eventId=event_id, fields='summary'))
+    except HttpError as e:
+        # Apagado da Agenda por fora: repetir não adianta
+        if e.resp.status not in (404, 410):
+            raise
+        print(f"ATENÇÃO: Evento {event_id} não existe mais na Agenda; confirmação feita só no livro.")
+        return
+
+    # patch: as demais propriedades privadas são mantidas
+    evento_atualizado = executar(service.events().patch(
+        calendarId=CALENDAR_ID,
+        eventId=event_id,
+        body=_confirmacao_do_evento(event_id, evento.get('summary', '')),
+        fields=CAMPOS_EVENTO
+    ))
+    _atualizar_indice_local(evento_atualizado)
+    print(f"SUCESSO: Evento {event_id} confirmado na Agenda.")
+
+def _deletar_evento_na_agenda(event_id: str):
+    """(ESPELHO) Apaga da Agenda um evento já cancelado no livro local."""
+    try:
+        executar(obter_servico().events().delete(calendarId=CALENDAR_ID, eventId=event_id))
+    except HttpError as e:
+        # 404/410: nunca chegou à Agenda (a inserção é ignorada) ou já foi apagado
+        if e.resp.status not in (404, 410):
+            raise
+    _remover_do_indice_local(event_id) # Uma sincronização pode ter trazido o evento de volta
+    print(f"SUCESSO: Evento {event_id} removido da Agenda.")
 
 
 # --- FUNÇÃO ATUALIZADA (Recebe CPF e NOVO status_pagamento) ---
-def marcar_horario(dia: date, horario_str: str, nome_cliente: str, cpf_cliente: str, itens_pedido_formatado: str, endereco_evento: str, valor_total: float, status_pagamento: str = 'CONFIRMADO'):
-    """Cria um novo evento (PENDENTE ou CONFIRMADO), fazendo verificação final."""
+def marcar_horario(dia: date, horario_str: str, nome_cliente: str, cpf_cliente: str, itens_pedido_formatado: str, endereco_evento: str, valor_total: float, status_pagamento: str = 'CONFIRMADO', chat_id: str = None, itens: dict = None, distancia_km: float = None):
+    """
+    Cria um novo evento (PENDENTE ou CONFIRMADO).
+    (NOVO) Os itens ({nome: quantidade}) são reservados atomicamente no livro local;
+    sem itens, a reserva ocupa o dia inteiro. A gravação na Agenda vira um espelho
+    assíncrono. O ID do evento é gerado aqui mesmo.
+    """
+    service = obter_servico()
     if not service:
         return False, None # Retorna (Falha, None)
 
     try:
-        # --- VERIFICAÇÃO FINAL (agora limpa pendentes expirados) ---
-        # Antes de marcar, verifica se o dia AINDA está 100% livre
-        if not _is_dia_completamente_livre(dia):
-            print(f"RACE CONDITION: Tentativa de marcar no dia {dia}, que está ocupado por evento válido.")
-            return False, None # Retorna (Falha, None)
-        # --- FIM DA VERIFICAÇÃO ---
+        # IDs da Agenda aceitam base32hex (0-9, a-v): um UUID em hex é válido
+        event_id = uuid.uuid4().hex
 
         hora, minuto = map(int, horario_str.split(':'))
         start_time = datetime.combine(dia, time(hora, minuto))
         end_time = start_time + timedelta(hours=4) # Duração de 4 horas
         
-        # (NOVO) Define o título e a chave de status
-        status_key = ""
+        # (NOVO) Define o título (o status vai nas extendedProperties)
         summary = ""
         if status_pagamento == 'PENDENTE':
             summary = f"[PENDENTE] 🎉 Aluguel para {nome_cliente} - R$ {valor_total:,.2f}"
-            status_key = "STATUS_KEY::PENDENTE::END_STATUS"
         else:
             summary = f"🎉 Aluguel para {nome_cliente} - R$ {valor_total:,.2f}"
-            status_key = "STATUS_KEY::CONFIRMADO::END_STATUS"
         
         description = (
             f"<b>Cliente:</b> {nome_cliente}\n"
@@ -227,23 +763,42 @@ def marcar_horario(dia: date, horario_str: str, nome_cliente: str, cpf_cliente:
             f"<b>Endereço do Evento:</b>\n{endereco_evento}\n\n"
             f"<b>Itens Reservados:</b>\n{itens_pedido_formatado}\n\n" 
             f"<b>Valor Total do Pedido:</b> R$ {valor_total:,.2f}\n\n"
-            f"<i>Agendamento realizado via Chatbot.</i>\n\n"
-            f"\n"
-            f"CPF_KEY::{cpf_cliente}::END_CPF\n"
-            f"{status_key}" # <-- (NOVO) Adiciona a chave de status
+            f"<i>Agendamento realizado via Chatbot.</i>"
         )
 
+        # (NOVO) Chaves de busca como propriedades privadas (filtráveis no servidor)
+        propriedades = {'cpf': cpf_cliente, 'status': status_pagamento}
+        if chat_id:
+            propriedades['chat_id'] = str(chat_id)
+
         evento = {
+            'id': event_id,
             'summary': summary,
             'description': description,
             'start': {'dateTime': start_time.isoformat(), 'timeZone': 'America/Sao_Paulo'},
             'end': {'dateTime': end_time.isoformat(), 'timeZone': 'America/Sao_Paulo'},
+            'extendedProperties': {'private': propriedades},
         }
 
-        evento_criado = service.events().insert(calendarId=CALENDAR_ID, body=evento).execute()
+        # --- VERIFICAÇÃO FINAL (claim atômico no livro local) ---
+        sincronizar_indice_agenda() # Traz o delta de eventos marcados fora do bot
+        if not _is_dia_completamente_livre(dia):
+            print(f"Dia {dia} ocupado numa agenda de equipamentos/equipe.")
+            return False, None
+        sucesso, _ = db_reservar_dia(
+            event_id, dia.isoformat(), horario_str, status_pagamento,
+            json.dumps(evento, ensure_ascii=False), _limite_pendente_utc(), itens, distancia_km
+        )
+        if not sucesso:
+            print(f"RACE CONDITION: Tentativa de marcar no dia {dia}, sem estoque, sem equipe livre ou ocupado por evento válido.")
+            return False, None # Retorna (Falha, None)
+        # --- FIM DA VERIFICAÇÃO ---
+
+        # (Pendentes expirados que liberaram a vaga ficam para a limpeza periódica)
+        _acordar_espelho()
         
         # Retorna Sucesso E o ID do evento
-        return True, evento_criado.get('id') 
+        return True, event_id
         
     except Exception as e:
         print(f"Erro ao marcar horário na agenda: {e}")
@@ -251,36 +806,33 @@ def marcar_horario(dia: date, horario_str: str, nome_cliente: str, cpf_cliente:
 
 # --- (FUNÇÃO ATUALIZADA) BUSCAR RESERVA(S) POR CPF ---
 def buscar_eventos_por_cpf(cpf: str):
-    """Busca *todos* os eventos FUTUROS (pendentes ou confirmados) que contenham a chave de CPF."""
+    """
+    Busca *todos* os eventos FUTUROS (pendentes ou confirmados) de um CPF.
+    (NOVO) O filtro é feito no servidor, pela propriedade privada 'cpf'.
+    """
+    service = obter_servico()
     if not service:
         return [] 
     try:
-        chave_busca = f"CPF_KEY::{cpf}::END_CPF"
         time_min = datetime.now().isoformat() + 'Z' 
 
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
+        items = list(listar_eventos(
+            service,
+            CALENDAR_ID,
             timeMin=time_min,
-            q=chave_busca, 
+            privateExtendedProperty=f"cpf={cpf}",
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
-        
-        items = events_result.get('items', [])
-        eventos_encontrados = [] 
-        
+        ))
         if not items:
             return [] 
-            
-        for item in items:
-            # (NOVO) Ignora eventos expirados que ainda não foram limpos
-            if _is_evento_pendente_expirado(item):
-                continue
-                
-            if chave_busca in item.get('description', ''):
-                eventos_encontrados.append(item) 
         
-        return eventos_encontrados 
+        # (NOVO) O índice local serve de cache dos eventos guardados no estado da conversa (só os ids)
+        _atualizar_indice_com_eventos(items)
+
+        # (NOVO) Expirados que a limpeza periódica ainda não removeu (consulta indexada)
+        ids_expirados = set(db_buscar_pendentes_expirados(_limite_pendente_utc()))
+        return [item for item in items if item['id'] not in ids_expirados]
         
     except Exception as e:
         print(f"Erro ao buscar eventos por CPF ({cpf}): {e}")
@@ -288,114 +840,101 @@ def buscar_eventos_por_cpf(cpf: str):
 
 # --- (FUNÇÃO DE CANCELAMENTO DO USUÁRIO) ---
 def cancelar_evento(event_id: str):
-    """Cancela (deleta) um evento da agenda e atualiza o DB para 'CANCELADO'."""
-    if not service:
-        return False
+    """
+    Cancela um evento e atualiza o DB para 'CANCELADO'.
+    (NOVO) Livro, venda e índice local são cancelados na hora, numa transação;
+    a remoção da Agenda vai para o espelho (vale também se o evento ainda não chegou lá).
+    """
     try:
-        # 1. Deleta da Agenda
-        service.events().delete(
-            calendarId=CALENDAR_ID,
-            eventId=event_id
-        ).execute()
-        
-        # 2. Atualiza o DB (marca como cancelado e zera valores)
-        cancelar_venda_por_id(event_id)
-        
+        if not db_cancelar_reserva(event_id):
+            return False
+        _acordar_espelho()
         return True
     except Exception as e:
         print(f"Erro ao cancelar evento ({event_id}): {e}")
         return False
 
 # --- (NOVA FUNÇÃO) PARA LIMPEZA AUTOMÁTICA ---
-def cancelar_evento_expirado(event_id: str):
-    """(AUTO) Deleta evento da Agenda e DELETA do DB."""
-    if not service:
-        return False
-    try:
-        # 1. Deleta da Agenda Google
-        service.events().delete(
-            calendarId=CALENDAR_ID,
-            eventId=event_id
-        ).execute()
-        print(f"SUCESSO: Evento expirado {event_id} deletado da Agenda.")
-        
-        # 2. Deleta do Banco de Dados
-        deletar_venda_por_id_google(event_id)
-        
-        return True
-    except Exception as e:
-        # Se falhar (ex: já foi deletado), apenas loga
-        print(f"Info: Erro ao deletar evento expirado {event_id} (pode já ter sido limpo): {e}")
-        return False
+def limpar_reservas_expiradas():
+    """
+    (AUTO) Remove do DB, numa transação, todas as reservas PENDENTES com mais de 24h
+    (vendas, reservas e índice) e põe a remoção dos eventos na fila do espelho, que
+    apaga da Agenda em requisições batch. Retorna quantas reservas foram limpas.
+    """
+    ids_removidos = db_remover_reservas_expiradas(_limite_pendente_utc())
+    if ids_removidos:
+        print(f"Limpando {len(ids_removidos)} reservas pendentes expiradas...")
+        _acordar_espelho()
+    return len(ids_removidos)
+
+_limpeza_thread = None
+
+def iniciar_limpeza_periodica(intervalo_segundos: int = INTERVALO_LIMPEZA_SEGUNDOS):
+    """Inicia (uma única vez por processo) a thread que roda a limpeza de expirados periodicamente."""
+    global _limpeza_thread
+    if _limpeza_thread is not None:
+        return
+
+    def _loop():
+        while True:
+            try:
+                limpar_reservas_expiradas()
+            except Exception as e:
+                print(f"Erro na limpeza periódica de reservas expiradas: {e}")
+            time_mod.sleep(intervalo_segundos)
+
+    _limpeza_thread = threading.Thread(target=_loop, daemon=True)
+    _limpeza_thread.start()
+    print(f"Limpeza periódica de reservas expiradas iniciada (a cada {intervalo_segundos}s).")
 
 # --- (NOVA FUNÇÃO) PARA CONFIRMAR PAGAMENTO ---
 def confirmar_pagamento_evento(event_id: str):
-    """Atualiza um evento de PENDENTE para CONFIRMADO no Google Calendar."""
-    if not service:
-        return False
+    """
+    Atualiza um evento de PENDENTE para CONFIRMADO.
+    (NOVO) Confirma primeiro no DB (livro, venda e índice), sem depender da Agenda: uma
+    reserva paga nunca fica PENDENTE para a limpeza de expirados. O evento na Agenda é
+    atualizado pelo espelho, depois da inserção (a fila mantém a ordem de cada evento).
+    Retorna 'CONFIRMADO', 'ESTORNAR' (pago depois de expirar, sem vaga no dia) ou None (erro).
+    """
     try:
-        # 1. Busca o evento pendente
-        evento = service.events().get(
-            calendarId=CALENDAR_ID,
-            eventId=event_id
-        ).execute()
-        
-        # 2. Atualiza o Título e a Descrição
-        evento['summary'] = evento.get('summary', '').replace("[PENDENTE] ", "")
-        
-        desc = evento.get('description', '')
-        desc = desc.replace("STATUS_KEY::PENDENTE::END_STATUS", "STATUS_KEY::CONFIRMADO::END_STATUS")
-        evento['description'] = desc
-        
-        # 3. Envia a atualização
-        service.events().update(
-            calendarId=CALENDAR_ID,
-            eventId=event_id,
-            body=evento
-        ).execute()
-        
-        print(f"SUCESSO: Evento {event_id} confirmado na Agenda.")
-        return True
+        resultado = db_confirmar_reserva(event_id, _limite_pendente_utc())
+        if resultado is None:
+            print(f"ERRO: Reserva {event_id} não existe mais no DB para ser confirmada.")
+            return None
+        if resultado == 'CONFIRMADO':
+            _acordar_espelho()
+            print(f"SUCESSO: Reserva {event_id} confirmada (a Agenda é atualizada em segundo plano).")
+        return resultado
         
     except Exception as e:
-        print(f"ERRO ao confirmar pagamento do evento {event_id} na Agenda: {e}")
-        return False
+        print(f"ERRO ao confirmar pagamento do evento {event_id}: {e}")
+        return None
 
 # --- (FUNÇÃO EXISTENTE) REMARCAR EVENTO ---
 def remarcar_evento(event_id: str, novo_dia: date, novo_horario_str: str):
     """
     Atualiza a data e hora de um evento existente.
-    Primeiro, verifica se o NOVO dia está livre (e limpa expirados).
+    (NOVO) O novo dia é reservado atomicamente no livro local; a Agenda é
+    atualizada em segundo plano pelo espelho.
     """
+    service = obter_servico()
     if not service:
         return False
     try:
-        # 1. Verifica se o NOVO dia está 100% livre (agora limpa expirados)
+        # 1. Move a reserva no livro local (falha se o NOVO dia não estiver livre)
+        sincronizar_indice_agenda()
         if not _is_dia_completamente_livre(novo_dia):
-            print(f"REMARCAÇÃO FALHOU: O novo dia {novo_dia} não está livre.")
+            print(f"REMARCAÇÃO FALHOU: O novo dia {novo_dia} está ocupado numa agenda de equipamentos/equipe.")
+            return False
+        sucesso, _ = db_remarcar_reserva( # Expirados liberados ficam para a limpeza periódica
+            event_id, novo_dia.isoformat(), novo_horario_str, _limite_pendente_utc()
+        )
+        if not sucesso:
+            print(f"REMARCAÇÃO FALHOU: Os itens não cabem no novo dia {novo_dia}.")
             return False
-            
-        # 2. Se estiver livre, busca o evento original para pegar os detalhes
-        evento_original = service.events().get(
-            calendarId=CALENDAR_ID,
-            eventId=event_id
-        ).execute()
-        
-        # 3. Calcula os novos horários
-        hora, minuto = map(int, novo_horario_str.split(':'))
-        new_start_time = datetime.combine(novo_dia, time(hora, minuto))
-        new_end_time = new_start_time + timedelta(hours=4) # Mantém 4h de duração
-        
-        # 4. Atualiza o corpo do evento com as novas datas
-        evento_original['start'] = {'dateTime': new_start_time.isoformat(), 'timeZone': 'America/Sao_Paulo'}
-        evento_original['end'] = {'dateTime': new_end_time.isoformat(), 'timeZone': 'America/Sao_Paulo'}
         
-        # 5. Envia a atualização
-        service.events().update(
-            calendarId=CALENDAR_ID,
-            eventId=event_id,
-            body=evento_original
-        ).execute()
+        # 2. Atualiza a Agenda em segundo plano
+        _acordar_espelho()
         
         return True
         
@@ -403,14 +942,70 @@ def remarcar_evento(event_id: str, novo_dia: date, novo_horario_str: str):
         print(f"Erro ao remarcar evento ({event_id}): {e}")
         return False
 
+# --- (NOVA FUNÇÃO) MIGRAÇÃO ÚNICA PARA EXTENDED PROPERTIES ---
+def _extrair_chave_descricao(descricao: str, inicio: str, fim: str):
+    """Extrai o valor entre as marcações antigas (ex: 'CPF_KEY::' e '::END_CPF')."""
+    if inicio not in descricao:
+        return None
+    return descricao.split(inicio, 1)[1].split(fim, 1)[0].strip()
+
+def migrar_eventos_para_extended_properties():
+    """
+    Copia o CPF e o status das chaves antigas na descrição (CPF_KEY::...::END_CPF e
+    STATUS_KEY::...::END_STATUS) para extendedProperties privadas, removendo as chaves.
+    Pode ser rodada mais de uma vez: eventos já migrados são ignorados.
+    Retorna quantos eventos foram migrados.
+    """
+    service = obter_servico()
+    if not service:
+        print("ERRO: Serviço do Google não iniciado. Migração não executada.")
+        return 0
+
+    migrados = 0
+    campos = "nextPageToken,items(id,summary,description,extendedProperties)"
+    for evento in listar_eventos(service, CALENDAR_ID, campos, q='CPF_KEY'):
+        descricao = evento.get('description', '')
+        cpf = _extrair_chave_descricao(descricao, 'CPF_KEY::', '::END_CPF')
+        if not cpf or _propriedades_privadas(evento).get('cpf'):
+            continue
+
+        propriedades = {
+            'cpf': cpf,
+            'status': _extrair_chave_descricao(descricao, 'STATUS_KEY::', '::END_STATUS') or _status_do_evento(evento)
+        }
+        venda_id = buscar_id_venda_por_id_google(evento['id'])
+        if venda_id is not None:
+            propriedades['venda_id'] = str(venda_id)
+
+        descricao_limpa = "\n".join(
+            linha for linha in descricao.split("\n")
+            if 'CPF_KEY::' not in linha and 'STATUS_KEY::' not in linha
+        ).rstrip()
+
+        try:
+            evento_atualizado = executar(service.events().patch(
+                calendarId=CALENDAR_ID,
+                eventId=evento['id'],
+                body={'description': descricao_limpa, 'extendedProperties': {'private': propriedades}},
+                fields=CAMPOS_EVENTO
+            ))
+            _atualizar_indice_local(evento_atualizado)
+            migrados += 1
+        except Exception as e:
+            print(f"ERRO ao migrar evento {evento['id']}: {e}")
+
+    print(f"Migração concluída: {migrados} eventos atualizados para extendedProperties.")
+    return migrados
+
 # --- (FUNÇÃO EXISTENTE) PARA SINCRONIZAÇÃO ---
 def verificar_evento_existe(event_id: str):
     """Verifica se um evento com um ID específico ainda existe no calendário."""
+    service = obter_servico()
     if not service:
         print(f"AVISO: Serviço do Google não iniciado. Assumindo que evento {event_id} existe.")
         return True 
     try:
-        service.events().get(calendarId=CALENDAR_ID, eventId=event_id).execute()
+        executar(service.events().get(calendarId=CALENDAR_ID, eventId=event_id, fields='id'))
         return True
     except Exception as e:
         print(f"Info: Evento {event_id} não encontrado no Google Calendar (provavelmente deletado): {e}")
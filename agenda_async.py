@@ -0,0 +1,198 @@
+# agenda_async.py
+# Cliente assíncrono (httpx) da API do Google Calendar, para o loop de eventos do bot.
+# Deixa prontos, sem travar o loop, o índice local (syncToken) e o freeBusy; as operações
+# do agenda.py rodam depois em threads (em_thread), respondidas pelo índice e cache.
+# As regras ficam só no agenda.py; aqui só muda o transporte das consultas.
+import asyncio
+import random
+import threading
+from urllib.parse import quote
+
+import httpx
+import google.auth.transport.requests
+
+import agenda
+from agenda_cliente import (
+    MAX_TENTATIVAS,
+    TIMEOUT_SEGUNDOS,
+    EVENTOS_POR_PAGINA,
+    CAMPOS_LISTA,
+    URL_API as URL_API_CONFIGURADA,
+    URL_API_PADRAO
+)
+from database import db_obter_sync_token
+
+URL_API = URL_API_CONFIGURADA or URL_API_PADRAO # Mesma URL do cliente síncrono (CALENDAR_API_URL)
+MOTIVOS_LIMITE_TAXA = ('rateLimitExceeded', 'userRateLimitExceeded')
+MAX_CONEXOES = 20
+
+_clientes = {} # Um httpx.AsyncClient por loop de eventos
+_token_lock = threading.Lock()
+_sync_lock = asyncio.Lock() # Só evita duas sincronizações no loop; entre o loop e as threads vale o token (CAS)
+
+
+# ==============================================================================
+# --- TRANSPORTE (httpx + token da conta de serviço + backoff) ---
+# ==============================================================================
+
+def _obter_cliente() -> httpx.AsyncClient:
+    """Cliente HTTP do loop atual (conexões keep-alive reaproveitadas entre as conversas)."""
+    loop = asyncio.get_running_loop()
+    cliente = _clientes.get(loop)
+    if cliente is None or cliente.is_closed:
+        cliente = httpx.AsyncClient(
+            base_url=URL_API,
+            timeout=TIMEOUT_SEGUNDOS,
+            limits=httpx.Limits(max_connections=MAX_CONEXOES, max_keepalive_connections=MAX_CONEXOES)
+        )
+        _clientes[loop] = cliente
+    return cliente
+
+async def fechar_cliente(*_):
+    """Fecha o cliente HTTP do loop atual (usado no desligamento do bot)."""
+    cliente = _clientes.pop(asyncio.get_running_loop(), None)
+    if cliente:
+        await cliente.aclose()
+
+def _renovar_token() -> str:
+    """Renova (se preciso) o token OAuth da conta de serviço. Bloqueante: roda numa thread."""
+    with _token_lock:
+        creds = agenda.obter_credenciais()
+        if not creds.valid:
+            creds.refresh(google.auth.transport.requests.Request())
+        return creds.token
+
+async def _cabecalhos() -> dict:
+    """Cabeçalho de autorização com um token válido."""
+    creds = agenda.obter_credenciais()
+    token = creds.token if creds.valid else await asyncio.to_thread(_renovar_token)
+    return {'Authorization': f"Bearer {token}"}
+
+def _deve_repetir(resposta: httpx.Response) -> bool:
+    """Mesmos critérios do googleapiclient: 429, 5xx e 403 de limite de taxa."""
+    if resposta.status_code == 429 or resposta.status_code >= 500:
+        return True
+    if resposta.status_code == 403:
+        try:
+            motivos = [erro.get('reason') for erro in resposta.json()['error']['errors']]
+        except (ValueError, KeyError, TypeError):
+            return False
+        return any(motivo in MOTIVOS_LIMITE_TAXA for motivo in motivos)
+    return False
+
+async def requisitar(metodo: str, caminho: str, **kwargs) -> dict:
+    """
+    Faz uma chamada à API com backoff exponencial (espera aleatória de até 2^tentativa s).
+    Levanta httpx.HTTPStatusError nas respostas de erro que não devem ser repetidas.
+    """
+    cliente = _obter_cliente()
+    for tentativa in range(MAX_TENTATIVAS + 1):
+        try:
+            resposta = await cliente.request(metodo, caminho, headers=await _cabecalhos(), **kwargs)
+        except httpx.TransportError:
+            if tentativa == MAX_TENTATIVAS:
+                raise
+        else:
+            if not _deve_repetir(resposta) or tentativa == MAX_TENTATIVAS:
+                resposta.raise_for_status()
+                return resposta.json() if resposta.content else {}
+        await asyncio.sleep(random.random() * 2 ** tentativa)
+
+def _caminho_eventos(calendar_id: str, event_id: str = None) -> str:
+    """Caminho de /events (ou de um evento) de uma agenda."""
+    caminho = f"/calendars/{quote(calendar_id, safe='')}/events"
+    if event_id:
+        caminho += f"/{quote(event_id, safe='')}"
+    return caminho
+
+async def listar_paginas(calendar_id: str, campos: str = CAMPOS_LISTA, **params):
+    """Gerador assíncrono: uma página de events.list por vez, seguindo o nextPageToken."""
+    params.setdefault('maxResults', EVENTOS_POR_PAGINA)
+    params['fields'] = campos
+    while True:
+        pagina = await requisitar('GET', _caminho_eventos(calendar_id), params=params)
+        yield pagina
+        page_token = pagina.get('nextPageToken')
+        if not page_token:
+            return
+        params['pageToken'] = page_token
+
+
+# ==============================================================================
+# --- OPERAÇÕES DO agenda.py COMO CORROTINAS ---
+# ==============================================================================
+
+async def _coletar_paginas(sync_token) -> list:
+    """Todas as páginas de mudanças desde o 'sync_token' (ou a carga completa)."""
+    return [pagina async for pagina in listar_paginas(agenda.CALENDAR_ID, **agenda._parametros_sincronizacao(sync_token))]
+
+async def sincronizar_indice_agenda_async(forcar: bool = False) -> bool:
+    """Versão assíncrona de agenda.sincronizar_indice_agenda (mesmo throttle e mesmo índice)."""
+    if not agenda.obter_credenciais():
+        return False
+
+    async with _sync_lock:
+        if not forcar and agenda._sincronizacao_recente():
+            return True
+        try:
+            sync_token = token_lido = await asyncio.to_thread(db_obter_sync_token, agenda.CALENDAR_ID)
+            try:
+                paginas = await _coletar_paginas(sync_token)
+            except httpx.HTTPStatusError as e:
+                # 410 GONE: o token não vale mais, o Google exige uma nova carga completa
+                if sync_token and e.response.status_code == 410:
+                    print("Info: syncToken da agenda expirou. Refazendo a sincronização completa...")
+                    sync_token = None
+                    paginas = await _coletar_paginas(None)
+                else:
+                    raise
+            sucesso = await asyncio.to_thread(agenda._aplicar_paginas_no_indice, paginas, sync_token, token_lido)
+            if sucesso:
+                agenda._registrar_sincronizacao()
+            return sucesso
+        except Exception as e:
+            print(f"Erro ao sincronizar (async) o índice local da agenda: {e}")
+            return False
+
+async def _consultar_freebusy_async(calendarios: list, inicio, fim) -> list:
+    """freebusy.query em lotes de 50 agendas, todos os lotes em paralelo."""
+    lotes = [
+        calendarios[i:i + agenda.MAX_CALENDARIOS_FREEBUSY]
+        for i in range(0, len(calendarios), agenda.MAX_CALENDARIOS_FREEBUSY)
+    ]
+    respostas = await asyncio.gather(*(
+        requisitar('POST', '/freeBusy', params={'fields': 'calendars(busy,errors)'}, json=agenda._corpo_freebusy(lote, inicio, fim))
+        for lote in lotes
+    ))
+    return [intervalo for resposta in respostas for intervalo in agenda._intervalos_da_resposta(resposta)]
+
+async def intervalos_ocupados_async(calendarios: list, data_inicio, data_fim) -> list:
+    """Versão assíncrona de agenda.intervalos_ocupados (divide a janela e consulta tudo em paralelo)."""
+    if not agenda.obter_credenciais() or not calendarios:
+        return []
+
+    chave = agenda._chave_freebusy(calendarios, data_inicio, data_fim)
+    em_cache = agenda._ler_cache_freebusy(chave)
+    if em_cache is not None:
+        return em_cache
+
+    resultados = await asyncio.gather(*(
+        _consultar_freebusy_async(list(chave[0]), inicio, fim)
+        for inicio, fim in agenda._partes_da_janela(data_inicio, data_fim)
+    ))
+    unidos = agenda._unir_intervalos([intervalo for resultado in resultados for intervalo in resultado])
+    agenda._gravar_cache_freebusy(chave, unidos)
+    return unidos
+
+async def preparar_disponibilidade(data_inicio, data_fim):
+    """
+    Deixa prontos, sem travar o loop, o índice local e o freeBusy da janela. As consultas
+    síncronas do agenda.py que vierem em seguida são respondidas pelo índice e pelo cache.
+    """
+    try:
+        await asyncio.gather(
+            sincronizar_indice_agenda_async(),
+            intervalos_ocupados_async(agenda.CALENDARIOS_EQUIPAMENTOS, data_inicio, data_fim)
+        )
+    except Exception as e:
+        print(f"Erro ao preparar (async) a disponibilidade: {e}")
@@ -0,0 +1,89 @@
+# agenda_cliente.py
+# Camada fina sobre a API do Google Calendar, usada por todas as funções do agenda.py:
+#  - pede só os campos necessários ('fields');
+#  - segue a paginação (nextPageToken) de forma preguiçosa, como gerador;
+#  - repete com backoff exponencial em 403 (limite de taxa), 429 e 5xx;
+#  - reaproveita o mesmo transporte HTTP autorizado (um por thread, pois o httplib2 não é thread-safe).
+import os
+import threading
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+TIMEOUT_SEGUNDOS = 20
+MAX_TENTATIVAS = 5 # Repetições com backoff exponencial (feito pelo próprio googleapiclient)
+EVENTOS_POR_PAGINA = 2500 # Máximo aceito pela API; menos páginas = menos viagens
+
+# --- (NOVO) Endereço da API ---
+# Por padrão, o Google. Com CALENDAR_API_URL definida (ex: http://127.0.0.1:8085/calendar/v3/),
+# o bot fala com o calendario_fake.py, sem credenciais e sem rede.
+URL_API_PADRAO = "https://www.googleapis.com/calendar/v3/"
+URL_API = os.environ.get('CALENDAR_API_URL')
+
+# --- Projeções de campos (reduzem o tamanho de cada resposta) ---
+CAMPOS_EVENTO = "id,status,summary,start,end,created,extendedProperties"
+CAMPOS_LISTA = f"nextPageToken,nextSyncToken,items({CAMPOS_EVENTO})"
+
+_credenciais = None
+_local = threading.local()
+
+
+def _http_da_thread():
+    """Retorna o transporte HTTP autorizado da thread atual (criado uma única vez por thread)."""
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = AuthorizedHttp(_credenciais, http=httplib2.Http(timeout=TIMEOUT_SEGUNDOS))
+        _local.http = http
+    return http
+
+
+def _construir_requisicao(http, *args, **kwargs):
+    """requestBuilder do googleapiclient: cada requisição usa o transporte da thread que a executa."""
+    return HttpRequest(_http_da_thread(), *args, **kwargs)
+
+
+def criar_servico(credenciais):
+    """Constrói o serviço do Calendar v3 sobre o transporte autorizado reutilizável (sem acessar a rede)."""
+    global _credenciais
+    _credenciais = credenciais
+    opcoes = {}
+    if URL_API:
+        opcoes['client_options'] = {'api_endpoint': URL_API} # Servidor local (calendario_fake.py)
+    return build(
+        'calendar', 'v3',
+        http=_http_da_thread(),
+        requestBuilder=_construir_requisicao,
+        static_discovery=True, # Documento de descoberta embutido na biblioteca: sem rede na construção
+        cache_discovery=False,
+        **opcoes
+    )
+
+
+def executar(requisicao):
+    """
+    Executa uma requisição com backoff exponencial.
+    O googleapiclient repete sozinho em 429, 5xx e 403 de limite de taxa
+    (rateLimitExceeded / userRateLimitExceeded) quando recebe 'num_retries'.
+    """
+    return requisicao.execute(num_retries=MAX_TENTATIVAS)
+
+
+def listar_paginas(service, calendar_id: str, campos: str = CAMPOS_LISTA, **params):
+    """Gerador: devolve uma página de 'events.list' por vez, seguindo o nextPageToken."""
+    params.setdefault('maxResults', EVENTOS_POR_PAGINA)
+    page_token = None
+    while True:
+        if page_token:
+            params['pageToken'] = page_token
+        pagina = executar(service.events().list(calendarId=calendar_id, fields=campos, **params))
+        yield pagina
+        page_token = pagina.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def listar_eventos(service, calendar_id: str, campos: str = CAMPOS_LISTA, **params):
+    """Gerador: devolve os eventos um a um, buscando a próxima página só quando necessário."""
+    for pagina in listar_paginas(service, calendar_id, campos, **params):
+        yield from pagina.get('items', [])
@@ -0,0 +1,107 @@
+# benchmark_agenda.py
+# Mede vazão e latência (p50/p99) das funções de disponibilidade e reserva contra
+# o calendario_fake.py, com agendas de tamanhos crescentes. Não usa a cota do Google
+# nem o financeiro.db (o livro local vai para um arquivo temporário).
+#
+# Uso: python benchmark_agenda.py [--eventos 100 1000 5000] [--repeticoes 50] [--latencia-ms 80]
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import urllib.request
+from datetime import date, timedelta
+
+PORTA_PADRAO = 8086
+
+
+def _controle(porta: int, caminho: str, corpo: dict):
+    """POST numa rota de controle do servidor falso."""
+    requisicao = urllib.request.Request(
+        f"http://127.0.0.1:{porta}/_controle{caminho}",
+        data=json.dumps(corpo).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(requisicao) as resposta:
+        return json.loads(resposta.read())
+
+
+def _medir(nome: str, funcao, repeticoes: int):
+    """Chama 'funcao(i)' 'repeticoes' vezes e imprime vazão, p50 e p99 (em ms)."""
+    tempos = []
+    inicio_total = time.perf_counter()
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(i)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    total = time.perf_counter() - inicio_total
+    percentis = statistics.quantiles(tempos, n=100) if len(tempos) > 1 else tempos * 99
+    print(f"  {nome:<30} {repeticoes / total:8.1f} op/s   p50 {percentis[49]:8.1f} ms   p99 {percentis[98]:8.1f} ms")
+
+
+def executar_benchmark(quantidades: list, repeticoes: int, latencia_ms: float, porta: int):
+    # O endereço precisa estar definido ANTES de importar o agenda (é lido na importação do agenda_cliente)
+    os.environ['CALENDAR_API_URL'] = f"http://127.0.0.1:{porta}/calendar/v3/"
+
+    import database
+    pasta = tempfile.mkdtemp(prefix='bench_agenda_')
+
+    import calendario_fake
+    servidor = calendario_fake.iniciar_em_thread(porta)
+    import agenda
+
+    try:
+        for quantidade in quantidades:
+            # Livro local e agenda do zero a cada rodada (a 1ª chamada faz a carga completa)
+            database.DB_NAME = os.path.join(pasta, f'bench_{quantidade}.db')
+            database.inicializar_banco()
+            agenda._ultima_sync = 0.0
+            _controle(porta, '/limpar', {})
+            _controle(porta, '', {'latencia_ms': 0})
+            _controle(porta, '/popular', {'calendar_id': agenda.CALENDAR_ID, 'quantidade': quantidade, 'dias': 365, 'cpfs': 200})
+            _controle(porta, '', {'latencia_ms': latencia_ms})
+
+            print(f"\n=== {quantidade} eventos na agenda (latência simulada {latencia_ms:.0f} ms) ===")
+            hoje = date.today()
+            meses = [(hoje.replace(day=1) + timedelta(days=32 * i)).replace(day=1) for i in range(12)]
+
+            inicio = time.perf_counter()
+            agenda.sincronizar_indice_agenda(forcar=True)
+            print(f"  {'carga completa do índice':<30} {(time.perf_counter() - inicio) * 1000:8.1f} ms")
+
+            _medir(
+                'verificar_dias_disponiveis',
+                lambda i: agenda.verificar_dias_disponiveis(meses[i % 12].year, meses[i % 12].month),
+                repeticoes
+            )
+            _medir(
+                'marcar_horario',
+                lambda i: agenda.marcar_horario(
+                    hoje + timedelta(days=1 + i), "14:00", "Cliente Benchmark", "99999999999",
+                    "- Item de teste", "Rua do Teste, 1", 100.0, 'PENDENTE',
+                    itens={f"Item Benchmark {i}": 1}
+                ),
+                repeticoes
+            )
+            _medir(
+                'buscar_eventos_por_cpf',
+                lambda i: agenda.buscar_eventos_por_cpf(f"{random.randrange(200):011d}"),
+                repeticoes
+            )
+            while database.db_tamanho_fila_espelho(): # Espera o espelho antes da próxima rodada
+                agenda.processar_espelho_pendente()
+                time.sleep(0.05)
+    finally:
+        servidor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark das consultas de agenda contra o calendario_fake.py.")
+    parser.add_argument('--eventos', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeticoes', type=int, default=50)
+    parser.add_argument('--latencia-ms', type=float, default=80)
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO)
+    args = parser.parse_args()
+    executar_benchmark(args.eventos, args.repeticoes, args.latencia_ms, args.porta)
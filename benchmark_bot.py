@@ -0,0 +1,90 @@
+# benchmark_bot.py
+# Mede se o loop de eventos do bot continua respondendo durante uma rajada de conversas.
+# Simula N chats mandando mensagem ao mesmo tempo. Cada mensagem carrega o estado,
+# roda uma "lógica" bloqueante (time.sleep no lugar do Google Maps / Mercado Pago) e
+# salva o estado, em dois modos:
+#  - "antes": tudo direto no loop (como os handlers faziam com o sqlite e o estado);
+#  - "depois": tudo pelo pool limitado do execucao.py (em_thread).
+# Um "relógio" no loop acorda a cada 10 ms e mede o atraso: é o tempo que qualquer outro
+# cliente esperaria para ser atendido. Usa um banco temporário (não toca no financeiro.db).
+#
+# Uso: python benchmark_bot.py [--chats 200] [--logica-ms 50] [--threads 16]
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import database
+
+INTERVALO_RELOGIO = 0.01
+
+
+async def _relogio(atrasos: list, parar: asyncio.Event):
+    """Acorda a cada INTERVALO_RELOGIO e anota quanto o loop demorou a devolver a vez (ms)."""
+    while not parar.is_set():
+        antes = time.perf_counter()
+        await asyncio.sleep(INTERVALO_RELOGIO)
+        atrasos.append((time.perf_counter() - antes - INTERVALO_RELOGIO) * 1000)
+
+
+def _logica_bloqueante(estado: dict, logica_ms: float) -> dict:
+    time.sleep(logica_ms / 1000) # Chamada síncrona a uma API externa
+    estado['contador'] = estado.get('contador', 0) + 1
+    estado['estado'] = 'benchmark'
+    return estado
+
+
+async def _mensagem(chat_id: str, logica_ms: float, no_pool: bool, estado_cache, em_thread):
+    if no_pool:
+        estado = await em_thread(estado_cache.carregar_estado, chat_id)
+        estado = await em_thread(_logica_bloqueante, estado, logica_ms)
+        await em_thread(estado_cache.salvar_estado, chat_id, estado)
+    else:
+        estado = estado_cache.carregar_estado(chat_id)
+        estado = _logica_bloqueante(estado, logica_ms)
+        estado_cache.salvar_estado(chat_id, estado)
+
+
+async def _rodada(chats: int, logica_ms: float, no_pool: bool):
+    import estado_cache
+    from execucao import em_thread, metricas, formatar_metricas
+
+    atrasos = []
+    parar = asyncio.Event()
+    relogio = asyncio.create_task(_relogio(atrasos, parar))
+    await asyncio.sleep(INTERVALO_RELOGIO * 2)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[
+        _mensagem(f"bench-{i}", logica_ms, no_pool, estado_cache, em_thread) for i in range(chats)
+    ])
+    total = time.perf_counter() - inicio
+    parar.set()
+    await relogio
+
+    percentis = statistics.quantiles(atrasos, n=100, method='inclusive') if len(atrasos) > 1 else atrasos * 99
+    nome = 'depois (pool limitado)' if no_pool else 'antes (direto no loop)'
+    print(f"  {nome:<24} {chats / total:8.1f} msg/s   atraso do loop p50 {percentis[49]:7.1f} ms   p99 {percentis[98]:7.1f} ms   máx {max(atrasos):7.1f} ms")
+    if no_pool:
+        print(f"    {formatar_metricas(metricas())}")
+
+
+def executar_benchmark(chats: int, logica_ms: float, threads: int):
+    os.environ['BOT_POOL_THREADS'] = str(threads) # Lido na importação do execucao.py
+    pasta = tempfile.mkdtemp(prefix='bench_bot_')
+    print(f"\n=== {chats} chats ao mesmo tempo, lógica bloqueante de {logica_ms:.0f} ms, pool de {threads} threads ===")
+    for no_pool in (False, True):
+        database.DB_NAME = os.path.join(pasta, f"bench_{int(no_pool)}.db")
+        database.inicializar_banco()
+        asyncio.run(_rodada(chats, logica_ms, no_pool))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Responsividade do loop do bot sob uma rajada de chats.")
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--logica-ms', type=float, default=50)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    executar_benchmark(args.chats, args.logica_ms, args.threads)
@@ -0,0 +1,116 @@
+# benchmark_db.py
+# Mede o custo de banco por mensagem (carregar + salvar o estado da conversa)
+# em dois modos:
+#  - "antes": uma conexão nova por chamada, journal padrão (como o database.py fazia);
+#  - "depois": conexão da thread reaproveitada, WAL e comandos preparados (database.transacao).
+# Roda com 1 e com várias threads, em um arquivo temporário (não toca no financeiro.db).
+#
+# Uso: python benchmark_db.py [--mensagens 2000] [--threads 1 8]
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import sqlite3
+
+import database
+
+ESTADO_EXEMPLO = {
+    'estado': 'aguardando_item_avulso',
+    'carrinho': [{'id': 'A01', 'nome': 'Kart Elétrico', 'preco': 250.0, 'custo': 40.0}] * 3,
+    'frete_valor': 35.0,
+    'nome_cliente': 'Cliente Benchmark'
+}
+
+
+# --- Modo "antes": abre e fecha uma conexão a cada chamada ---
+
+def _carregar_antes(chat_id: str) -> dict:
+    conn = sqlite3.connect(database.DB_NAME, timeout=10)
+    cursor = conn.cursor()
+    cursor.execute("SELECT estado_json FROM conversa_estados WHERE chat_id = ?", (chat_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else {'estado': None, 'carrinho': [], 'frete_valor': -1.0}
+
+def _salvar_antes(chat_id: str, estado: dict):
+    conn = sqlite3.connect(database.DB_NAME, timeout=10)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO conversa_estados (chat_id, estado_json) VALUES (?, ?)",
+        (chat_id, json.dumps(estado, default=database.def_json_serial))
+    )
+    conn.commit()
+    conn.close()
+
+
+# --- Modo "depois": as funções atuais do database.py ---
+
+def _carregar_depois(chat_id: str) -> dict:
+    return database.db_carregar_estado_usuario(chat_id)
+
+def _salvar_depois(chat_id: str, estado: dict):
+    database.db_salvar_estado_usuario(chat_id, estado)
+
+
+def _preparar_banco(caminho: str, wal: bool):
+    """Cria um banco novo com o esquema do bot."""
+    database.DB_NAME = caminho
+    database.inicializar_banco()
+    if not wal:
+        # O modo "antes" usa o journal padrão (rollback)
+        database.fechar_conexao()
+        conn = sqlite3.connect(caminho)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+
+def _rodar(carregar, salvar, mensagens: int, threads: int):
+    """Cada thread simula 'mensagens / threads' mensagens (carregar + salvar). Retorna os tempos (ms)."""
+    tempos = []
+    lock = threading.Lock()
+
+    def _trabalhador(indice: int):
+        locais = []
+        for i in range(mensagens // threads):
+            chat_id = f"{indice}-{i % 50}"
+            inicio = time.perf_counter()
+            estado = carregar(chat_id)
+            estado.update(ESTADO_EXEMPLO)
+            salvar(chat_id, estado)
+            locais.append((time.perf_counter() - inicio) * 1000)
+        database.fechar_conexao()
+        with lock:
+            tempos.extend(locais)
+
+    trabalhadores = [threading.Thread(target=_trabalhador, args=(i,)) for i in range(threads)]
+    inicio = time.perf_counter()
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    return tempos, time.perf_counter() - inicio
+
+
+def executar_benchmark(mensagens: int, lista_threads: list):
+    pasta = tempfile.mkdtemp(prefix='bench_db_')
+    for threads in lista_threads:
+        print(f"\n=== {mensagens} mensagens, {threads} thread(s) ===")
+        for nome, carregar, salvar, wal in (
+            ('antes (conexão por chamada)', _carregar_antes, _salvar_antes, False),
+            ('depois (conexão da thread + WAL)', _carregar_depois, _salvar_depois, True)
+        ):
+            _preparar_banco(os.path.join(pasta, f"bench_{threads}_{int(wal)}.db"), wal)
+            tempos, total = _rodar(carregar, salvar, mensagens, threads)
+            percentis = statistics.quantiles(tempos, n=100)
+            print(f"  {nome:<34} {len(tempos) / total:9.1f} msg/s   média {statistics.mean(tempos):6.3f} ms   p99 {percentis[98]:6.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Custo de banco por mensagem, antes e depois do gerenciador de conexões.")
+    parser.add_argument('--mensagens', type=int, default=2000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    args = parser.parse_args()
+    executar_benchmark(args.mensagens, args.threads)
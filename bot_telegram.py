@@ -4,7 +4,7 @@ import time
 import asyncio # Necessário para a v20+
 
 # --- MUDANÇAS DE IMPORTAÇÃO (v20+) ---
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -13,16 +13,30 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler 
 )
+from telegram.error import BadRequest
 
 # --- Nossas Importações (do seu projeto) ---
 from config import TELEGRAM_TOKEN
-from logic import processar_mensagem
+from logic import processar_mensagem_async
+from agenda_async import fechar_cliente
+from agenda import iniciar_limpeza_periodica, iniciar_espelho
+import midia_telegram # (NOVO) file_id das imagens já enviadas (sem re-download pelo ngrok)
+from despacho import um_por_vez_por_chat # (NOVO) Updates do mesmo chat em série
+from fila_envio import LimitadorDeEnvio, estatisticas as estatisticas_envio # (NOVO) Limite de taxa na saída
+from execucao import (
+    em_thread,
+    usar_como_executor_padrao,
+    registrar_metricas_periodicamente,
+    formatar_metricas
+)
 
-# --- (NOVO) Import das funções de estado do DB ---
-from database import (
-    db_carregar_estado_usuario,
-    db_salvar_estado_usuario,
-    db_deletar_estado_usuario
+# --- (NOVO) Estados de conversa via cache em memória (gravação em lote no DB) ---
+from estado_cache import (
+    carregar_estado,
+    salvar_estado,
+    deletar_estado,
+    iniciar_varredura_periodica,
+    encerrar as encerrar_cache_estados
 )
 # ------------------------------------------
 
@@ -33,7 +47,75 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# --- Função de envio (Inalterada da última vez) ---
+# (NOVO) Quantos updates a Application processa ao mesmo tempo (de chats diferentes)
+ATUALIZACOES_SIMULTANEAS = 64
+
+# (NOVO) Álbuns (send_media_group)
+LIMITE_LEGENDA = 1024 # Caracteres (UTF-16) aceitos numa legenda de foto
+FOTOS_POR_ALBUM = 10 # Máximo do Telegram por send_media_group (mínimo: 2)
+TEXTO_DOS_BOTOES = "Escolha uma opção:" # Álbum não leva botões: vão numa mensagem logo abaixo
+
+# --- (NOVO) Envio de foto reaproveitando o file_id do Telegram ---
+async def _enviar_foto(context: ContextTypes.DEFAULT_TYPE, chat_id: int, url: str, **kwargs):
+    """
+    send_photo com o file_id guardado (se houver). No primeiro envio vai a URL e o
+    file_id devolvido é guardado; se o Telegram recusar um file_id, reenvia pela URL.
+    """
+    (foto, chave, do_cache), = await em_thread(midia_telegram.preparar_fotos, [url])
+    if do_cache:
+        try:
+            return await context.bot.send_photo(chat_id=chat_id, photo=foto, **kwargs)
+        except BadRequest as e:
+            logger.warning(f"file_id recusado para {url} ({e}). Reenviando pela URL.")
+            await em_thread(midia_telegram.esquecer_file_ids, [chave])
+    mensagem = await context.bot.send_photo(chat_id=chat_id, photo=url, **kwargs)
+    if chave:
+        await em_thread(midia_telegram.registrar_file_ids, [(chave, mensagem)])
+    return mensagem
+
+# --- (NOVO) Várias fotos num álbum só (send_media_group) ---
+def _cabe_na_legenda(texto: str) -> bool:
+    return len(texto.encode('utf-16-le')) // 2 <= LIMITE_LEGENDA
+
+def _lotes_do_album(urls: list) -> list:
+    """Divide as fotos em álbuns de 2 a 10 (uma sobra de 1 foto pega uma do álbum anterior)."""
+    lotes = [urls[i:i + FOTOS_POR_ALBUM] for i in range(0, len(urls), FOTOS_POR_ALBUM)]
+    if len(lotes) > 1 and len(lotes[-1]) == 1:
+        lotes[-1].insert(0, lotes[-2].pop())
+    return lotes
+
+async def _enviar_album(context: ContextTypes.DEFAULT_TYPE, chat_id: int, urls: list, legenda: str = None):
+    """
+    Envia as fotos como álbum (uma chamada a cada 10 fotos), com a legenda na primeira.
+    Usa os file_ids guardados; se o Telegram recusar algum, reenvia o álbum pelas URLs.
+    """
+    for numero_lote, lote in enumerate(_lotes_do_album(urls)):
+        legenda_do_lote = legenda if numero_lote == 0 else None
+        if len(lote) == 1: # Álbum exige pelo menos 2 fotos
+            await _enviar_foto(context, chat_id, lote[0], caption=legenda_do_lote)
+            continue
+        fotos = await em_thread(midia_telegram.preparar_fotos, lote)
+        try:
+            mensagens = await context.bot.send_media_group(chat_id=chat_id, media=[
+                InputMediaPhoto(media=foto, caption=legenda_do_lote if i == 0 else None)
+                for i, (foto, _, _) in enumerate(fotos)
+            ])
+        except BadRequest as e:
+            do_cache = [chave for _, chave, em_cache in fotos if em_cache]
+            if not do_cache:
+                raise
+            logger.warning(f"file_id recusado num álbum ({e}). Reenviando pelas URLs.")
+            await em_thread(midia_telegram.esquecer_file_ids, do_cache)
+            fotos = [(url, chave, False) for url, (_, chave, _) in zip(lote, fotos)]
+            mensagens = await context.bot.send_media_group(chat_id=chat_id, media=[
+                InputMediaPhoto(media=url, caption=legenda_do_lote if i == 0 else None)
+                for i, url in enumerate(lote)
+            ])
+        novos = [(chave, mensagem) for (_, chave, em_cache), mensagem in zip(fotos, mensagens) if chave and not em_cache]
+        if novos:
+            await em_thread(midia_telegram.registrar_file_ids, novos)
+
+# --- Função de envio ---
 async def enviar_resposta_telegram(context: ContextTypes.DEFAULT_TYPE, chat_id: int, resposta_dict: dict):
     """
     Interpreta o dicionário de resposta do logic.py e envia para o Telegram.
@@ -65,24 +147,36 @@ async def enviar_resposta_telegram(context: ContextTypes.DEFAULT_TYPE, chat_id:
         print(f"\n[DEBUG] URL da imagem que estou tentando enviar: {media_urls[0]}\n")
 
     try:
-        if media_urls:
-            # Cenário 1: Mídia com legenda (caption)
-            if usar_legenda and body_text:
-                await context.bot.send_photo(
+        # (NOVO) Cenário 1: Várias fotos -> um álbum com o texto na legenda da primeira.
+        # Os botões (ou um texto grande demais para legenda) vão numa segunda mensagem.
+        if len(media_urls) > 1:
+            legenda = body_text if body_text and _cabe_na_legenda(body_text) else None
+            await _enviar_album(context, chat_id, media_urls, legenda)
+
+            texto_seguinte = body_text if body_text and not legenda else None
+            if keyboard and not texto_seguinte:
+                texto_seguinte = TEXTO_DOS_BOTOES
+            if texto_seguinte:
+                await context.bot.send_message(
                     chat_id=chat_id,
-                    photo=media_urls[0],
+                    text=texto_seguinte,
+                    reply_markup=keyboard
+                )
+
+        elif media_urls:
+            # Cenário 2: Uma foto com legenda (caption) e botões
+            if usar_legenda and body_text and _cabe_na_legenda(body_text):
+                await _enviar_foto(
+                    context,
+                    chat_id,
+                    media_urls[0],
                     caption=body_text,
                     reply_markup=keyboard 
                 )
-                for url in media_urls[1:]:
-                    await context.bot.send_photo(chat_id=chat_id, photo=url)
             
-            # Cenário 2: Mídia e texto separados
+            # Cenário 3: Foto e texto separados (as chamadas já saem em ordem: sem sleep)
             else:
-                for url in media_urls:
-                    await context.bot.send_photo(chat_id=chat_id, photo=url)
-                
-                await asyncio.sleep(1) 
+                await _enviar_foto(context, chat_id, media_urls[0])
 
                 if body_text:
                     await context.bot.send_message(
@@ -91,7 +185,7 @@ async def enviar_resposta_telegram(context: ContextTypes.DEFAULT_TYPE, chat_id:
                         reply_markup=keyboard 
                     )
         
-        # Cenário 3: Só texto (com os botões)
+        # Cenário 4: Só texto (com os botões)
         elif body_text:
             await context.bot.send_message(
                 chat_id=chat_id, 
@@ -107,6 +201,7 @@ async def enviar_resposta_telegram(context: ContextTypes.DEFAULT_TYPE, chat_id:
             pass
 
 # --- Handler de mensagem (ATUALIZADO com lógica de DB) ---
+@um_por_vez_por_chat
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Processa todas as mensagens de TEXTO recebidas.
@@ -118,29 +213,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print(f"Mensagem [Texto] de '{numero_cliente_telegram}': '{mensagem_recebida}'") # Log
 
     # --- (NOVA LÓGICA DE ESTADO) ---
-    # 1. Carrega o estado atual do usuário do DB
-    estado_info = db_carregar_estado_usuario(numero_cliente_telegram)
+    # 1. Carrega o estado atual do usuário (cache em memória; DB só na primeira vez)
+    estado_info = await em_thread(carregar_estado, numero_cliente_telegram)
 
     # 2. Chama o logic.py (agora passando o estado)
-    resposta_dict, estado_info_atualizado = processar_mensagem(
+    resposta_dict, estado_info_atualizado = await processar_mensagem_async(
         mensagem_recebida, 
         numero_cliente_telegram,
         estado_info # Passa o estado carregado
     )
     
-    # 3. Salva o novo estado de volta no DB
+    # 3. Salva o novo estado (vai para o DB no próximo lote)
     if estado_info_atualizado.get('estado') is None:
         # Se o logic zerou o estado (ex: voltou ao menu), deletamos do DB
-        db_deletar_estado_usuario(numero_cliente_telegram)
+        await em_thread(deletar_estado, numero_cliente_telegram)
     else:
         # Senão, salvamos a atualização
-        db_salvar_estado_usuario(numero_cliente_telegram, estado_info_atualizado)
+        await em_thread(salvar_estado, numero_cliente_telegram, estado_info_atualizado)
     # --- (FIM DA NOVA LÓGICA DE ESTADO) ---
 
     # 4. Envia a resposta (agora com botões)
     await enviar_resposta_telegram(context, chat_id, resposta_dict)
 
 # --- Handler de cliques (ATUALIZADO com lógica de DB) ---
+@um_por_vez_por_chat
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Processa todos os cliques em botões (CallbackQuery)."""
     query = update.callback_query
@@ -153,27 +249,28 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     print(f"Clique [Botão] de '{numero_cliente_telegram}': '{mensagem_recebida}'") # Log
 
     # --- (NOVA LÓGICA DE ESTADO) ---
-    # 1. Carrega o estado atual do usuário do DB
-    estado_info = db_carregar_estado_usuario(numero_cliente_telegram)
+    # 1. Carrega o estado atual do usuário (cache em memória; DB só na primeira vez)
+    estado_info = await em_thread(carregar_estado, numero_cliente_telegram)
 
     # 2. Envia o clique para o logic.py (como se fosse texto)
-    resposta_dict, estado_info_atualizado = processar_mensagem(
+    resposta_dict, estado_info_atualizado = await processar_mensagem_async(
         mensagem_recebida, 
         numero_cliente_telegram,
         estado_info # Passa o estado carregado
     )
     
-    # 3. Salva o novo estado de volta no DB
+    # 3. Salva o novo estado (vai para o DB no próximo lote)
     if estado_info_atualizado.get('estado') is None:
-        db_deletar_estado_usuario(numero_cliente_telegram)
+        await em_thread(deletar_estado, numero_cliente_telegram)
     else:
-        db_salvar_estado_usuario(numero_cliente_telegram, estado_info_atualizado)
+        await em_thread(salvar_estado, numero_cliente_telegram, estado_info_atualizado)
     # --- (FIM DA NOVA LÓGICA DE ESTADO) ---
     
     # 4. Envia a nova resposta
     await enviar_resposta_telegram(context, chat_id, resposta_dict)
 
 # --- Handler /start (ATUALIZADO com lógica de DB) ---
+@um_por_vez_por_chat
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Envia a mensagem de /start e simula a primeira mensagem 'oi'."""
     chat_id = update.message.chat_id
@@ -186,37 +283,80 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # --- (NOVA LÓGICA DE ESTADO) ---
     # 1. Carrega o estado (que provavelmente estará vazio/novo)
-    estado_info = db_carregar_estado_usuario(numero_cliente_telegram)
+    estado_info = await em_thread(carregar_estado, numero_cliente_telegram)
 
     # 2. Simula o início da conversa chamando o processar_mensagem com "oi"
-    resposta_dict, estado_info_atualizado = processar_mensagem(
+    resposta_dict, estado_info_atualizado = await processar_mensagem_async(
         "oi", 
         numero_cliente_telegram,
         estado_info
     )
     
     # 3. Salva o estado inicial (que agora é 'aguardando_tipo_reserva')
-    db_salvar_estado_usuario(numero_cliente_telegram, estado_info_atualizado)
+    await em_thread(salvar_estado, numero_cliente_telegram, estado_info_atualizado)
     # --- (FIM DA NOVA LÓGICA DE ESTADO) ---
 
     await enviar_resposta_telegram(context, chat_id, resposta_dict)
 
-# --- Função Principal (Inalterada da última vez) ---
-def main():
-    """Inicia o bot do Telegram."""
-    
-    print("Iniciando o bot (v20+)...")
+async def ao_iniciar(application: Application):
+    """(NOVO) Todo asyncio.to_thread passa a usar o pool limitado; métricas do pool no log."""
+    usar_como_executor_padrao()
+    application.create_task(registrar_metricas_periodicamente())
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def ao_desligar(application: Application):
+    """(NOVO) Fecha o cliente HTTP da Agenda e grava os estados de conversa pendentes."""
+    await fechar_cliente()
+    encerrar_cache_estados()
+    print(formatar_metricas())
+    print(f"[Fila de envio] {estatisticas_envio()}")
+
+# --- (NOVO) Montagem da Application (usada no polling e no webhook) ---
+def criar_aplicacao() -> Application:
+    """Cria a Application com os handlers registrados (sem iniciar nada)."""
+    # (NOVO) Ao desligar: fecha o cliente HTTP da Agenda e grava os estados em cache.
+    # (NOVO) Vários updates ao mesmo tempo; a ordem dentro de cada chat é garantida pelo despacho.py
+    # (NOVO) Todo envio passa pela fila com limite de taxa (fila_envio.py)
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(ATUALIZACOES_SIMULTANEAS)
+        .rate_limiter(LimitadorDeEnvio())
+        .post_init(ao_iniciar)
+        .post_shutdown(ao_desligar)
+        .build()
+    )
 
     # Registra os Handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
+def iniciar_tarefas_de_fundo():
+    """(NOVO) Limpezas periódicas que rodam junto com o bot (em qualquer modo)."""
+    # (NOVO) Limpa reservas PENDENTES expiradas em segundo plano, fora do caminho do cliente
+    iniciar_limpeza_periodica()
+    # (NOVO) Esvazia a fila de escritas na Agenda deixada pelo processo anterior, e segue vigiando
+    iniciar_espelho()
+    # (NOVO) Arquiva as conversas abandonadas (a tabela de estados não cresce para sempre)
+    iniciar_varredura_periodica()
+
+# --- Função Principal (modo polling) ---
+def main():
+    """
+    Inicia o bot do Telegram em modo polling.
+    (NOVO) Para o modo webhook (sem polling), ligue TELEGRAM_USAR_WEBHOOK no config.py
+    e rode o image_server.py: o bot passa a rodar dentro dele (ver webhook_telegram.py).
+    """
+    
+    print("Iniciando o bot (v20+)...")
+
+    application = criar_aplicacao()
+    iniciar_tarefas_de_fundo()
 
     print("Bot do Telegram iniciado. Pressione Ctrl+C para parar.")
-    application.run_polling()
+    application.run_polling() # (Remove o webhook, se houver um registrado)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,347 @@
+# calendario_fake.py
+# Servidor local que imita o pedaço da API do Google Calendar v3 que o bot usa,
+# para testes de carga sem gastar a cota do Google.
+#
+# Uso:
+#   python calendario_fake.py --porta 8085 --latencia-ms 80 --taxa-erro 0.01
+#   CALENDAR_API_URL=http://127.0.0.1:8085/calendar/v3/ python bot_telegram.py
+#
+# Suporta: events list (q, timeMin/timeMax, paginação, syncToken, privateExtendedProperty,
+# orderBy=startTime), get, insert, update, patch, delete e freeBusy.
+# Não suporta requisições batch (a limpeza periódica usa batch).
+# Rotas de controle (fora da API): /_controle (latência/erros), /_controle/limpar, /_controle/popular.
+import argparse
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+FUSO_PADRAO = ZoneInfo('America/Sao_Paulo')
+RESULTADOS_POR_PAGINA_PADRAO = 250
+RESULTADOS_POR_PAGINA_MAX = 2500
+
+# --- Estado do servidor ---
+_lock = threading.Lock()
+_agendas = {} # calendar_id -> {event_id: evento}
+_sequencia = 0 # Contador de mudanças (base dos syncTokens)
+_config = {'latencia_ms': 0, 'variacao_ms': 0, 'taxa_erro': 0.0, 'taxa_limite': 0.0}
+
+
+# ==============================================================================
+# --- AUXILIARES ---
+# ==============================================================================
+
+def _agora_utc() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def _proxima_sequencia() -> int:
+    global _sequencia
+    _sequencia += 1
+    return _sequencia
+
+def _erro(codigo: int, mensagem: str, motivo: str):
+    """Resposta de erro no mesmo formato da API do Google."""
+    resposta = jsonify({'error': {'code': codigo, 'message': mensagem, 'errors': [{'domain': 'global', 'reason': motivo, 'message': mensagem}]}})
+    resposta.status_code = codigo
+    return resposta
+
+def _instante(valor: dict):
+    """Converte um 'start'/'end' do evento (dateTime ou date) em datetime com fuso."""
+    if not valor:
+        return None
+    if 'dateTime' in valor:
+        instante = datetime.fromisoformat(valor['dateTime'].replace('Z', '+00:00'))
+        if instante.tzinfo is None:
+            instante = instante.replace(tzinfo=ZoneInfo(valor.get('timeZone', 'America/Sao_Paulo')))
+        return instante
+    if 'date' in valor:
+        return datetime.combine(date.fromisoformat(valor['date']), datetime.min.time(), FUSO_PADRAO)
+    return None
+
+def _parametro_instante(nome: str):
+    valor = request.args.get(nome)
+    return datetime.fromisoformat(valor.replace('Z', '+00:00')) if valor else None
+
+def _mesclar(destino: dict, alteracoes: dict):
+    """Semântica do PATCH: objetos são mesclados, o resto é substituído."""
+    for chave, valor in alteracoes.items():
+        if isinstance(valor, dict) and isinstance(destino.get(chave), dict):
+            _mesclar(destino[chave], valor)
+        else:
+            destino[chave] = valor
+
+def _registrar_mudanca(evento: dict):
+    evento['updated'] = _agora_utc()
+    evento['_sequencia'] = _proxima_sequencia()
+    evento['etag'] = f"\"{evento['_sequencia']}\""
+
+def _publico(evento: dict) -> dict:
+    """O evento como a API devolve (sem os campos internos)."""
+    return {chave: valor for chave, valor in evento.items() if not chave.startswith('_')}
+
+def _texto_do_evento(evento: dict) -> str:
+    return " ".join(str(evento.get(campo, '')) for campo in ('summary', 'description', 'location')).lower()
+
+
+# ==============================================================================
+# --- LATÊNCIA E INJEÇÃO DE ERROS ---
+# ==============================================================================
+
+@app.before_request
+def _simular_rede():
+    if request.path.startswith('/_controle'):
+        return None
+    latencia = _config['latencia_ms'] + random.uniform(0, _config['variacao_ms'])
+    if latencia > 0:
+        time.sleep(latencia / 1000.0)
+    sorteio = random.random()
+    if sorteio < _config['taxa_erro']:
+        return _erro(503, 'Backend Error', 'backendError')
+    if sorteio < _config['taxa_erro'] + _config['taxa_limite']:
+        return _erro(403, 'Rate Limit Exceeded', 'rateLimitExceeded')
+    return None
+
+
+# ==============================================================================
+# --- API: EVENTS ---
+# ==============================================================================
+
+@app.route('/calendar/v3/calendars/<calendar_id>/events', methods=['GET'])
+def listar_eventos(calendar_id):
+    with _lock:
+        eventos = list(_agendas.get(calendar_id, {}).values())
+        sequencia_atual = _sequencia
+
+    sync_token = request.args.get('syncToken')
+    if sync_token:
+        try:
+            desde = int(sync_token)
+        except ValueError:
+            return _erro(410, 'Sync token is no longer valid, a full sync is required.', 'fullSyncRequired')
+        if desde > sequencia_atual:
+            return _erro(410, 'Sync token is no longer valid, a full sync is required.', 'fullSyncRequired')
+        # Incremental: tudo que mudou depois do token, inclusive os cancelados
+        eventos = [evento for evento in eventos if evento['_sequencia'] > desde]
+    else:
+        eventos = [evento for evento in eventos if evento.get('status') != 'cancelled']
+
+        time_min, time_max = _parametro_instante('timeMin'), _parametro_instante('timeMax')
+        if time_min:
+            eventos = [evento for evento in eventos if _instante(evento.get('end')) > time_min]
+        if time_max:
+            eventos = [evento for evento in eventos if _instante(evento.get('start')) < time_max]
+
+        termo = request.args.get('q')
+        if termo:
+            eventos = [evento for evento in eventos if termo.lower() in _texto_do_evento(evento)]
+
+        for filtro in request.args.getlist('privateExtendedProperty'):
+            chave, _, valor = filtro.partition('=')
+            eventos = [
+                evento for evento in eventos
+                if evento.get('extendedProperties', {}).get('private', {}).get(chave) == valor
+            ]
+
+    if request.args.get('orderBy') == 'startTime':
+        eventos.sort(key=lambda evento: _instante(evento.get('start')) or datetime.min.replace(tzinfo=timezone.utc))
+    else:
+        eventos.sort(key=lambda evento: evento['_sequencia'])
+
+    por_pagina = min(int(request.args.get('maxResults', RESULTADOS_POR_PAGINA_PADRAO)), RESULTADOS_POR_PAGINA_MAX)
+    inicio = int(request.args.get('pageToken', 0))
+    pagina = eventos[inicio:inicio + por_pagina]
+
+    resposta = {'kind': 'calendar#events', 'items': [_publico(evento) for evento in pagina]}
+    if inicio + por_pagina < len(eventos):
+        resposta['nextPageToken'] = str(inicio + por_pagina)
+    else:
+        resposta['nextSyncToken'] = str(sequencia_atual)
+    return jsonify(resposta)
+
+@app.route('/calendar/v3/calendars/<calendar_id>/events', methods=['POST'])
+def inserir_evento(calendar_id):
+    corpo = request.get_json(force=True)
+    with _lock:
+        agenda = _agendas.setdefault(calendar_id, {})
+        event_id = corpo.get('id') or uuid.uuid4().hex
+        if event_id in agenda:
+            return _erro(409, 'The requested identifier already exists.', 'duplicate')
+        evento = dict(corpo, id=event_id, status='confirmed', created=_agora_utc(), kind='calendar#event')
+        _registrar_mudanca(evento)
+        agenda[event_id] = evento
+        return jsonify(_publico(evento))
+
+def _evento_existente(calendar_id, event_id):
+    evento = _agendas.get(calendar_id, {}).get(event_id)
+    if evento is None:
+        return None, _erro(404, 'Not Found', 'notFound')
+    if evento.get('status') == 'cancelled':
+        return None, _erro(410, 'Resource has been deleted', 'deleted')
+    return evento, None
+
+@app.route('/calendar/v3/calendars/<calendar_id>/events/<event_id>', methods=['GET'])
+def obter_evento(calendar_id, event_id):
+    with _lock:
+        evento = _agendas.get(calendar_id, {}).get(event_id)
+        if evento is None:
+            return _erro(404, 'Not Found', 'notFound')
+        return jsonify(_publico(evento))
+
+@app.route('/calendar/v3/calendars/<calendar_id>/events/<event_id>', methods=['PUT', 'PATCH'])
+def atualizar_evento(calendar_id, event_id):
+    corpo = request.get_json(force=True)
+    with _lock:
+        evento, erro = _evento_existente(calendar_id, event_id)
+        if erro:
+            return erro
+        if request.method == 'PUT':
+            preservados = {chave: evento[chave] for chave in ('id', 'created', 'kind', 'status')}
+            evento.clear()
+            evento.update(corpo)
+            evento.update(preservados)
+        else:
+            _mesclar(evento, corpo)
+        _registrar_mudanca(evento)
+        return jsonify(_publico(evento))
+
+@app.route('/calendar/v3/calendars/<calendar_id>/events/<event_id>', methods=['DELETE'])
+def deletar_evento(calendar_id, event_id):
+    with _lock:
+        evento, erro = _evento_existente(calendar_id, event_id)
+        if erro:
+            return erro
+        # Fica como "cancelled" para aparecer na próxima sincronização incremental
+        evento['status'] = 'cancelled'
+        _registrar_mudanca(evento)
+        return ('', 204)
+
+
+# ==============================================================================
+# --- API: FREEBUSY ---
+# ==============================================================================
+
+@app.route('/calendar/v3/freeBusy', methods=['POST'])
+def consultar_freebusy():
+    corpo = request.get_json(force=True)
+    time_min = datetime.fromisoformat(corpo['timeMin'].replace('Z', '+00:00'))
+    time_max = datetime.fromisoformat(corpo['timeMax'].replace('Z', '+00:00'))
+
+    calendarios = {}
+    with _lock:
+        for item in corpo.get('items', []):
+            calendar_id = item['id']
+            if calendar_id not in _agendas:
+                calendarios[calendar_id] = {'errors': [{'domain': 'global', 'reason': 'notFound'}], 'busy': []}
+                continue
+            intervalos = []
+            for evento in _agendas[calendar_id].values():
+                if evento.get('status') == 'cancelled' or evento.get('transparency') == 'transparent':
+                    continue
+                inicio, fim = _instante(evento.get('start')), _instante(evento.get('end'))
+                if inicio and fim and fim > time_min and inicio < time_max:
+                    intervalos.append((max(inicio, time_min), min(fim, time_max)))
+            unidos = []
+            for inicio, fim in sorted(intervalos):
+                if unidos and inicio <= unidos[-1][1]:
+                    unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fim))
+                else:
+                    unidos.append((inicio, fim))
+            calendarios[calendar_id] = {'busy': [
+                {
+                    'start': inicio.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'end': fim.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                }
+                for inicio, fim in unidos
+            ]}
+    return jsonify({'kind': 'calendar#freeBusy', 'timeMin': corpo['timeMin'], 'timeMax': corpo['timeMax'], 'calendars': calendarios})
+
+
+# ==============================================================================
+# --- CONTROLE (FORA DA API) ---
+# ==============================================================================
+
+@app.route('/_controle', methods=['GET', 'POST'])
+def controle():
+    """Lê ou altera latência ('latencia_ms', 'variacao_ms') e taxas de erro ('taxa_erro', 'taxa_limite')."""
+    if request.method == 'POST':
+        for chave, valor in (request.get_json(force=True) or {}).items():
+            if chave in _config:
+                _config[chave] = float(valor)
+    return jsonify(_config)
+
+@app.route('/_controle/limpar', methods=['POST'])
+def controle_limpar():
+    """Apaga todas as agendas (os syncTokens antigos passam a dar 410)."""
+    global _sequencia
+    with _lock:
+        _agendas.clear()
+        _sequencia = 0
+    return jsonify({'ok': True})
+
+@app.route('/_controle/popular', methods=['POST'])
+def controle_popular():
+    """
+    Cria eventos de teste: {"calendar_id": ..., "quantidade": N, "dias": 365, "cpfs": 200}.
+    Os eventos caem em dias e horários aleatórios a partir de hoje, com CPF e status nas
+    propriedades privadas (como o bot grava).
+    """
+    corpo = request.get_json(force=True)
+    calendar_id = corpo['calendar_id']
+    quantidade = int(corpo.get('quantidade', 100))
+    dias = int(corpo.get('dias', 365))
+    cpfs = int(corpo.get('cpfs', 200))
+    hoje = date.today()
+    with _lock:
+        agenda = _agendas.setdefault(calendar_id, {})
+        for _ in range(quantidade):
+            inicio = datetime.combine(hoje + timedelta(days=random.randrange(dias)), datetime.min.time()) + timedelta(hours=random.randint(8, 17))
+            event_id = uuid.uuid4().hex
+            evento = {
+                'id': event_id,
+                'kind': 'calendar#event',
+                'status': 'confirmed',
+                'created': _agora_utc(),
+                'summary': f"🎉 Aluguel para Cliente Teste - R$ 1.000,00",
+                'start': {'dateTime': inicio.isoformat(), 'timeZone': 'America/Sao_Paulo'},
+                'end': {'dateTime': (inicio + timedelta(hours=4)).isoformat(), 'timeZone': 'America/Sao_Paulo'},
+                'extendedProperties': {'private': {
+                    'cpf': f"{random.randrange(cpfs):011d}",
+                    'status': random.choice(['CONFIRMADO', 'CONFIRMADO', 'PENDENTE'])
+                }}
+            }
+            _registrar_mudanca(evento)
+            agenda[event_id] = evento
+    return jsonify({'ok': True, 'total': len(agenda)})
+
+
+# ==============================================================================
+# --- EXECUÇÃO ---
+# ==============================================================================
+
+def iniciar_em_thread(porta: int = 8085):
+    """Sobe o servidor numa thread (para benchmarks no mesmo processo). Retorna o servidor."""
+    from werkzeug.serving import make_server
+    servidor = make_server('127.0.0.1', porta, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API do Google Calendar v3.")
+    parser.add_argument('--porta', type=int, default=8085)
+    parser.add_argument('--latencia-ms', type=float, default=0)
+    parser.add_argument('--variacao-ms', type=float, default=0)
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help="Fração de respostas 503")
+    parser.add_argument('--taxa-limite', type=float, default=0.0, help="Fração de respostas 403 rateLimitExceeded")
+    args = parser.parse_args()
+    _config.update({
+        'latencia_ms': args.latencia_ms, 'variacao_ms': args.variacao_ms,
+        'taxa_erro': args.taxa_erro, 'taxa_limite': args.taxa_limite
+    })
+    print(f"Agenda falsa ouvindo em http://127.0.0.1:{args.porta}/calendar/v3/")
+    app.run(host='127.0.0.1', port=args.porta, threaded=True)
@@ -134,4 +134,29 @@ CATALOGO_AVULSOS_CATEGORIZADO = {
 }
 
 # Cria a lista única de avulsos (usada em logic.py)
-CATALOGO_AVULSOS = [item for sublist in CATALOGO_AVULSOS_CATEGORIZADO.values() for item in sublist]
\ No newline at end of file
+CATALOGO_AVULSOS = [item for sublist in CATALOGO_AVULSOS_CATEGORIZADO.values() for item in sublist]
+
+def opcoes_da_etapa(tipo_combo_id: str, etapa_idx: int) -> list:
+    """Nomes dos itens que podem ser escolhidos numa etapa de um combo (na ordem exibida ao cliente)."""
+    ids_categorias = DEFINICOES_COMBOS[tipo_combo_id]['etapas'][etapa_idx]['id_cat']
+    opcoes = []
+    if 1 in ids_categorias:
+        opcoes.extend(ITENS_BRINQUEDOS_G)
+    if 4 in ids_categorias:
+        opcoes.extend(ITENS_KIT_BABY)
+    if 2 in ids_categorias:
+        opcoes.extend(ITENS_BRINQUEDOS_M)
+    if 3 in ids_categorias:
+        opcoes.extend(ITENS_BRINQUEDOS_P)
+    return opcoes
+
+def formatar_reais(valor: float) -> str:
+    """Formata um valor float para o padrão R$ X.XXX,XX (usado em logic.py e excel_sync.py)"""
+    try:
+        formatado_en = f"{valor:,.2f}"
+        temp_swap = formatado_en.replace(',', '_')
+        com_virgula = temp_swap.replace('.', ',')
+        formatado_br = com_virgula.replace('_', '.')
+        return formatado_br
+    except Exception:
+        return f"{valor:.2f}"
@@ -1,10 +1,82 @@
 # database.py
 import sqlite3
-from datetime import datetime, date # Importa 'date'
+import threading
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta, timezone # Importa 'date'
 import json # Importa 'json'
+import re
+import time
+from catalogo import CATALOGO_AVULSOS
+from estoque import cabe_no_intervalo, intervalo_de_uso, intervalo_do_dia
+from logistica import cabe_na_logistica, tarefas_da_reserva
 
 DB_NAME = 'financeiro.db'
 
+# ==============================================================================
+# --- (NOVO) GERENCIADOR DE CONEXÕES ---
+# ==============================================================================
+# Cada thread abre UMA conexão e a reaproveita (antes, cada função abria e fechava
+# a sua). O banco roda em modo WAL: leitores não esperam o escritor.
+TIMEOUT_CONEXAO = 10 # Segundos esperando o lock de escrita
+COMANDOS_EM_CACHE = 256 # Comandos preparados guardados por conexão
+CACHE_PAGINAS_KB = 8192 # cache_size (negativo no PRAGMA = KB)
+
+_local = threading.local()
+
+def _abrir_conexao() -> sqlite3.Connection:
+    """Abre uma conexão em modo autocommit (as transações são explícitas) com os PRAGMAs de desempenho."""
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=TIMEOUT_CONEXAO,
+        isolation_level=None,
+        cached_statements=COMANDOS_EM_CACHE
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") # Seguro com WAL; só o último commit pode se perder numa queda de energia
+    conn.execute(f"PRAGMA cache_size=-{CACHE_PAGINAS_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def obter_conexao() -> sqlite3.Connection:
+    """Conexão da thread atual (aberta na primeira chamada; reaberta se o DB_NAME mudar)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.db_name != DB_NAME:
+        if conn is not None:
+            conn.close()
+        conn = _abrir_conexao()
+        _local.conn = conn
+        _local.db_name = DB_NAME
+    return conn
+
+def fechar_conexao():
+    """Fecha a conexão da thread atual (ex: no fim de uma thread de trabalho)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transacao(imediata: bool = False):
+    """
+    Transação na conexão da thread: COMMIT ao sair do bloco, ROLLBACK se der erro.
+    Retorna o cursor. Com 'imediata', o lock de escrita é pego já no início (BEGIN IMMEDIATE).
+    Um bloco dentro de outro reaproveita a transação de fora.
+    O bloco pode desistir com cursor.execute("ROLLBACK") antes de sair.
+    """
+    conn = obter_conexao()
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
+    conn.execute("BEGIN IMMEDIATE" if imediata else "BEGIN")
+    try:
+        yield conn.cursor()
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    if conn.in_transaction:
+        conn.execute("COMMIT")
+
 # --- (NOVO) Função movida do logic.py ---
 def def_json_serial(obj):
     """Tradutor para o JSON salvar datas e datetimes."""
@@ -14,11 +86,17 @@ def def_json_serial(obj):
 # --- Fim da nova função ---
 
 
-def inicializar_banco():
-    """Cria as tabelas e adiciona colunas se não existirem."""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
+# ==============================================================================
+# --- (NOVO) MIGRAÇÕES VERSIONADAS DO ESQUEMA ---
+# ==============================================================================
+# Cada migração roda uma única vez e fica registrada em 'schema_migrations'.
+# Para mudar o esquema, acrescente uma nova função ao fim de MIGRACOES (nunca edite uma já aplicada).
+
+def _migracao_001_esquema_base(cursor):
+    """
+    Esquema anterior ao controle de versões. Continua idempotente (IF NOT EXISTS e
+    checagem de colunas) porque bancos antigos já têm parte dessas tabelas.
+    """
     # --- Tabela de Vendas ---
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS vendas (
@@ -64,33 +142,291 @@ def inicializar_banco():
     ''')
     # --- Fim da nova tabela ---
 
-    conn.commit()
-    conn.close()
+    # --- (NOVA TABELA) Índice local de disponibilidade (espelho da Agenda Google) ---
+    # Mantido pela sincronização incremental (syncToken) em agenda.py.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agenda_eventos (
+        id_google_calendar TEXT PRIMARY KEY,
+        data_evento TEXT NOT NULL,
+        inicio TEXT,
+        resumo TEXT,
+        status TEXT,
+        criado_em TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agenda_eventos_data ON agenda_eventos (data_evento)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_agenda_eventos_status ON agenda_eventos (status, criado_em)')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS agenda_sync (
+        calendar_id TEXT PRIMARY KEY,
+        sync_token TEXT,
+        ultima_sincronizacao TEXT
+    )
+    ''')
+    # --- Fim do índice de disponibilidade ---
+
+    # --- (NOVA TABELA) Livro de reservas (claim atômico do dia) ---
+    # A Agenda Google passa a ser um espelho assíncrono: quem decide se o dia
+    # está livre é esta tabela, dentro de uma transação BEGIN IMMEDIATE.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reservas (
+        id_google_calendar TEXT PRIMARY KEY,
+        data_evento TEXT NOT NULL,
+        horario_evento TEXT,
+        status TEXT DEFAULT 'PENDENTE',
+        criado_em TEXT,
+        corpo_evento TEXT,
+        sincronizado_agenda INTEGER DEFAULT 0
+    )
+    ''')
+    colunas_existentes_reservas = [col[1] for col in cursor.execute("PRAGMA table_info(reservas)").fetchall()]
+    if 'distancia_km' not in colunas_existentes_reservas:
+        cursor.execute('ALTER TABLE reservas ADD COLUMN distancia_km REAL')
+
+    # (NOVO) Um dia pode ter várias festas: quem limita agora é o estoque de cada item
+    cursor.execute('DROP INDEX IF EXISTS idx_reservas_dia')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservas_data ON reservas (data_evento)')
+    # (NOVO) Usado pela limpeza periódica de pendentes expirados
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservas_status ON reservas (status, criado_em)')
+    # --- Fim do livro de reservas ---
+
+    # --- (NOVA TABELA) Itens de cada reserva (índice de quantidades ao longo do tempo) ---
+    # Cada linha: quantas unidades do item a reserva ocupa no intervalo [inicio, fim).
+    # Reservas sem linhas aqui (antigas) continuam ocupando o dia inteiro.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reserva_itens (
+        id_google_calendar TEXT NOT NULL,
+        item TEXT NOT NULL,
+        quantidade INTEGER NOT NULL DEFAULT 1,
+        inicio TEXT NOT NULL,
+        fim TEXT NOT NULL,
+        PRIMARY KEY (id_google_calendar, item)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reserva_itens_item ON reserva_itens (item, inicio)')
+    # --- Fim dos itens de reserva ---
+
+def _migracao_002_indices_vendas(cursor):
+    """Índices da tabela vendas para relatórios (data), conciliação (status) e buscas por CPF."""
+    # buscar_todas_vendas: ORDER BY data_evento, horario_evento lido direto do índice (sem ordenar)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data_evento, horario_evento)')
+    # get_active_google_ids: índice de cobertura (a consulta é respondida sem tocar na tabela)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vendas_status ON vendas (status, id_google_calendar)')
+    # Histórico de um cliente, em ordem de data
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vendas_cpf ON vendas (cpf_cliente, data_evento)')
+    cursor.execute('ANALYZE vendas') # Estatísticas para o planejador escolher os índices novos
+
+def _migracao_003_venda_itens(cursor):
+    """
+    Itens de cada venda em linhas (antes, só o JSON do carrinho em vendas.itens_vendidos).
+    Um combo vira uma linha com o preço e uma linha por brinquedo escolhido (combo_pai_id).
+    As vendas antigas são convertidas a partir do JSON.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS venda_itens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        venda_id INTEGER NOT NULL,
+        item_id TEXT,
+        nome TEXT NOT NULL,
+        preco_centavos INTEGER,
+        custo_centavos INTEGER,
+        combo_pai_id INTEGER,
+        etapa TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_venda_itens_venda ON venda_itens (venda_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_venda_itens_nome ON venda_itens (nome, venda_id)')
+
+    cursor.execute("SELECT id, itens_vendidos FROM vendas WHERE itens_vendidos IS NOT NULL")
+    for venda_id, itens_json in cursor.fetchall():
+        try:
+            carrinho = json.loads(itens_json)
+        except ValueError as e:
+            print(f"AVISO: Itens da venda {venda_id} ilegíveis, não convertidos: {e}")
+            continue
+        _inserir_itens_da_venda(cursor, venda_id, carrinho)
+
+def _migracao_004_estados_compactos(cursor):
+    """
+    Reescreve os estados de conversa salvos na forma compacta (estado_compacto.py):
+    ids de eventos e de itens no lugar dos objetos completos. Mostra o ganho de espaço.
+    """
+    from estado_compacto import compactar_estado # Import local: estado_compacto importa o database
+
+    cursor.execute("SELECT chat_id, estado_json FROM conversa_estados")
+    linhas = cursor.fetchall()
+    bytes_antes = bytes_depois = 0
+    novos = []
+    for chat_id, estado_json in linhas:
+        bytes_antes += len(estado_json.encode('utf-8'))
+        try:
+            compacto_json = json.dumps(compactar_estado(json.loads(estado_json)), default=def_json_serial)
+        except Exception as e:
+            print(f"AVISO: Estado do chat {chat_id} não compactado: {e}")
+            compacto_json = estado_json
+        bytes_depois += len(compacto_json.encode('utf-8'))
+        novos.append((compacto_json, chat_id))
+    cursor.executemany("UPDATE conversa_estados SET estado_json = ? WHERE chat_id = ?", novos)
+    if linhas:
+        print(f"Estados compactados: {len(linhas)} chats, {bytes_antes} -> {bytes_depois} bytes "
+              f"({100 * (1 - bytes_depois / max(bytes_antes, 1)):.0f}% menor).")
+
+def _migracao_005_atividade_estados(cursor):
+    """
+    Última atividade de cada conversa (para expirar os estados abandonados) e a
+    tabela de arquivo para onde vão os estados expirados.
+    """
+    cursor.execute('ALTER TABLE conversa_estados ADD COLUMN ultima_atividade TEXT')
+    # Estados antigos contam a partir de agora (não sabemos quando foram usados)
+    cursor.execute("UPDATE conversa_estados SET ultima_atividade = ?", (datetime.now().isoformat(),))
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversa_estados_atividade ON conversa_estados (ultima_atividade)')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS conversa_estados_arquivo (
+        chat_id TEXT NOT NULL,
+        estado_json TEXT,
+        ultima_atividade TEXT,
+        arquivado_em TEXT NOT NULL
+    )
+    ''')
+
+def _migracao_006_versao_estados(cursor):
+    """Versão de cada estado de conversa (compare-and-swap entre processos, ver estado_store.py)."""
+    cursor.execute('ALTER TABLE conversa_estados ADD COLUMN versao INTEGER NOT NULL DEFAULT 1')
+
+def _migracao_007_telegram_file_ids(cursor):
+    """file_id das imagens já enviadas ao Telegram, por caminho e hash do conteúdo (ver midia_telegram.py)."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS telegram_file_ids (
+        caminho TEXT PRIMARY KEY,
+        hash_conteudo TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        atualizado_em TEXT NOT NULL
+    )
+    ''')
+
+def _migracao_008_espelho_agenda(cursor):
+    """
+    Fila persistente (outbox) das escritas na Agenda Google: cada mudança no livro grava,
+    na mesma transação, a operação a espelhar. Só sai da fila depois que a API aceitou.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS espelho_agenda (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        operacao TEXT NOT NULL,
+        id_google_calendar TEXT NOT NULL,
+        criado_em TEXT NOT NULL,
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        proxima_tentativa TEXT NOT NULL,
+        ultimo_erro TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_espelho_agenda_evento ON espelho_agenda (id_google_calendar)')
+    # Reservas que ficaram só no livro (antes a fila era em memória)
+    agora = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    cursor.execute('''
+    INSERT INTO espelho_agenda (operacao, id_google_calendar, criado_em, proxima_tentativa)
+    SELECT 'inserir', id_google_calendar, ?, ? FROM reservas
+    WHERE sincronizado_agenda = 0 AND corpo_evento IS NOT NULL AND status IN ('PENDENTE', 'CONFIRMADO')
+    ''', (agora, agora))
+
+MIGRACOES = [
+    (1, 'esquema_base', _migracao_001_esquema_base),
+    (2, 'indices_vendas', _migracao_002_indices_vendas),
+    (3, 'venda_itens', _migracao_003_venda_itens),
+    (4, 'estados_compactos', _migracao_004_estados_compactos),
+    (5, 'atividade_estados', _migracao_005_atividade_estados),
+    (6, 'versao_estados', _migracao_006_versao_estados),
+    (7, 'telegram_file_ids', _migracao_007_telegram_file_ids),
+    (8, 'espelho_agenda', _migracao_008_espelho_agenda),
+]
+
+def aplicar_migracoes():
+    """
+    Aplica, em ordem, as migrações ainda não registradas. Tudo numa transação
+    BEGIN IMMEDIATE: se dois processos sobem juntos, só um aplica.
+    """
+    with transacao(imediata=True) as cursor:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            versao INTEGER PRIMARY KEY,
+            nome TEXT NOT NULL,
+            aplicada_em TEXT NOT NULL
+        )
+        ''')
+        cursor.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_migrations")
+        versao_atual = cursor.fetchone()[0]
+        for versao, nome, migracao in MIGRACOES:
+            if versao <= versao_atual:
+                continue
+            migracao(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (versao, nome, aplicada_em) VALUES (?, ?, ?)",
+                (versao, nome, datetime.now().isoformat())
+            )
+            print(f"Migração {versao:03d} ({nome}) aplicada.")
+
+def inicializar_banco():
+    """Cria ou atualiza o esquema do banco (só as migrações pendentes rodam)."""
+    aplicar_migracoes()
 
 # ==============================================================================
 # --- FUNÇÕES DE VENDAS (Existentes) ---
 # ==============================================================================
 
-def registrar_venda(id_google, data_evento, horario_evento, nome, cpf, endereco, itens_json, faturamento, custo_op, lucro, distancia_km, custo_combustivel, frete_valor_pago, status_pagamento: str = 'CONFIRMADO'):
-    """Insere uma nova venda no banco (podendo ser pendente ou confirmada)."""
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
+# --- (NOVO) Itens da venda em linhas (tabela venda_itens) ---
+_IDS_AVULSOS = {item['nome']: str(item['id']) for item in CATALOGO_AVULSOS}
+
+def _texto_para_centavos(texto):
+    """'R$ 1.400,00', 'A partir de R$ 800,00' ou 'R$ 500,00 (cada)' -> 140000 / 80000 / 50000 (None se não houver valor)."""
+    encontrado = re.search(r'\d{1,3}(?:\.\d{3})*,\d{2}', texto or '')
+    if not encontrado:
+        return None
+    return int(encontrado.group().replace('.', '').replace(',', ''))
+
+def _inserir_itens_da_venda(cursor, venda_id: int, carrinho: list):
+    """Grava o carrinho em venda_itens (combos: uma linha do combo + uma por brinquedo escolhido)."""
+    for item in carrinho:
         cursor.execute('''
-        INSERT INTO vendas (
-            id_google_calendar, data_confirmacao, data_evento, horario_evento, nome_cliente, 
-            cpf_cliente, endereco, itens_vendidos, faturamento_bruto, 
-            custo_operacional, lucro_liquido, distancia_km, custo_combustivel, 
-            frete_valor_pago, status_pagamento 
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO venda_itens (venda_id, item_id, nome, preco_centavos, custo_centavos)
+        VALUES (?, ?, ?, ?, ?)
         ''', (
-            id_google, datetime.now().isoformat(), data_evento, horario_evento, nome, cpf, 
-            endereco, itens_json, faturamento, custo_op, lucro, 
-            distancia_km, custo_combustivel, frete_valor_pago, status_pagamento
+            venda_id, str(item.get('id')) if item.get('id') is not None else None, item.get('nome', 'Item desconhecido'),
+            _texto_para_centavos(item.get('preco')), _texto_para_centavos(item.get('custo'))
         ))
-        conn.commit()
-        conn.close()
+        combo_pai_id = cursor.lastrowid
+        escolhidos = [
+            (venda_id, _IDS_AVULSOS.get(nome), nome, combo_pai_id, etapa)
+            for etapa, nomes in item.get('descricao_custom', {}).items()
+            for nome in nomes
+        ]
+        if escolhidos:
+            cursor.executemany('''
+            INSERT INTO venda_itens (venda_id, item_id, nome, combo_pai_id, etapa)
+            VALUES (?, ?, ?, ?, ?)
+            ''', escolhidos)
+
+def registrar_venda(id_google, data_evento, horario_evento, nome, cpf, endereco, carrinho, faturamento, custo_op, lucro, distancia_km, custo_combustivel, frete_valor_pago, status_pagamento: str = 'CONFIRMADO'):
+    """
+    Insere uma nova venda no banco (podendo ser pendente ou confirmada).
+    (NOVO) Os itens do 'carrinho' vão para a tabela venda_itens, na mesma transação.
+    """
+    try:
+        with transacao() as cursor:
+            cursor.execute('''
+            INSERT INTO vendas (
+                id_google_calendar, data_confirmacao, data_evento, horario_evento, nome_cliente, 
+                cpf_cliente, endereco, faturamento_bruto, 
+                custo_operacional, lucro_liquido, distancia_km, custo_combustivel, 
+                frete_valor_pago, status_pagamento 
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                id_google, datetime.now().isoformat(), data_evento, horario_evento, nome, cpf, 
+                endereco, faturamento, custo_op, lucro, 
+                distancia_km, custo_combustivel, frete_valor_pago, status_pagamento
+            ))
+            _inserir_itens_da_venda(cursor, cursor.lastrowid, carrinho)
         print(f"SUCESSO: Venda registrada no DB para {nome} (Status: {status_pagamento})")
     except Exception as e:
         print(f"ERRO ao registrar venda no DB: {e}")
@@ -98,15 +434,12 @@ def registrar_venda(id_google, data_evento, horario_evento, nome, cpf, endereco,
 def atualizar_status_pagamento(id_google, novo_status):
     """Atualiza o status de pagamento de uma venda (ex: PENDENTE -> CONFIRMADO)."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute('''
-        UPDATE vendas 
-        SET status_pagamento = ?
-        WHERE id_google_calendar = ?
-        ''', (novo_status, id_google))
-        conn.commit()
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute('''
+            UPDATE vendas 
+            SET status_pagamento = ?
+            WHERE id_google_calendar = ?
+            ''', (novo_status, id_google))
         print(f"SUCESSO: Status de pagamento do {id_google} atualizado para {novo_status}.")
     except Exception as e:
         print(f"ERRO ao atualizar status de pagamento no DB: {e}")
@@ -114,63 +447,57 @@ def atualizar_status_pagamento(id_google, novo_status):
 def deletar_venda_por_id_google(id_google):
     """Remove uma venda do DB (usado para reservas pendentes expiradas)."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM vendas WHERE id_google_calendar = ?",
-            (id_google,)
-        )
-        conn.commit()
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute(
+                "DELETE FROM venda_itens WHERE venda_id IN (SELECT id FROM vendas WHERE id_google_calendar = ?)",
+                (id_google,)
+            )
+            cursor.execute(
+                "DELETE FROM vendas WHERE id_google_calendar = ?",
+                (id_google,)
+            )
         print(f"SUCESSO: Venda pendente/expirada {id_google} deletada do DB.")
     except Exception as e:
         print(f"ERRO ao deletar venda pendente do DB: {e}")
 
 def buscar_todas_vendas():
     """Busca todas as vendas registradas no banco de dados."""
-    conn = None
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                id, id_google_calendar, data_evento, horario_evento, nome_cliente, cpf_cliente, endereco, 
-                itens_vendidos, faturamento_bruto, custo_operacional, lucro_liquido, distancia_km, 
-                custo_combustivel, frete_valor_pago, status_pagamento
-            FROM vendas 
-            ORDER BY data_evento, horario_evento
-        """)
-        
-        vendas = cursor.fetchall()
+        with transacao() as cursor:
+            cursor.execute("""
+                SELECT 
+                    id, id_google_calendar, data_evento, horario_evento, nome_cliente, cpf_cliente, endereco, 
+                    itens_vendidos, faturamento_bruto, custo_operacional, lucro_liquido, distancia_km, 
+                    custo_combustivel, frete_valor_pago, status_pagamento
+                FROM vendas 
+                ORDER BY data_evento, horario_evento
+            """)
+            vendas = cursor.fetchall()
         return vendas
     except sqlite3.Error as e:
         print(f"Erro ao buscar todas as vendas: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
+
+def _cancelar_venda(cursor, id_google):
+    cursor.execute('''
+    UPDATE vendas 
+    SET status = 'CANCELADO', 
+        status_pagamento = 'CANCELADO', 
+        faturamento_bruto = 0, 
+        custo_operacional = 0, 
+        lucro_liquido = 0,
+        distancia_km = 0,
+        custo_combustivel = 0,
+        frete_valor_pago = 0,
+        horario_evento = NULL
+    WHERE id_google_calendar = ?
+    ''', (id_google,))
 
 def cancelar_venda_por_id(id_google):
     """Atualiza o status para 'CANCELADO' e zera os valores."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute('''
-        UPDATE vendas 
-        SET status = 'CANCELADO', 
-            status_pagamento = 'CANCELADO', 
-            faturamento_bruto = 0, 
-            custo_operacional = 0, 
-            lucro_liquido = 0,
-            distancia_km = 0,
-            custo_combustivel = 0,
-            frete_valor_pago = 0,
-            horario_evento = NULL
-        WHERE id_google_calendar = ?
-        ''', (id_google,))
-        conn.commit()
-        conn.close()
+        with transacao() as cursor:
+            _cancelar_venda(cursor, id_google)
         print(f"SUCESSO: Venda {id_google} cancelada no DB.")
     except Exception as e:
         print(f"ERRO ao cancelar venda no DB: {e}")
@@ -178,32 +505,85 @@ def cancelar_venda_por_id(id_google):
 def atualizar_data_horario_venda(id_google, nova_data_evento, novo_horario_evento):
     """Atualiza a data e o horário do evento (remarcação)."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute('''
-        UPDATE vendas 
-        SET data_evento = ?, horario_evento = ? 
-        WHERE id_google_calendar = ?
-        ''', (nova_data_evento, novo_horario_evento, id_google))
-        conn.commit()
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute('''
+            UPDATE vendas 
+            SET data_evento = ?, horario_evento = ? 
+            WHERE id_google_calendar = ?
+            ''', (nova_data_evento, novo_horario_evento, id_google))
         print(f"SUCESSO: Venda {id_google} remarcada no DB para {nova_data_evento} às {novo_horario_evento}.")
     except Exception as e:
         print(f"ERRO ao remarcar venda no DB: {e}")
 
+def buscar_id_venda_por_id_google(id_google):
+    """Retorna o ID (na tabela vendas) da venda ligada a um evento da agenda, ou None."""
+    try:
+        with transacao() as cursor:
+            cursor.execute("SELECT id FROM vendas WHERE id_google_calendar = ?", (id_google,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"ERRO ao buscar ID da venda para {id_google}: {e}")
+        return None
+
 def get_active_google_ids():
     """Busca todos os IDs do Google Calendar que estão com status 'CONFIRMADO'."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id_google_calendar FROM vendas WHERE status = 'CONFIRMADO'")
-        ids = [row[0] for row in cursor.fetchall() if row[0] is not None]
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute("SELECT id_google_calendar FROM vendas WHERE status = 'CONFIRMADO'")
+            ids = [row[0] for row in cursor.fetchall() if row[0] is not None]
         return ids
     except Exception as e:
         print(f"ERRO ao buscar IDs ativos do DB: {e}")
         return []
 
+# ==============================================================================
+# --- (NOVAS FUNÇÕES) ITENS DAS VENDAS E RELATÓRIOS ---
+# ==============================================================================
+
+def db_itens_das_vendas() -> dict:
+    """
+    Itens de todas as vendas, numa só consulta: {venda_id: [(nome, preco_centavos, etapa), ...]}.
+    Os brinquedos escolhidos de um combo vêm logo depois da linha do combo (com 'etapa').
+    """
+    try:
+        with transacao() as cursor:
+            cursor.execute('''
+            SELECT venda_id, nome, preco_centavos, etapa FROM venda_itens
+            ORDER BY venda_id, COALESCE(combo_pai_id, id), id
+            ''')
+            itens = {}
+            for venda_id, nome, preco_centavos, etapa in cursor.fetchall():
+                itens.setdefault(venda_id, []).append((nome, preco_centavos, etapa))
+        return itens
+    except Exception as e:
+        print(f"ERRO ao buscar os itens das vendas: {e}")
+        return {}
+
+def db_relatorio_itens(data_inicio: str, data_fim: str) -> list:
+    """
+    Quantas vezes cada item foi alugado em vendas confirmadas com festa entre 'data_inicio'
+    e 'data_fim' (inclusive), e quanto faturou (centavos; brinquedos de combo entram no
+    preço do combo). Retorna [(nome, vezes, faturamento_centavos)], do mais alugado ao menos.
+    """
+    try:
+        with transacao() as cursor:
+            cursor.execute('''
+            SELECT vi.nome, COUNT(*), COALESCE(SUM(vi.preco_centavos), 0)
+            FROM vendas v
+            JOIN venda_itens vi ON vi.venda_id = v.id
+            WHERE v.data_evento BETWEEN ? AND ?
+              AND v.status = 'CONFIRMADO'
+              AND v.status_pagamento = 'CONFIRMADO'
+            GROUP BY vi.nome
+            ORDER BY COUNT(*) DESC, vi.nome
+            ''', (data_inicio, data_fim))
+            relatorio = cursor.fetchall()
+        return relatorio
+    except Exception as e:
+        print(f"ERRO ao gerar o relatório de itens: {e}")
+        return []
+
 # ==============================================================================
 # --- (NOVAS FUNÇÕES) GERENCIAMENTO DE ESTADO DA CONVERSA ---
 # ==============================================================================
@@ -215,11 +595,9 @@ def db_carregar_todos_estados():
     # é melhor carregar usuário por usuário.
     print("Carregando todos os estados de conversa do DB...")
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT chat_id, estado_json FROM conversa_estados")
-        rows = cursor.fetchall()
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute("SELECT chat_id, estado_json FROM conversa_estados")
+            rows = cursor.fetchall()
         
         user_states = {}
         for row in rows:
@@ -237,11 +615,9 @@ def db_carregar_todos_estados():
 def db_carregar_estado_usuario(chat_id: str) -> dict:
     """Carrega o estado de um usuário específico do DB."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT estado_json FROM conversa_estados WHERE chat_id = ?", (chat_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute("SELECT estado_json FROM conversa_estados WHERE chat_id = ?", (chat_id,))
+            row = cursor.fetchone()
         
         if row:
             # Encontrado, decodifica o JSON e retorna
@@ -259,15 +635,16 @@ def db_salvar_estado_usuario(chat_id: str, estado_dict: dict):
         # Converte o dicionário Python para uma string JSON
         estado_json = json.dumps(estado_dict, default=def_json_serial)
         
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        # INSERT OR REPLACE (UPSERT): Insere se for novo, substitui se já existir
-        cursor.execute('''
-        INSERT OR REPLACE INTO conversa_estados (chat_id, estado_json)
-        VALUES (?, ?)
-        ''', (chat_id, estado_json))
-        conn.commit()
-        conn.close()
+        with transacao() as cursor:
+            # UPSERT: insere se for novo; se já existir, substitui e avança a versão
+            cursor.execute('''
+            INSERT INTO conversa_estados (chat_id, estado_json, ultima_atividade, versao)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                estado_json = excluded.estado_json,
+                ultima_atividade = excluded.ultima_atividade,
+                versao = conversa_estados.versao + 1
+            ''', (chat_id, estado_json, datetime.now().isoformat(), versao_inicial()))
         # print(f"Estado salvo para {chat_id}") # (Opcional: pode poluir o log)
     except Exception as e:
         print(f"ERRO CRÍTICO ao salvar estado para {chat_id}: {e}")
@@ -275,11 +652,785 @@ def db_salvar_estado_usuario(chat_id: str, estado_dict: dict):
 def db_deletar_estado_usuario(chat_id: str):
     """Remove o estado de um usuário do DB (quando ele volta ao menu principal)."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM conversa_estados WHERE chat_id = ?", (chat_id,))
-        conn.commit()
-        conn.close()
+        with transacao() as cursor:
+            cursor.execute("DELETE FROM conversa_estados WHERE chat_id = ?", (chat_id,))
         print(f"Estado limpo para {chat_id} (sessão finalizada).")
     except Exception as e:
-        print(f"ERRO ao deletar estado para {chat_id}: {e}")
\ No newline at end of file
+        print(f"ERRO ao deletar estado para {chat_id}: {e}")
+
+def versao_inicial() -> int:
+    """
+    (NOVO) Versão de um estado recém-criado: microssegundos do relógio. Um chat que teve o
+    estado removido e recriado não repete versões antigas (um CAS velho não passa por engano).
+    """
+    return time.time_ns() // 1000
+
+def db_gravar_estados_cas(itens: list, chats_ativos: list = None):
+    """
+    (NOVO) Compare-and-swap de vários estados numa única transação.
+    'itens' é uma lista de (chat_id, estado_json ou None para remover, versao_esperada);
+    versao_esperada 0 = o chat não tinha estado. Cada item só é gravado se a versão
+    no banco ainda for a esperada (senão outro processo gravou antes: conflito).
+    'chats_ativos' só têm a última atividade renovada.
+    Retorna {chat_id: nova_versao (0 = removido) ou None se houve conflito}; None se o banco falhou.
+    """
+    agora = datetime.now().isoformat()
+    resultado = {}
+    try:
+        with transacao(imediata=True) as cursor:
+            for chat_id, estado_json, versao_esperada in itens:
+                if estado_json is None:
+                    if versao_esperada:
+                        cursor.execute(
+                            "DELETE FROM conversa_estados WHERE chat_id = ? AND versao = ?",
+                            (chat_id, versao_esperada)
+                        )
+                        resultado[chat_id] = 0 if cursor.rowcount else None
+                    else:
+                        cursor.execute("SELECT 1 FROM conversa_estados WHERE chat_id = ?", (chat_id,))
+                        resultado[chat_id] = None if cursor.fetchone() else 0
+                elif versao_esperada:
+                    cursor.execute('''
+                    UPDATE conversa_estados SET estado_json = ?, ultima_atividade = ?, versao = versao + 1
+                    WHERE chat_id = ? AND versao = ?
+                    ''', (estado_json, agora, chat_id, versao_esperada))
+                    resultado[chat_id] = versao_esperada + 1 if cursor.rowcount else None
+                else:
+                    nova_versao = versao_inicial()
+                    cursor.execute('''
+                    INSERT OR IGNORE INTO conversa_estados (chat_id, estado_json, ultima_atividade, versao)
+                    VALUES (?, ?, ?, ?)
+                    ''', (chat_id, estado_json, agora, nova_versao))
+                    resultado[chat_id] = nova_versao if cursor.rowcount else None
+            if chats_ativos:
+                cursor.executemany(
+                    "UPDATE conversa_estados SET ultima_atividade = ? WHERE chat_id = ?",
+                    [(agora, chat_id) for chat_id in chats_ativos]
+                )
+        return resultado
+    except Exception as e:
+        print(f"ERRO CRÍTICO ao gravar lote de {len(itens)} estados: {e}")
+        return None
+
+def db_expirar_estados_ociosos(limite_atividade: str, arquivar: bool = True) -> list:
+    """
+    (NOVO) Remove os estados sem atividade desde 'limite_atividade' (ISO) e retorna os chat_ids removidos.
+    Com 'arquivar', eles são copiados antes para conversa_estados_arquivo.
+    Nunca toca em quem aguarda a confirmação de um pagamento cuja reserva pendente ainda existe.
+    """
+    with transacao(imediata=True) as cursor:
+        cursor.execute('''
+        SELECT c.chat_id FROM (
+            SELECT chat_id, CASE WHEN json_valid(estado_json) THEN estado_json END AS estado
+            FROM conversa_estados WHERE ultima_atividade < ?
+        ) AS c
+        WHERE NOT (
+            json_extract(c.estado, '$.estado') = 'aguardando_confirmacao_pagamento'
+            AND EXISTS (
+                SELECT 1 FROM reservas AS r
+                WHERE r.id_google_calendar = json_extract(c.estado, '$.pending_event_id')
+                  AND r.status = 'PENDENTE'
+            )
+        )
+        ''', (limite_atividade,))
+        chats = [row[0] for row in cursor.fetchall()]
+        if not chats:
+            return []
+        parametros = [(chat_id,) for chat_id in chats]
+        if arquivar:
+            agora = datetime.now().isoformat()
+            cursor.executemany('''
+            INSERT INTO conversa_estados_arquivo (chat_id, estado_json, ultima_atividade, arquivado_em)
+            SELECT chat_id, estado_json, ultima_atividade, ? FROM conversa_estados WHERE chat_id = ?
+            ''', [(agora, chat_id) for chat_id in chats])
+        cursor.executemany("DELETE FROM conversa_estados WHERE chat_id = ?", parametros)
+    return chats
+
+def db_ler_estado_versionado(chat_id: str):
+    """(NOVO) (JSON do estado sem decodificar, versão) de um chat; (None, 0) se não houver."""
+    with transacao() as cursor:
+        cursor.execute("SELECT estado_json, versao FROM conversa_estados WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+def db_versao_estado(chat_id: str) -> int:
+    """(NOVO) Só a versão do estado de um chat (0 se não houver)."""
+    with transacao() as cursor:
+        cursor.execute("SELECT versao FROM conversa_estados WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+def db_reservas_pendentes(ids_google: list) -> set:
+    """(NOVO) Quais dos ids ainda são reservas PENDENTES no livro local."""
+    if not ids_google:
+        return set()
+    marcadores = ", ".join("?" * len(ids_google))
+    with transacao() as cursor:
+        cursor.execute(
+            f"SELECT id_google_calendar FROM reservas WHERE status = 'PENDENTE' AND id_google_calendar IN ({marcadores})",
+            list(ids_google)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+# ==============================================================================
+# --- (NOVAS FUNÇÕES) ÍNDICE LOCAL DE DISPONIBILIDADE (AGENDA) ---
+# ==============================================================================
+
+def db_obter_sync_token(calendar_id: str):
+    """Retorna o último syncToken salvo para a agenda (ou None se nunca sincronizou)."""
+    try:
+        with transacao() as cursor:
+            cursor.execute("SELECT sync_token FROM agenda_sync WHERE calendar_id = ?", (calendar_id,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"ERRO ao ler syncToken da agenda: {e}")
+        return None
+
+def db_atualizar_indice_agenda(calendar_id: str, eventos: list, ids_removidos: list, sync_token: str = None, sincronizacao_completa: bool = False, token_lido: str = None):
+    """
+    Aplica um lote de alterações da Agenda no índice local, numa única transação.
+    'eventos' é uma lista de tuplas (id, data_evento, inicio, resumo, status, criado_em).
+    Se 'sincronizacao_completa' for True, o índice é recriado do zero.
+    (NOVO) Com 'sync_token' (resultado de uma sincronização), só aplica se o token salvo ainda
+    for o 'token_lido' no início dela: se outra sincronização (a do bot assíncrono ou a das
+    threads) já avançou o índice, este lote mais velho é descartado.
+    """
+    try:
+        with transacao(imediata=True) as cursor:
+            if sync_token:
+                cursor.execute("SELECT sync_token FROM agenda_sync WHERE calendar_id = ?", (calendar_id,))
+                row = cursor.fetchone()
+                if (row[0] if row else None) != token_lido:
+                    print("Info: Outra sincronização já atualizou o índice da agenda. Descartando este lote.")
+                    return True
+            if sincronizacao_completa:
+                cursor.execute("DELETE FROM agenda_eventos")
+            if eventos:
+                cursor.executemany('''
+                INSERT OR REPLACE INTO agenda_eventos (id_google_calendar, data_evento, inicio, resumo, status, criado_em)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', eventos)
+            if ids_removidos:
+                cursor.executemany(
+                    "DELETE FROM agenda_eventos WHERE id_google_calendar = ?",
+                    [(event_id,) for event_id in ids_removidos]
+                )
+            if sync_token:
+                cursor.execute('''
+                INSERT OR REPLACE INTO agenda_sync (calendar_id, sync_token, ultima_sincronizacao)
+                VALUES (?, ?, ?)
+                ''', (calendar_id, sync_token, datetime.now().isoformat()))
+        return True
+    except Exception as e:
+        print(f"ERRO ao atualizar o índice local da agenda: {e}")
+        return False
+
+def db_eventos_do_indice(ids_google: list) -> dict:
+    """(NOVO) Início e resumo dos eventos pedidos, lidos do índice local: {id: (inicio, resumo)}."""
+    if not ids_google:
+        return {}
+    marcadores = ", ".join("?" * len(ids_google))
+    with transacao() as cursor:
+        cursor.execute(
+            f"SELECT id_google_calendar, inicio, resumo FROM agenda_eventos WHERE id_google_calendar IN ({marcadores})",
+            list(ids_google)
+        )
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+def db_dias_ocupados_no_periodo(data_inicio: str, data_fim: str, limite_pendente: str) -> set:
+    """
+    Retorna o conjunto de datas (ISO) ocupadas entre 'data_inicio' e 'data_fim' (inclusive).
+    Eventos PENDENTES criados antes de 'limite_pendente' (expirados) não contam.
+    Para as reservas do livro vale o livro (status e data atuais), não o índice da Agenda:
+    uma cancelada, expirada ou remarcada cujo espelho ainda está na fila não ocupa o dia antigo.
+    """
+    try:
+        with transacao() as cursor:
+            cursor.execute('''
+            SELECT data_evento FROM agenda_eventos
+            WHERE data_evento BETWEEN ? AND ?
+              AND NOT (status = 'PENDENTE' AND criado_em < ?)
+              AND id_google_calendar NOT IN (SELECT id_google_calendar FROM reservas)
+            UNION
+            SELECT data_evento FROM reservas
+            WHERE data_evento BETWEEN ? AND ?
+              AND status IN ('PENDENTE', 'CONFIRMADO')
+              AND NOT (status = 'PENDENTE' AND criado_em < ?)
+            ''', (data_inicio, data_fim, limite_pendente, data_inicio, data_fim, limite_pendente))
+            dias = {row[0] for row in cursor.fetchall()}
+        return dias
+    except Exception as e:
+        print(f"ERRO ao consultar dias ocupados no índice local: {e}")
+        return set()
+
+def _dias_bloqueados_inteiros(cursor, data_inicio: str, data_fim: str, limite_pendente: str, ignorar_id: str = None) -> set:
+    """
+    Dias ocupados por inteiro: eventos da agenda que não vieram do livro (ex: marcados à mão)
+    e reservas antigas, sem itens registrados.
+    """
+    cursor.execute('''
+    SELECT data_evento FROM agenda_eventos
+    WHERE data_evento BETWEEN ? AND ?
+      AND NOT (status = 'PENDENTE' AND criado_em < ?)
+      AND id_google_calendar NOT IN (SELECT id_google_calendar FROM reservas)
+    UNION
+    SELECT r.data_evento FROM reservas r
+    WHERE r.data_evento BETWEEN ? AND ?
+      AND r.status IN ('PENDENTE', 'CONFIRMADO')
+      AND NOT (r.status = 'PENDENTE' AND r.criado_em < ?)
+      AND r.id_google_calendar IS NOT ?
+      AND NOT EXISTS (SELECT 1 FROM reserva_itens ri WHERE ri.id_google_calendar = r.id_google_calendar)
+    ''', (data_inicio, data_fim, limite_pendente, data_inicio, data_fim, limite_pendente, ignorar_id))
+    return {row[0] for row in cursor.fetchall()}
+
+def _dias_com_reserva(cursor, data_inicio: str, data_fim: str, limite_pendente: str, ignorar_id: str = None) -> set:
+    """Dias com qualquer reserva ativa (usado quando a reserva nova não tem itens e ocupa o dia todo)."""
+    cursor.execute('''
+    SELECT DISTINCT data_evento FROM reservas
+    WHERE data_evento BETWEEN ? AND ?
+      AND status IN ('PENDENTE', 'CONFIRMADO')
+      AND NOT (status = 'PENDENTE' AND criado_em < ?)
+      AND id_google_calendar IS NOT ?
+    ''', (data_inicio, data_fim, limite_pendente, ignorar_id))
+    return {row[0] for row in cursor.fetchall()}
+
+def _ocupacoes_dos_itens(cursor, itens, inicio: str, fim: str, limite_pendente: str, ignorar_id: str = None) -> dict:
+    """
+    Reservas ativas dos 'itens' que cruzam [inicio, fim): {item: [(inicio, fim, quantidade), ...]}.
+    Usa o índice (item, inicio) da tabela reserva_itens.
+    """
+    ocupacoes = {}
+    for item in itens:
+        cursor.execute('''
+        SELECT ri.inicio, ri.fim, ri.quantidade FROM reserva_itens ri
+        JOIN reservas r ON r.id_google_calendar = ri.id_google_calendar
+        WHERE ri.item = ? AND ri.inicio < ? AND ri.fim > ?
+          AND r.status IN ('PENDENTE', 'CONFIRMADO')
+          AND NOT (r.status = 'PENDENTE' AND r.criado_em < ?)
+          AND r.id_google_calendar IS NOT ?
+        ''', (item, fim, inicio, limite_pendente, ignorar_id))
+        ocupacoes[item] = cursor.fetchall()
+    return ocupacoes
+
+def db_ocupacao_no_periodo(data_inicio: str, data_fim: str, itens: dict, limite_pendente: str, ignorar_id: str = None):
+    """
+    Dados para responder "em que dias este carrinho cabe" num período inteiro, numa só conexão.
+    Retorna (dias_bloqueados, ocupacoes): os dias em que nada cabe e, por item, as
+    reservas ativas [(inicio, fim, quantidade)] do período. 'ignorar_id' exclui a
+    própria reserva (remarcação). Sem itens, qualquer reserva ativa bloqueia o dia.
+    """
+    try:
+        with transacao() as cursor:
+            dias_bloqueados = _dias_bloqueados_inteiros(cursor, data_inicio, data_fim, limite_pendente, ignorar_id)
+            if not itens:
+                dias_bloqueados |= _dias_com_reserva(cursor, data_inicio, data_fim, limite_pendente, ignorar_id)
+            inicio = intervalo_do_dia(date.fromisoformat(data_inicio))[0]
+            fim = intervalo_do_dia(date.fromisoformat(data_fim))[1]
+            ocupacoes = _ocupacoes_dos_itens(cursor, itens, inicio, fim, limite_pendente, ignorar_id)
+        return dias_bloqueados, ocupacoes
+    except Exception as e:
+        print(f"ERRO ao consultar a ocupação dos itens no período: {e}")
+        raise
+
+def db_itens_da_reserva(id_google: str) -> dict:
+    """Retorna {item: quantidade} de uma reserva (vazio para reservas antigas, sem itens)."""
+    try:
+        with transacao() as cursor:
+            cursor.execute("SELECT item, quantidade FROM reserva_itens WHERE id_google_calendar = ?", (id_google,))
+            itens = dict(cursor.fetchall())
+        return itens
+    except Exception as e:
+        print(f"ERRO ao buscar os itens da reserva {id_google}: {e}")
+        return {}
+
+
+# ==============================================================================
+# --- (NOVAS FUNÇÕES) LIVRO DE RESERVAS (CLAIM ATÔMICO) ---
+# ==============================================================================
+
+def _tarefas_logisticas(cursor, data_evento: str, limite_pendente: str, ignorar_id: str = None) -> list:
+    """
+    Entregas e recolhimentos das reservas ativas em volta do dia (véspera ao dia seguinte,
+    pois uma festa tardia pode ter o recolhimento depois da meia-noite).
+    Reservas sem distância no livro usam a da venda; sem nenhuma, a distância padrão.
+    """
+    dia = date.fromisoformat(data_evento)
+    cursor.execute('''
+    SELECT r.data_evento, r.horario_evento, COALESCE(r.distancia_km, v.distancia_km)
+    FROM reservas r
+    LEFT JOIN vendas v ON v.id_google_calendar = r.id_google_calendar
+    WHERE r.data_evento BETWEEN ? AND ?
+      AND r.horario_evento IS NOT NULL
+      AND r.status IN ('PENDENTE', 'CONFIRMADO')
+      AND NOT (r.status = 'PENDENTE' AND r.criado_em < ?)
+      AND r.id_google_calendar IS NOT ?
+    ''', (
+        (dia - timedelta(days=1)).isoformat(), (dia + timedelta(days=1)).isoformat(),
+        limite_pendente, ignorar_id
+    ))
+    tarefas = []
+    for data_reserva, horario_reserva, distancia_km in cursor.fetchall():
+        tarefas.extend(tarefas_da_reserva(data_reserva, horario_reserva, distancia_km))
+    return tarefas
+
+def _ha_vaga(cursor, data_evento: str, horario_evento: str, itens: dict, limite_pendente: str, ignorar_id: str = None, distancia_km: float = None) -> bool:
+    """
+    True se a reserva cabe: o dia não está bloqueado por inteiro, cada item tem
+    unidades livres no intervalo de uso e há veículo e equipe para entregar e recolher.
+    Sem itens, a reserva precisa do dia vazio.
+    """
+    if _dias_bloqueados_inteiros(cursor, data_evento, data_evento, limite_pendente, ignorar_id):
+        return False
+    if not itens:
+        return not _dias_com_reserva(cursor, data_evento, data_evento, limite_pendente, ignorar_id)
+    inicio, fim = intervalo_de_uso(data_evento, horario_evento)
+    ocupacoes = _ocupacoes_dos_itens(cursor, itens, inicio, fim, limite_pendente, ignorar_id)
+    if not cabe_no_intervalo(itens, ocupacoes, inicio, fim):
+        return False
+    return cabe_na_logistica(
+        _tarefas_logisticas(cursor, data_evento, limite_pendente, ignorar_id),
+        tarefas_da_reserva(data_evento, horario_evento, distancia_km)
+    )
+
+def db_tarefas_logisticas(data_evento: str, limite_pendente: str, ignorar_id: str = None) -> list:
+    """Entregas/recolhimentos já reservados em volta do dia, para o planejador de horários."""
+    try:
+        with transacao() as cursor:
+            tarefas = _tarefas_logisticas(cursor, data_evento, limite_pendente, ignorar_id)
+        return tarefas
+    except Exception as e:
+        print(f"ERRO ao buscar as tarefas de entrega do dia {data_evento}: {e}")
+        raise
+
+def _distancia_da_reserva(cursor, id_google: str):
+    """Distância (km, só ida) de uma reserva: a do livro ou, para as antigas, a da venda."""
+    cursor.execute('''
+    SELECT COALESCE(
+        (SELECT distancia_km FROM reservas WHERE id_google_calendar = ?),
+        (SELECT distancia_km FROM vendas WHERE id_google_calendar = ?)
+    )
+    ''', (id_google, id_google))
+    return cursor.fetchone()[0]
+
+def db_distancia_da_reserva(id_google: str):
+    """Distância (km, só ida) de uma reserva: a do livro ou, para as antigas, a da venda."""
+    try:
+        with transacao() as cursor:
+            distancia_km = _distancia_da_reserva(cursor, id_google)
+        return distancia_km
+    except Exception as e:
+        print(f"ERRO ao buscar a distância da reserva {id_google}: {e}")
+        return None
+
+def _expirar_pendentes_do_dia(cursor, data_evento: str, limite_pendente: str) -> list:
+    """Marca como EXPIRADO as reservas pendentes vencidas do dia (liberando a vaga) e retorna seus IDs."""
+    cursor.execute('''
+    SELECT id_google_calendar FROM reservas
+    WHERE data_evento = ? AND status = 'PENDENTE' AND criado_em < ?
+    ''', (data_evento, limite_pendente))
+    ids_expirados = [row[0] for row in cursor.fetchall()]
+    if ids_expirados:
+        cursor.executemany(
+            "UPDATE reservas SET status = 'EXPIRADO' WHERE id_google_calendar = ?",
+            [(event_id,) for event_id in ids_expirados]
+        )
+    return ids_expirados
+
+def db_reservar_dia(id_google: str, data_evento: str, horario_evento: str, status: str, corpo_evento_json: str, limite_pendente: str, itens: dict = None, distancia_km: float = None):
+    """
+    Tenta reservar os itens (ou o dia inteiro, sem itens) de forma atômica (BEGIN IMMEDIATE).
+    (NOVO) Várias festas no mesmo dia são aceitas enquanto houver estoque de cada item
+    e veículo/equipe livres para a entrega e o recolhimento.
+    Retorna (sucesso, ids_expirados), onde 'ids_expirados' são reservas pendentes
+    vencidas que liberaram a vaga e precisam ser limpas da Agenda.
+    """
+    try:
+        with transacao(imediata=True) as cursor:
+            ids_expirados = _expirar_pendentes_do_dia(cursor, data_evento, limite_pendente)
+            if not _ha_vaga(cursor, data_evento, horario_evento, itens, limite_pendente, distancia_km=distancia_km):
+                cursor.execute("ROLLBACK")
+                return False, []
+
+            cursor.execute('''
+            INSERT INTO reservas (id_google_calendar, data_evento, horario_evento, status, criado_em, corpo_evento, distancia_km)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                id_google, data_evento, horario_evento, status,
+                datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'), corpo_evento_json, distancia_km
+            ))
+            if itens:
+                inicio, fim = intervalo_de_uso(data_evento, horario_evento)
+                cursor.executemany('''
+                INSERT INTO reserva_itens (id_google_calendar, item, quantidade, inicio, fim)
+                VALUES (?, ?, ?, ?, ?)
+                ''', [(id_google, item, quantidade, inicio, fim) for item, quantidade in itens.items()])
+            _enfileirar_operacao_espelho(cursor, 'inserir', id_google)
+        print(f"SUCESSO: Reserva de {data_evento} gravada no livro local ({id_google}).")
+        return True, ids_expirados
+    except sqlite3.IntegrityError:
+        # ID repetido (a reserva já está no livro)
+        return False, []
+    except Exception as e:
+        print(f"ERRO ao reservar o dia {data_evento} no livro local: {e}")
+        return False, []
+
+def _corpo_remarcado(corpo_evento_json: str, nova_data_evento: str, novo_horario_evento: str):
+    """Corpo do evento (JSON) com início e fim no novo dia/horário, mantendo a duração."""
+    if not corpo_evento_json:
+        return corpo_evento_json
+    corpo = json.loads(corpo_evento_json)
+    inicio_antigo = datetime.fromisoformat(corpo['start']['dateTime'])
+    duracao = datetime.fromisoformat(corpo['end']['dateTime']) - inicio_antigo
+    novo_inicio = datetime.fromisoformat(f"{nova_data_evento}T{novo_horario_evento}")
+    corpo['start']['dateTime'] = novo_inicio.isoformat()
+    corpo['end']['dateTime'] = (novo_inicio + duracao).isoformat()
+    return json.dumps(corpo, ensure_ascii=False)
+
+def db_remarcar_reserva(id_google: str, nova_data_evento: str, novo_horario_evento: str, limite_pendente: str):
+    """
+    Move uma reserva (e seus itens) para outro dia/horário de forma atômica
+    (mesmas regras do db_reservar_dia, sem contar a própria reserva).
+    Reservas antigas que ainda não estão no livro são incluídas como CONFIRMADAS.
+    Retorna (sucesso, ids_expirados).
+    """
+    try:
+        with transacao(imediata=True) as cursor:
+            cursor.execute("SELECT item, quantidade FROM reserva_itens WHERE id_google_calendar = ?", (id_google,))
+            itens = dict(cursor.fetchall())
+            distancia_km = _distancia_da_reserva(cursor, id_google)
+
+            ids_expirados = _expirar_pendentes_do_dia(cursor, nova_data_evento, limite_pendente)
+            if not _ha_vaga(cursor, nova_data_evento, novo_horario_evento, itens, limite_pendente, ignorar_id=id_google, distancia_km=distancia_km):
+                cursor.execute("ROLLBACK")
+                return False, []
+
+            # O corpo guardado também muda: uma inserção ainda na fila vai com a data nova
+            cursor.execute("SELECT corpo_evento FROM reservas WHERE id_google_calendar = ?", (id_google,))
+            row = cursor.fetchone()
+            corpo_evento = _corpo_remarcado(row[0], nova_data_evento, novo_horario_evento) if row else None
+            cursor.execute('''
+            UPDATE reservas SET data_evento = ?, horario_evento = ?, corpo_evento = ?
+            WHERE id_google_calendar = ?
+            ''', (nova_data_evento, novo_horario_evento, corpo_evento, id_google))
+            if cursor.rowcount == 0:
+                cursor.execute('''
+                INSERT INTO reservas (id_google_calendar, data_evento, horario_evento, status, criado_em, sincronizado_agenda, distancia_km)
+                VALUES (?, ?, ?, 'CONFIRMADO', ?, 1, ?)
+                ''', (id_google, nova_data_evento, novo_horario_evento, datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'), distancia_km))
+            if itens:
+                inicio, fim = intervalo_de_uso(nova_data_evento, novo_horario_evento)
+                cursor.execute(
+                    "UPDATE reserva_itens SET inicio = ?, fim = ? WHERE id_google_calendar = ?",
+                    (inicio, fim, id_google)
+                )
+            _enfileirar_operacao_espelho(cursor, 'remarcar', id_google)
+        return True, ids_expirados
+    except sqlite3.IntegrityError:
+        return False, []
+    except Exception as e:
+        print(f"ERRO ao remarcar a reserva {id_google} no livro local: {e}")
+        return False, []
+
+def db_atualizar_status_reserva(id_google: str, novo_status: str):
+    """Atualiza o status de uma reserva no livro (ex: PENDENTE -> CONFIRMADO, ou CANCELADO)."""
+    try:
+        with transacao() as cursor:
+            cursor.execute(
+                "UPDATE reservas SET status = ? WHERE id_google_calendar = ?",
+                (novo_status, id_google)
+            )
+    except Exception as e:
+        print(f"ERRO ao atualizar status da reserva {id_google} no livro local: {e}")
+
+def db_confirmar_reserva(id_google: str, limite_pendente: str):
+    """
+    (NOVO) Pagamento aprovado: marca CONFIRMADO no livro, na venda e no índice local,
+    numa única transação e sem depender da Agenda (o espelho atualiza o evento depois).
+    Uma reserva EXPIRADA só é confirmada se os itens ainda couberem no dia; uma CANCELADA
+    (o evento já saiu da Agenda) nunca volta. Nesses casos a venda fica 'ESTORNO_PENDENTE'.
+    Retorna 'CONFIRMADO', 'ESTORNAR' (pago, mas sem vaga) ou None (a reserva não existe mais).
+    """
+    try:
+        with transacao(imediata=True) as cursor:
+            cursor.execute(
+                "SELECT status, data_evento, horario_evento FROM reservas WHERE id_google_calendar = ?",
+                (id_google,)
+            )
+            row = cursor.fetchone()
+            cursor.execute(
+                "SELECT 1 FROM vendas WHERE id_google_calendar = ? AND status_pagamento = 'ESTORNO_PENDENTE'",
+                (id_google,)
+            )
+            if cursor.fetchone():
+                return 'ESTORNAR' # Aviso de pagamento repetido: o estorno já foi decidido
+            if row and row[0] in ('EXPIRADO', 'CANCELADO'):
+                status, data_evento, horario_evento = row
+                cabe = False
+                if status == 'EXPIRADO':
+                    cursor.execute("SELECT item, quantidade FROM reserva_itens WHERE id_google_calendar = ?", (id_google,))
+                    itens = dict(cursor.fetchall())
+                    cabe = _ha_vaga(
+                        cursor, data_evento, horario_evento, itens, limite_pendente,
+                        ignorar_id=id_google, distancia_km=_distancia_da_reserva(cursor, id_google)
+                    )
+                if not cabe:
+                    cursor.execute(
+                        "UPDATE vendas SET status_pagamento = 'ESTORNO_PENDENTE' WHERE id_google_calendar = ?",
+                        (id_google,)
+                    )
+                    print(f"ATENÇÃO: Pagamento aprovado para a reserva {id_google} que estava {status} e o dia não tem mais vaga. Estorno pendente.")
+                    return 'ESTORNAR'
+            cursor.execute("UPDATE reservas SET status = 'CONFIRMADO' WHERE id_google_calendar = ?", (id_google,))
+            cursor.execute("UPDATE vendas SET status_pagamento = 'CONFIRMADO' WHERE id_google_calendar = ?", (id_google,))
+            venda_confirmada = cursor.rowcount > 0
+            cursor.execute("UPDATE agenda_eventos SET status = 'CONFIRMADO' WHERE id_google_calendar = ?", (id_google,))
+            if row is None and not venda_confirmada:
+                return None
+            _enfileirar_operacao_espelho(cursor, 'confirmar', id_google)
+        return 'CONFIRMADO'
+    except Exception as e:
+        print(f"ERRO ao confirmar a reserva {id_google} no DB: {e}")
+        return None
+
+def db_cancelar_reserva(id_google: str) -> bool:
+    """(NOVO) Cancela a reserva no livro e a venda, e tira o evento do índice local, numa única transação."""
+    try:
+        with transacao(imediata=True) as cursor:
+            cursor.execute("UPDATE reservas SET status = 'CANCELADO' WHERE id_google_calendar = ?", (id_google,))
+            _cancelar_venda(cursor, id_google)
+            cursor.execute("DELETE FROM agenda_eventos WHERE id_google_calendar = ?", (id_google,))
+            _enfileirar_operacao_espelho(cursor, 'deletar', id_google)
+        print(f"SUCESSO: Reserva {id_google} cancelada no DB.")
+        return True
+    except Exception as e:
+        print(f"ERRO ao cancelar a reserva {id_google} no DB: {e}")
+        return False
+
+def db_marcar_reserva_sincronizada(id_google: str):
+    """Marca que o evento da reserva já foi gravado na Agenda Google."""
+    try:
+        with transacao() as cursor:
+            cursor.execute(
+                "UPDATE reservas SET sincronizado_agenda = 1, corpo_evento = NULL WHERE id_google_calendar = ?",
+                (id_google,)
+            )
+    except Exception as e:
+        print(f"ERRO ao marcar reserva {id_google} como sincronizada: {e}")
+
+def db_reserva_para_espelho(id_google: str):
+    """(status, corpo_evento_json, data_evento, horario_evento, sincronizado) da reserva, ou None."""
+    try:
+        with transacao() as cursor:
+            cursor.execute('''
+            SELECT status, corpo_evento, data_evento, horario_evento, sincronizado_agenda
+            FROM reservas WHERE id_google_calendar = ?
+            ''', (id_google,))
+            return cursor.fetchone()
+    except Exception as e:
+        print(f"ERRO ao ler a reserva {id_google} para o espelho: {e}")
+        return None
+
+
+# ==============================================================================
+# --- (NOVAS FUNÇÕES) FILA PERSISTENTE DO ESPELHO DA AGENDA (OUTBOX) ---
+# ==============================================================================
+
+def _agora_utc() -> datetime:
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+def _enfileirar_operacao_espelho(cursor, operacao: str, id_google: str):
+    """Grava a operação na fila do espelho, dentro da transação de quem mudou o livro."""
+    agora = _agora_utc().strftime('%Y-%m-%dT%H:%M:%S')
+    cursor.execute('''
+    INSERT INTO espelho_agenda (operacao, id_google_calendar, criado_em, proxima_tentativa)
+    VALUES (?, ?, ?, ?)
+    ''', (operacao, id_google, agora, agora))
+
+def db_reservar_operacoes_espelho(prazo_segundos: int, limite: int = 100) -> list:
+    """
+    Pega as operações do espelho prontas para rodar: só a mais antiga de cada evento (a ordem
+    por evento é mantida) e só se ela já venceu a espera. As escolhidas ficam reservadas por
+    'prazo_segundos' (outro processo não as pega; se este cair, voltam sozinhas para a fila).
+    Retorna [(id, operacao, id_google, tentativas)].
+    """
+    agora = _agora_utc()
+    try:
+        with transacao(imediata=True) as cursor:
+            cursor.execute('''
+            SELECT id, operacao, id_google_calendar, tentativas, proxima_tentativa
+            FROM espelho_agenda ORDER BY id
+            ''')
+            vistos = set()
+            escolhidas = []
+            for op_id, operacao, id_google, tentativas, proxima_tentativa in cursor.fetchall():
+                if id_google in vistos:
+                    continue
+                vistos.add(id_google)
+                if proxima_tentativa <= agora.strftime('%Y-%m-%dT%H:%M:%S'):
+                    escolhidas.append((op_id, operacao, id_google, tentativas))
+                    if len(escolhidas) >= limite:
+                        break
+            prazo = (agora + timedelta(seconds=prazo_segundos)).strftime('%Y-%m-%dT%H:%M:%S')
+            cursor.executemany(
+                "UPDATE espelho_agenda SET proxima_tentativa = ? WHERE id = ?",
+                [(prazo, op[0]) for op in escolhidas]
+            )
+        return escolhidas
+    except Exception as e:
+        print(f"ERRO ao ler a fila do espelho da agenda: {e}")
+        return []
+
+def db_concluir_operacoes_espelho(ids_operacoes: list):
+    """Remove da fila as operações que a Agenda já aceitou."""
+    if not ids_operacoes:
+        return
+    try:
+        with transacao() as cursor:
+            cursor.executemany("DELETE FROM espelho_agenda WHERE id = ?", [(op_id,) for op_id in ids_operacoes])
+    except Exception as e:
+        print(f"ERRO ao concluir operações do espelho da agenda: {e}")
+
+def db_adiar_operacao_espelho(id_operacao: int, espera_segundos: float, erro: str):
+    """Registra a falha e devolve a operação à fila para daqui a 'espera_segundos'."""
+    proxima = (_agora_utc() + timedelta(seconds=espera_segundos)).strftime('%Y-%m-%dT%H:%M:%S')
+    try:
+        with transacao() as cursor:
+            cursor.execute('''
+            UPDATE espelho_agenda SET tentativas = tentativas + 1, proxima_tentativa = ?, ultimo_erro = ?
+            WHERE id = ?
+            ''', (proxima, erro[:500], id_operacao))
+    except Exception as e:
+        print(f"ERRO ao adiar operação do espelho da agenda: {e}")
+
+def db_tamanho_fila_espelho() -> int:
+    """Quantas escritas na Agenda ainda estão pendentes."""
+    with transacao() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM espelho_agenda")
+        return cursor.fetchone()[0]
+
+
+# ==============================================================================
+# --- (NOVAS FUNÇÕES) LIMPEZA DE RESERVAS PENDENTES EXPIRADAS ---
+# ==============================================================================
+
+def _selecionar_pendentes_expirados(cursor, limite_pendente: str) -> list:
+    cursor.execute('''
+    SELECT id_google_calendar FROM reservas
+    WHERE status = 'EXPIRADO'
+       OR (status = 'PENDENTE' AND criado_em < ?)
+    UNION
+    SELECT id_google_calendar FROM agenda_eventos
+    WHERE status = 'PENDENTE' AND criado_em < ?
+      AND id_google_calendar NOT IN (
+          SELECT id_google_calendar FROM reservas WHERE status = 'CONFIRMADO'
+      )
+    ''', (limite_pendente, limite_pendente))
+    return [row[0] for row in cursor.fetchall()]
+
+def db_buscar_pendentes_expirados(limite_pendente: str) -> list:
+    """
+    Retorna os IDs de todas as reservas pendentes vencidas (criadas antes de 'limite_pendente'),
+    tanto do livro local quanto do índice da agenda, numa única consulta indexada.
+    Uma reserva já paga no livro nunca entra, mesmo que a Agenda ainda diga PENDENTE.
+    """
+    try:
+        with transacao() as cursor:
+            return _selecionar_pendentes_expirados(cursor, limite_pendente)
+    except Exception as e:
+        print(f"ERRO ao buscar reservas pendentes expiradas: {e}")
+        return []
+
+def db_remover_reservas_expiradas(limite_pendente: str) -> list:
+    """
+    Remove de uma vez (BEGIN IMMEDIATE) as vendas, reservas e entradas do índice das reservas
+    pendentes vencidas, e põe a remoção dos eventos na fila do espelho da Agenda.
+    Os IDs são escolhidos de novo dentro da trava, e todo DELETE exige o status pendente/expirado:
+    uma reserva paga entre a consulta e a limpeza não é apagada. Retorna os IDs removidos.
+    """
+    try:
+        with transacao(imediata=True) as cursor:
+            ids_google = _selecionar_pendentes_expirados(cursor, limite_pendente)
+            if not ids_google:
+                return []
+            parametros = [(id_google,) for id_google in ids_google]
+            cursor.executemany('''
+            DELETE FROM venda_itens WHERE venda_id IN (
+                SELECT id FROM vendas WHERE id_google_calendar = ? AND status_pagamento = 'PENDENTE'
+            )
+            ''', parametros)
+            cursor.executemany("DELETE FROM vendas WHERE id_google_calendar = ? AND status_pagamento = 'PENDENTE'", parametros)
+            cursor.executemany('''
+            DELETE FROM reserva_itens WHERE id_google_calendar = ? AND id_google_calendar IN (
+                SELECT id_google_calendar FROM reservas WHERE status IN ('PENDENTE', 'EXPIRADO')
+            )
+            ''', parametros)
+            cursor.executemany(
+                "DELETE FROM reservas WHERE id_google_calendar = ? AND status IN ('PENDENTE', 'EXPIRADO')",
+                parametros
+            )
+            cursor.executemany(
+                "DELETE FROM agenda_eventos WHERE id_google_calendar = ? AND status IN ('PENDENTE', 'EXPIRADO')",
+                parametros
+            )
+            for id_google in ids_google:
+                _enfileirar_operacao_espelho(cursor, 'deletar', id_google)
+        print(f"SUCESSO: {len(ids_google)} reservas pendentes expiradas removidas do DB.")
+        return ids_google
+    except Exception as e:
+        print(f"ERRO ao remover reservas pendentes expiradas do DB: {e}")
+        return []
+
+# ==============================================================================
+# --- (NOVAS FUNÇÕES) CACHE DE file_id DO TELEGRAM ---
+# ==============================================================================
+
+def db_obter_file_ids(caminhos_hashes: dict) -> dict:
+    """
+    file_id salvos para {caminho: hash_conteudo}. Só volta o que bate com o hash
+    atual: se a imagem mudou no disco, o file_id antigo é ignorado. Retorna {caminho: file_id}.
+    """
+    if not caminhos_hashes:
+        return {}
+    marcadores = ", ".join("?" * len(caminhos_hashes))
+    try:
+        with transacao() as cursor:
+            cursor.execute(
+                f"SELECT caminho, hash_conteudo, file_id FROM telegram_file_ids WHERE caminho IN ({marcadores})",
+                list(caminhos_hashes)
+            )
+            return {
+                caminho: file_id for caminho, hash_conteudo, file_id in cursor.fetchall()
+                if caminhos_hashes[caminho] == hash_conteudo
+            }
+    except Exception as e:
+        print(f"ERRO ao ler file_ids do Telegram: {e}")
+        return {}
+
+def db_salvar_file_ids(itens: list):
+    """Grava (caminho, hash_conteudo, file_id) numa transação; substitui o file_id de uma versão antiga da imagem."""
+    if not itens:
+        return
+    agora = datetime.now().isoformat()
+    try:
+        with transacao() as cursor:
+            cursor.executemany('''
+            INSERT INTO telegram_file_ids (caminho, hash_conteudo, file_id, atualizado_em)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(caminho) DO UPDATE SET
+                hash_conteudo = excluded.hash_conteudo,
+                file_id = excluded.file_id,
+                atualizado_em = excluded.atualizado_em
+            ''', [(caminho, hash_conteudo, file_id, agora) for caminho, hash_conteudo, file_id in itens])
+    except Exception as e:
+        print(f"ERRO ao salvar file_ids do Telegram: {e}")
+
+def db_remover_file_ids(caminhos: list):
+    """Esquece os file_ids recusados pelo Telegram (o próximo envio volta a usar a URL)."""
+    if not caminhos:
+        return
+    try:
+        with transacao() as cursor:
+            cursor.executemany("DELETE FROM telegram_file_ids WHERE caminho = ?", [(c,) for c in caminhos])
+    except Exception as e:
+        print(f"ERRO ao remover file_ids do Telegram: {e}")
@@ -0,0 +1,64 @@
+# despacho.py
+# Ordem das mensagens por chat no bot do Telegram.
+# Com concurrent_updates ligado, a Application roda vários updates ao mesmo tempo. Sem
+# cuidado, dois cliques seguidos no mesmo botão rodavam dois processar_mensagem em paralelo
+# no mesmo chat: cada um carregava e salvava o estado, e o último a salvar apagava o outro.
+# Aqui cada chat tem uma fila: os updates de um mesmo chat rodam um de cada vez, na ordem de
+# chegada; chats diferentes continuam em paralelo. A vez é reservada de forma síncrona, no
+# início do handler (antes de qualquer await), então a ordem é exatamente a de entrega.
+import asyncio
+import functools
+
+_filas = {} # chat_id -> Future que termina quando o último da fila daquele chat acabar
+
+
+class VezDoChat:
+    """
+    Lugar na fila de um chat. Criar reserva a vez; 'async with' espera os anteriores
+    terminarem e libera o próximo ao sair (também em erro ou cancelamento).
+    'filas' permite uma ordem separada da dos handlers (ex: a fila de envio do fila_envio.py).
+    """
+
+    def __init__(self, chat_id, filas: dict = None):
+        self.chat_id = chat_id
+        self.filas = _filas if filas is None else filas
+        self.anterior = self.filas.get(chat_id)
+        self.fim = asyncio.get_running_loop().create_future()
+        self.filas[chat_id] = self.fim
+
+    async def __aenter__(self):
+        if self.anterior is not None and not self.anterior.done():
+            try:
+                await asyncio.shield(self.anterior)
+            except BaseException:
+                # Cancelado enquanto esperava: o próximo só pode andar quando o anterior acabar
+                self.anterior.add_done_callback(lambda _: self._liberar())
+                raise
+        return self
+
+    async def __aexit__(self, tipo, erro, rastreio):
+        self._liberar()
+        return False
+
+    def _liberar(self):
+        if not self.fim.done():
+            self.fim.set_result(None)
+        if self.filas.get(self.chat_id) is self.fim:
+            del self.filas[self.chat_id] # Ninguém mais na fila: não guarda chats parados
+
+
+def chats_na_fila() -> int:
+    """Quantos chats têm updates rodando ou esperando."""
+    return len(_filas)
+
+
+def um_por_vez_por_chat(handler):
+    """Decorador dos handlers: updates do mesmo chat em série (na ordem), chats diferentes em paralelo."""
+    @functools.wraps(handler)
+    async def _na_vez_do_chat(update, context):
+        chat = update.effective_chat
+        if chat is None:
+            return await handler(update, context)
+        async with VezDoChat(chat.id):
+            return await handler(update, context)
+    return _na_vez_do_chat
@@ -0,0 +1,259 @@
+# estado_cache.py
+# Cache em memória (write-behind) dos estados de conversa.
+# Antes, cada mensagem lia e gravava (com commit) o estado no SQLite, mesmo sem mudança.
+# Agora:
+#  - os chats ativos ficam num LRU em memória (o JSON guardado é a cópia "oficial");
+#  - salvar só marca o chat como sujo se o JSON mudou;
+#  - uma thread grava os chats sujos em lote, numa única transação, a cada INTERVALO_GRAVACAO_SEGUNDOS;
+#  - descarregar_estados() grava tudo o que falta (chamado no desligamento e no atexit).
+# Outros processos (ex: image_server) enxergam as mudanças com até INTERVALO_GRAVACAO_SEGUNDOS de atraso.
+# (NOVO) O JSON guardado é o estado compacto (estado_compacto.py): referências no lugar de
+# eventos e itens completos; carregar_estado devolve o estado já hidratado.
+# (NOVO) Estados sem atividade há mais de TTL_ESTADOS_HORAS são arquivados e removidos
+# pela varredura periódica (iniciar_varredura_periodica), exceto pagamentos pendentes vivos.
+# (NOVO) Os estados ficam num StateStore (estado_store.py) com versão por chat:
+#  - o lote grava cada chat com compare-and-swap; se outro processo gravou antes, o nosso
+#    estado é descartado do cache (vale o do armazenamento) e o conflito vai para o log;
+#  - uma entrada do cache só confere a versão no armazenamento depois de REVALIDAR_VERSAO_SEGUNDOS
+#    (não a cada leitura): um chat atendido por outro processo é relido em até esse tempo, e uma
+#    gravação em cima de um estado velho é pega pelo CAS do lote;
+#  - atualizar_estado() faz ler-alterar-gravar com CAS na hora (ex: webhook de pagamento).
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import islice
+
+from database import def_json_serial
+from estado_compacto import compactar_estado, hidratar_estado
+from estado_store import obter_store, ConflitoDeVersao
+
+MAX_CHATS_EM_CACHE = 5000
+INTERVALO_GRAVACAO_SEGUNDOS = 2.0
+TTL_ESTADOS_HORAS = 72 # Conversa parada há mais tempo que isso é considerada abandonada
+INTERVALO_VARREDURA_SEGUNDOS = 30 * 60
+ARQUIVAR_ESTADOS_EXPIRADOS = True # False = apenas remove
+REVALIDAR_VERSAO_SEGUNDOS = 5.0 # None = nunca (um único processo usando o armazenamento)
+TENTATIVAS_CAS = 5
+
+ESTADO_PADRAO_JSON = json.dumps({'estado': None, 'carrinho': [], 'frete_valor': -1.0})
+
+_lock = threading.RLock()
+_gravacao_lock = threading.Lock() # Um lote por vez; o _lock fica livre enquanto o lote vai para o disco
+_cache = OrderedDict() # chat_id -> {'json': str|None (None = sem estado), 'versao': int, 'sujo': bool, 'ativo': bool, 'conferido': monotonic}
+_gravador_thread = None
+_varredura_thread = None
+_parar = threading.Event()
+_encerrado = False
+
+
+def _entrada(chat_id: str) -> dict:
+    """Entrada do chat no LRU (lida do armazenamento na primeira vez ou se ficou velha). Chamar com o _lock."""
+    entrada = _cache.get(chat_id)
+    if (entrada is not None and REVALIDAR_VERSAO_SEGUNDOS is not None and not entrada['sujo']
+            and time.monotonic() - entrada['conferido'] >= REVALIDAR_VERSAO_SEGUNDOS):
+        if obter_store().versao(chat_id) != entrada['versao']:
+            entrada = None # Outro processo gravou este chat: relê
+        else:
+            entrada['conferido'] = time.monotonic()
+    if entrada is None:
+        estado_json, versao = obter_store().ler(chat_id)
+        entrada = {'json': estado_json, 'versao': versao, 'sujo': False, 'ativo': False, 'conferido': time.monotonic()}
+        _cache.pop(chat_id, None)
+        _despejar_excedentes(vagas=1)
+        _cache[chat_id] = entrada
+    else:
+        _cache.move_to_end(chat_id)
+    return entrada
+
+
+def _despejar_excedentes(vagas: int = 0):
+    """
+    Tira do LRU os chats menos usados além do limite (deixando 'vagas' livres para quem vai entrar).
+    Os sujos ficam até o próximo lote gravá-los.
+    """
+    excedentes = len(_cache) + vagas - MAX_CHATS_EM_CACHE
+    if excedentes > 0:
+        limpos = (chat_id for chat_id, entrada in _cache.items() if not entrada['sujo'])
+        for chat_id in list(islice(limpos, excedentes)):
+            del _cache[chat_id]
+
+
+def carregar_estado(chat_id: str) -> dict:
+    """Estado do chat (uma cópia nova: alterar o dict não muda o cache até salvar_estado)."""
+    try:
+        with _lock:
+            entrada = _entrada(chat_id)
+            entrada['ativo'] = True # Renova a última atividade no próximo lote, mesmo sem mudança
+            estado_json = entrada['json']
+        _iniciar_gravador()
+        return hidratar_estado(json.loads(estado_json or ESTADO_PADRAO_JSON))
+    except Exception as e:
+        print(f"ERRO ao carregar estado para {chat_id}: {e}")
+        return json.loads(ESTADO_PADRAO_JSON)
+
+
+def salvar_estado(chat_id: str, estado_dict: dict):
+    """Guarda o estado no cache; só marca para gravação se ele mudou."""
+    try:
+        estado_json = json.dumps(compactar_estado(estado_dict), default=def_json_serial)
+    except Exception as e:
+        print(f"ERRO CRÍTICO ao serializar estado para {chat_id}: {e}")
+        return
+    with _lock:
+        entrada = _entrada(chat_id)
+        if entrada['json'] != estado_json:
+            entrada['json'] = estado_json
+            entrada['sujo'] = True
+    _iniciar_gravador()
+
+
+def deletar_estado(chat_id: str):
+    """Remove o estado (quando o chat volta ao menu principal); a remoção vai no próximo lote."""
+    with _lock:
+        entrada = _entrada(chat_id)
+        if entrada['json'] is not None:
+            entrada['json'] = None
+            entrada['sujo'] = True
+    _iniciar_gravador()
+
+
+def descarregar_estados() -> bool:
+    """
+    Grava, num único lote com CAS por chat, todos os estados sujos. Retorna False se a gravação falhou.
+    Os sujos são copiados com o _lock e gravados sem ele: as mensagens não esperam o disco.
+    Um chat alterado durante a gravação continua sujo (vai no próximo lote, já com a versão nova).
+    """
+    with _gravacao_lock:
+        with _lock:
+            sujos = [(chat_id, entrada['json'], entrada['versao']) for chat_id, entrada in _cache.items() if entrada['sujo']]
+            ativos = [
+                chat_id for chat_id, entrada in _cache.items()
+                if entrada['ativo'] and not entrada['sujo'] and entrada['json'] is not None
+            ]
+        if not sujos and not ativos:
+            return True
+        resultado = obter_store().gravar_lote(sujos, ativos)
+        if resultado is None:
+            return False
+        with _lock:
+            for chat_id, estado_json, _ in sujos:
+                nova_versao = resultado.get(chat_id)
+                if nova_versao is None:
+                    print(f"AVISO: Estado do chat {chat_id} foi alterado por outro processo; a alteração local foi descartada.")
+                    _cache.pop(chat_id, None)
+                    continue
+                entrada = _cache.get(chat_id)
+                if entrada is None:
+                    continue
+                entrada.update(versao=nova_versao, conferido=time.monotonic())
+                if entrada['json'] == estado_json:
+                    entrada.update(sujo=False, ativo=False)
+            for chat_id in ativos:
+                if chat_id in _cache:
+                    _cache[chat_id]['ativo'] = False
+        return True
+
+
+def atualizar_estado(chat_id: str, funcao) -> dict:
+    """
+    Ler-alterar-gravar imediato com compare-and-swap (sem esperar o lote).
+    'funcao' recebe o estado hidratado e devolve o novo (estado None = remover).
+    Se outro processo gravar no meio, relê e chama 'funcao' de novo (até TENTATIVAS_CAS vezes),
+    então 'funcao' não deve ter efeitos colaterais. Retorna o estado gravado.
+    """
+    store = obter_store()
+    with _lock:
+        entrada = _cache.get(chat_id)
+        sujo = entrada is not None and entrada['sujo']
+    if sujo:
+        descarregar_estados() # O armazenamento precisa ter a nossa última versão
+    for _ in range(TENTATIVAS_CAS):
+        estado_json, versao = store.ler(chat_id)
+        novo = funcao(hidratar_estado(json.loads(estado_json or ESTADO_PADRAO_JSON)))
+        remover = novo is None or novo.get('estado') is None
+        novo_json = None if remover else json.dumps(compactar_estado(novo), default=def_json_serial)
+        try:
+            nova_versao = store.comparar_e_gravar(chat_id, novo_json, versao)
+        except ConflitoDeVersao:
+            continue
+        with _lock:
+            if chat_id in _cache:
+                _cache[chat_id].update(json=novo_json, versao=nova_versao, sujo=False, conferido=time.monotonic())
+        return novo
+    raise ConflitoDeVersao(chat_id)
+
+
+def varrer_estados_ociosos(ttl_horas: float = TTL_ESTADOS_HORAS) -> int:
+    """
+    Arquiva e remove os estados sem atividade há mais de 'ttl_horas' (também do cache).
+    Chats aguardando a confirmação de um pagamento pendente ainda válido são mantidos.
+    Retorna quantos estados foram removidos.
+    """
+    limite = (datetime.now() - timedelta(hours=ttl_horas)).isoformat()
+    # Grava antes o que está pendente, para a última atividade do armazenamento estar em dia
+    if not descarregar_estados():
+        return 0
+    removidos = obter_store().expirar_ociosos(limite, ARQUIVAR_ESTADOS_EXPIRADOS)
+    with _lock:
+        for chat_id in removidos:
+            _cache.pop(chat_id, None)
+    if removidos:
+        print(f"Varredura de estados: {len(removidos)} conversas abandonadas há mais de {ttl_horas}h {'arquivadas' if ARQUIVAR_ESTADOS_EXPIRADOS else 'removidas'}.")
+    return len(removidos)
+
+
+def iniciar_varredura_periodica(ttl_horas: float = TTL_ESTADOS_HORAS, intervalo_segundos: int = INTERVALO_VARREDURA_SEGUNDOS):
+    """Inicia (uma única vez por processo) a thread que expira os estados abandonados."""
+    global _varredura_thread
+    if _varredura_thread is not None:
+        return
+
+    def _loop():
+        while not _parar.is_set():
+            try:
+                varrer_estados_ociosos(ttl_horas)
+            except Exception as e:
+                print(f"ERRO na varredura de estados abandonados: {e}")
+            _parar.wait(intervalo_segundos)
+
+    _varredura_thread = threading.Thread(target=_loop, daemon=True)
+    _varredura_thread.start()
+    print(f"Varredura de estados abandonados iniciada (TTL {ttl_horas}h, a cada {intervalo_segundos}s).")
+
+
+def _worker_gravador():
+    """Grava os estados sujos periodicamente até o desligamento."""
+    while not _parar.wait(INTERVALO_GRAVACAO_SEGUNDOS):
+        try:
+            descarregar_estados()
+        except Exception as e:
+            print(f"ERRO na gravação periódica dos estados: {e}")
+
+
+def _iniciar_gravador():
+    global _gravador_thread
+    if _gravador_thread is None:
+        with _lock:
+            if _gravador_thread is None:
+                _gravador_thread = threading.Thread(target=_worker_gravador, daemon=True)
+                _gravador_thread.start()
+
+
+def encerrar():
+    """Para a gravação periódica e grava o que falta (desligamento do processo)."""
+    global _encerrado
+    if _encerrado:
+        return
+    _encerrado = True
+    _parar.set()
+    inicio = time.monotonic()
+    if descarregar_estados():
+        print(f"Estados de conversa gravados no desligamento ({(time.monotonic() - inicio) * 1000:.0f} ms).")
+    else:
+        print("ERRO CRÍTICO: Não foi possível gravar os estados de conversa no desligamento.")
+
+
+atexit.register(encerrar)
@@ -0,0 +1,196 @@
+# estado_compacto.py
+# Forma compacta do estado de conversa (o que vai para o cache e para o DB).
+# Antes, o estado guardava eventos inteiros do Google e itens inteiros do catálogo
+# (com descrição e URLs de imagem). Agora guarda só referências:
+#  - carrinho: avulso -> {'id': 24}; combo -> {'id': 101, 'escolhidos': {'0': [3, 15], ...}}
+#    (índice da etapa -> posições dos brinquedos na lista de opções da etapa);
+#  - combo_em_construcao: só tipo, etapa atual e escolhidos (o resto vem de DEFINICOES_COMBOS);
+#  - evento_para_gerenciar / lista_eventos_gerenciar: só os ids dos eventos.
+# hidratar_estado() devolve o formato que o logic.py usa, a partir do catálogo e do
+# índice local da agenda (tabela agenda_eventos). Estados antigos (completos) são aceitos.
+import json
+
+from catalogo import CATALOGO_AVULSOS, DEFINICOES_COMBOS, opcoes_da_etapa
+from database import db_eventos_do_indice, def_json_serial
+
+_AVULSOS_POR_ID = {item['id']: item for item in CATALOGO_AVULSOS}
+_TIPO_DO_COMBO = {definicao['id']: tipo for tipo, definicao in DEFINICOES_COMBOS.items()}
+_CAMPOS_DO_COMBO = ('id', 'nome', 'preco', 'custo')
+
+ESTADOS_DE_GERENCIAMENTO = ('evento_para_gerenciar', 'lista_eventos_gerenciar')
+
+
+# ==============================================================================
+# --- COMPACTAÇÃO ---
+# ==============================================================================
+
+def _compactar_escolhidos(tipo_combo_id: str, itens_escolhidos: dict):
+    """{nome_etapa: [nomes]} -> {'indice_etapa': [posições]} (None se a etapa não existir mais)."""
+    etapas = DEFINICOES_COMBOS[tipo_combo_id]['etapas']
+    indice_da_etapa = {etapa['nome_etapa']: i for i, etapa in enumerate(etapas)}
+    escolhidos = {}
+    for nome_etapa, nomes in itens_escolhidos.items():
+        etapa_idx = indice_da_etapa.get(nome_etapa)
+        if etapa_idx is None:
+            return None
+        opcoes = opcoes_da_etapa(tipo_combo_id, etapa_idx)
+        # Um nome fora da lista (catálogo alterado) fica como texto
+        escolhidos[str(etapa_idx)] = [opcoes.index(nome) if nome in opcoes else nome for nome in nomes]
+    return escolhidos
+
+def _compactar_item(item: dict) -> dict:
+    """Item do carrinho -> referência ao catálogo (o item fica inteiro se não estiver no catálogo)."""
+    item_id = item.get('id')
+    if item_id in _TIPO_DO_COMBO and 'descricao_custom' in item:
+        escolhidos = _compactar_escolhidos(_TIPO_DO_COMBO[item_id], item['descricao_custom'])
+        if escolhidos is not None:
+            return {'id': item_id, 'escolhidos': escolhidos}
+    elif _AVULSOS_POR_ID.get(item_id) == item:
+        return {'id': item_id}
+    return item
+
+def compactar_estado(estado: dict) -> dict:
+    """Cópia do estado com referências no lugar de eventos e itens completos."""
+    compacto = dict(estado)
+    if estado.get('carrinho'):
+        compacto['carrinho'] = [_compactar_item(item) for item in estado['carrinho']]
+
+    combo = estado.get('combo_em_construcao')
+    if combo and 'itens_escolhidos' in combo:
+        escolhidos = _compactar_escolhidos(combo['tipo_combo_id'], combo['itens_escolhidos'])
+        if escolhidos is not None:
+            compacto['combo_em_construcao'] = {
+                'tipo_combo_id': combo['tipo_combo_id'],
+                'etapa_idx': combo['etapa_idx'],
+                'escolhidos': escolhidos
+            }
+
+    evento = estado.get('evento_para_gerenciar')
+    if isinstance(evento, dict) and evento.get('id'):
+        compacto['evento_para_gerenciar'] = evento['id']
+    if estado.get('lista_eventos_gerenciar'):
+        compacto['lista_eventos_gerenciar'] = [
+            evento['id'] if isinstance(evento, dict) else evento
+            for evento in estado['lista_eventos_gerenciar']
+        ]
+    return compacto
+
+
+# ==============================================================================
+# --- HIDRATAÇÃO ---
+# ==============================================================================
+
+def _hidratar_escolhidos(tipo_combo_id: str, escolhidos: dict) -> dict:
+    """{'indice_etapa': [posições]} -> {nome_etapa: [nomes]}, na ordem das etapas."""
+    etapas = DEFINICOES_COMBOS[tipo_combo_id]['etapas']
+    itens_escolhidos = {}
+    for etapa_idx_str, referencias in sorted(escolhidos.items(), key=lambda par: int(par[0])):
+        etapa_idx = int(etapa_idx_str)
+        opcoes = opcoes_da_etapa(tipo_combo_id, etapa_idx)
+        itens_escolhidos[etapas[etapa_idx]['nome_etapa']] = [
+            opcoes[ref] if isinstance(ref, int) else ref for ref in referencias
+        ]
+    return itens_escolhidos
+
+def _hidratar_item(item: dict) -> dict:
+    """Referência do carrinho -> item completo do catálogo."""
+    item_id = item.get('id')
+    if 'escolhidos' in item and item_id in _TIPO_DO_COMBO:
+        tipo_combo_id = _TIPO_DO_COMBO[item_id]
+        completo = {campo: DEFINICOES_COMBOS[tipo_combo_id][campo] for campo in _CAMPOS_DO_COMBO}
+        completo['descricao_custom'] = _hidratar_escolhidos(tipo_combo_id, item['escolhidos'])
+        return completo
+    if len(item) == 1 and item_id in _AVULSOS_POR_ID:
+        return dict(_AVULSOS_POR_ID[item_id])
+    return item
+
+def _evento_do_indice(event_id: str, dados: tuple) -> dict:
+    """Monta, a partir do índice local, os campos do evento que o logic.py usa (id, summary, start)."""
+    inicio, resumo = dados
+    chave_inicio = 'dateTime' if 'T' in (inicio or '') else 'date'
+    return {'id': event_id, 'summary': resumo, 'start': {chave_inicio: inicio}}
+
+def _hidratar_eventos(estado: dict):
+    """
+    Troca os ids de eventos pelos dados do índice local. Na lista, um evento que sumiu
+    vira {'id', 'indisponivel'} no mesmo lugar: o cliente já viu a lista numerada e
+    os números das outras reservas não podem mudar.
+    """
+    evento_id = estado.get('evento_para_gerenciar')
+    lista_ids = estado.get('lista_eventos_gerenciar') or []
+    ids = [event_id for event_id in [evento_id] + lista_ids if isinstance(event_id, str)]
+    if not ids:
+        return
+    eventos = db_eventos_do_indice(ids)
+
+    if lista_ids:
+        estado['lista_eventos_gerenciar'] = [
+            event_id if not isinstance(event_id, str)
+            else _evento_do_indice(event_id, eventos[event_id]) if event_id in eventos
+            else {'id': event_id, 'indisponivel': True}
+            for event_id in lista_ids
+        ]
+    if isinstance(evento_id, str):
+        if evento_id in eventos:
+            estado['evento_para_gerenciar'] = _evento_do_indice(evento_id, eventos[evento_id])
+        else:
+            # A reserva foi cancelada/removida desde a última mensagem: volta ao menu
+            print(f"AVISO: Evento {evento_id} não está mais na agenda; estado de gerenciamento descartado.")
+            for chave in ESTADOS_DE_GERENCIAMENTO:
+                estado.pop(chave, None)
+            estado['estado'] = None
+
+def hidratar_estado(estado: dict) -> dict:
+    """Estado compacto (ou antigo) -> formato completo usado pelo logic.py (altera e devolve 'estado')."""
+    if estado.get('carrinho'):
+        estado['carrinho'] = [_hidratar_item(item) for item in estado['carrinho']]
+
+    combo = estado.get('combo_em_construcao')
+    if combo and 'escolhidos' in combo:
+        tipo_combo_id = combo['tipo_combo_id']
+        definicao = DEFINICOES_COMBOS[tipo_combo_id]
+        completo = {'tipo_combo_id': tipo_combo_id}
+        completo.update({campo: definicao[campo] for campo in _CAMPOS_DO_COMBO})
+        completo['etapa_idx'] = combo['etapa_idx']
+        completo['itens_escolhidos'] = _hidratar_escolhidos(tipo_combo_id, combo['escolhidos'])
+        if combo['etapa_idx'] < len(definicao['etapas']):
+            completo['etapa_atual'] = definicao['etapas'][combo['etapa_idx']]
+        estado['combo_em_construcao'] = completo
+
+    _hidratar_eventos(estado)
+    return estado
+
+
+# ==============================================================================
+# --- MEDIÇÃO ---
+# ==============================================================================
+
+def tamanho_em_bytes(estado: dict) -> int:
+    """Tamanho do estado serializado (como vai para o DB)."""
+    return len(json.dumps(estado, default=def_json_serial).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    # Estado típico: 3 avulsos + 1 combo no carrinho e uma lista de 5 reservas para gerenciar
+    evento_exemplo = {
+        'id': 'abc123def456', 'status': 'confirmed', 'summary': 'Festa - Cliente Exemplo (PENDENTE)',
+        'start': {'dateTime': '2026-12-05T14:00:00-03:00', 'timeZone': 'America/Sao_Paulo'},
+        'end': {'dateTime': '2026-12-05T18:00:00-03:00', 'timeZone': 'America/Sao_Paulo'},
+        'created': '2026-10-18T12:00:00.000Z',
+        'extendedProperties': {'private': {'cpf': '12345678901', 'status': 'PENDENTE'}}
+    }
+    tipo = '1'
+    combo = {campo: DEFINICOES_COMBOS[tipo][campo] for campo in _CAMPOS_DO_COMBO}
+    combo['descricao_custom'] = {
+        etapa['nome_etapa']: opcoes_da_etapa(tipo, i)[:etapa['limite']]
+        for i, etapa in enumerate(DEFINICOES_COMBOS[tipo]['etapas'])
+    }
+    estado = {
+        'estado': 'selecionando_reserva_para_gerenciar',
+        'carrinho': [dict(item) for item in CATALOGO_AVULSOS[:3]] + [combo],
+        'frete_valor': 35.0,
+        'lista_eventos_gerenciar': [dict(evento_exemplo, id=f"evento{i}") for i in range(5)]
+    }
+    antes = tamanho_em_bytes(estado)
+    depois = tamanho_em_bytes(compactar_estado(estado))
+    print(f"Estado completo: {antes} bytes | compacto: {depois} bytes | redução de {100 * (1 - depois / antes):.0f}%")
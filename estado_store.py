@@ -0,0 +1,261 @@
+# estado_store.py
+# Onde os estados de conversa ficam guardados, atrás de uma interface única (StateStore).
+# Cada estado tem uma versão; a gravação é um compare-and-swap por chat: só grava se a
+# versão ainda for a que foi lida. Assim vários processos (workers do gunicorn, o bot,
+# o servidor de webhooks) atendem chats diferentes em paralelo sem perder atualizações,
+# e dois processos mexendo no MESMO chat percebem o conflito em vez de se sobrescreverem.
+#
+# Implementações:
+#  - SQLiteStateStore: a tabela conversa_estados do financeiro.db (padrão);
+#  - ArquivoStateStore: um arquivo por chat numa pasta compartilhada, com trava de arquivo
+#    por faixa de chats (aponte ESTADO_PASTA para /dev/shm para ficar em memória).
+#
+# Escolha com a variável de ambiente ESTADO_BACKEND=sqlite|arquivo (e ESTADO_PASTA).
+import json
+import os
+from abc import ABC, abstractmethod
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+from database import (
+    db_ler_estado_versionado,
+    db_versao_estado,
+    db_gravar_estados_cas,
+    db_expirar_estados_ociosos,
+    db_reservas_pendentes,
+    versao_inicial
+)
+
+BACKEND_PADRAO = 'sqlite'
+PASTA_PADRAO = 'estados_compartilhados'
+FAIXAS_DE_TRAVA = 64 # Chats diferentes raramente disputam a mesma trava
+
+
+class ConflitoDeVersao(Exception):
+    """O estado mudou (outro processo gravou) desde que foi lido."""
+
+
+class StateStore(ABC):
+    """
+    Interface dos armazenamentos de estado. Os estados entram e saem como JSON (str);
+    a versão 0 significa "o chat não tem estado".
+    """
+
+    @abstractmethod
+    def ler(self, chat_id: str):
+        """(estado_json ou None, versao)."""
+
+    @abstractmethod
+    def versao(self, chat_id: str) -> int:
+        """Só a versão atual (0 se não houver estado)."""
+
+    @abstractmethod
+    def gravar_lote(self, itens: list, chats_ativos: list = None):
+        """
+        Compare-and-swap de vários chats: 'itens' = [(chat_id, estado_json ou None, versao_esperada)].
+        Retorna {chat_id: nova_versao ou None (conflito)}; None se o armazenamento falhou.
+        'chats_ativos' só têm a última atividade renovada.
+        """
+
+    @abstractmethod
+    def expirar_ociosos(self, limite_atividade: str, arquivar: bool = True) -> list:
+        """Remove (ou arquiva) os estados sem atividade desde 'limite_atividade' (ISO); retorna os chat_ids."""
+
+    def comparar_e_gravar(self, chat_id: str, estado_json, versao_esperada: int) -> int:
+        """Grava um chat se a versão ainda for 'versao_esperada'. Retorna a nova versão; ConflitoDeVersao se não."""
+        resultado = self.gravar_lote([(chat_id, estado_json, versao_esperada)])
+        if resultado is None:
+            raise RuntimeError(f"Falha ao gravar o estado do chat {chat_id}")
+        if resultado[chat_id] is None:
+            raise ConflitoDeVersao(chat_id)
+        return resultado[chat_id]
+
+
+# ==============================================================================
+# --- SQLITE (financeiro.db) ---
+# ==============================================================================
+
+class SQLiteStateStore(StateStore):
+    """Estados na tabela conversa_estados (coluna 'versao'); o CAS é um UPDATE ... WHERE versao = ?."""
+
+    def ler(self, chat_id: str):
+        return db_ler_estado_versionado(chat_id)
+
+    def versao(self, chat_id: str) -> int:
+        return db_versao_estado(chat_id)
+
+    def gravar_lote(self, itens: list, chats_ativos: list = None):
+        return db_gravar_estados_cas(itens, chats_ativos)
+
+    def expirar_ociosos(self, limite_atividade: str, arquivar: bool = True) -> list:
+        return db_expirar_estados_ociosos(limite_atividade, arquivar)
+
+
+# ==============================================================================
+# --- ARQUIVOS COM TRAVA (pasta compartilhada) ---
+# ==============================================================================
+
+class ArquivoStateStore(StateStore):
+    """
+    Um arquivo por chat ('<versao>\\n<estado_json>'), trocado de forma atômica (os.replace).
+    Leituras não travam; cada gravação trava a faixa do chat (flock entre processos e
+    um Lock entre threads). A última atividade é a data de modificação do arquivo.
+    """
+
+    def __init__(self, pasta: str = PASTA_PADRAO):
+        self.pasta_estados = os.path.join(pasta, 'estados')
+        self.pasta_travas = os.path.join(pasta, 'travas')
+        self.pasta_arquivo = os.path.join(pasta, 'arquivo')
+        for caminho in (self.pasta_estados, self.pasta_travas, self.pasta_arquivo):
+            os.makedirs(caminho, exist_ok=True)
+        self._locks_threads = [threading.Lock() for _ in range(FAIXAS_DE_TRAVA)]
+
+    def _caminho(self, chat_id: str) -> str:
+        return os.path.join(self.pasta_estados, quote(chat_id, safe='-_') + '.estado')
+
+    @contextmanager
+    def _trava(self, chat_id: str):
+        """Trava exclusiva da faixa do chat (entre threads e entre processos)."""
+        faixa = zlib.crc32(chat_id.encode('utf-8')) % FAIXAS_DE_TRAVA
+        with self._locks_threads[faixa]:
+            with open(os.path.join(self.pasta_travas, f"{faixa:02d}.trava"), 'a+b') as arquivo:
+                if fcntl:
+                    fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+                else:
+                    arquivo.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(arquivo.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue # LK_LOCK desiste após ~10s; tenta de novo
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+                    else:
+                        arquivo.seek(0)
+                        msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def ler(self, chat_id: str):
+        try:
+            with open(self._caminho(chat_id), encoding='utf-8') as arquivo:
+                versao = int(arquivo.readline())
+                return arquivo.read(), versao
+        except FileNotFoundError:
+            return None, 0
+
+    def versao(self, chat_id: str) -> int:
+        try:
+            with open(self._caminho(chat_id), encoding='utf-8') as arquivo:
+                return int(arquivo.readline())
+        except FileNotFoundError:
+            return 0
+
+    def _gravar(self, chat_id: str, estado_json, versao_esperada: int):
+        """CAS de um chat (chamar com a trava da faixa)."""
+        caminho = self._caminho(chat_id)
+        if self.versao(chat_id) != versao_esperada:
+            return None
+        if estado_json is None:
+            if versao_esperada:
+                os.remove(caminho)
+            return 0
+        nova_versao = versao_esperada + 1 if versao_esperada else versao_inicial()
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(f"{nova_versao}\n{estado_json}")
+        os.replace(temporario, caminho)
+        return nova_versao
+
+    def gravar_lote(self, itens: list, chats_ativos: list = None):
+        resultado = {}
+        try:
+            for chat_id, estado_json, versao_esperada in itens:
+                with self._trava(chat_id):
+                    resultado[chat_id] = self._gravar(chat_id, estado_json, versao_esperada)
+            for chat_id in chats_ativos or []:
+                try:
+                    os.utime(self._caminho(chat_id))
+                except FileNotFoundError:
+                    pass
+            return resultado
+        except OSError as e:
+            print(f"ERRO CRÍTICO ao gravar lote de {len(itens)} estados em {self.pasta_estados}: {e}")
+            return None
+
+    def expirar_ociosos(self, limite_atividade: str, arquivar: bool = True) -> list:
+        limite = datetime.fromisoformat(limite_atividade).timestamp()
+        candidatos = {}
+        pendentes = {}
+        for entrada in os.scandir(self.pasta_estados):
+            if not entrada.name.endswith('.estado') or entrada.stat().st_mtime >= limite:
+                continue
+            with open(entrada.path, encoding='utf-8') as arquivo:
+                arquivo.readline()
+                try:
+                    estado = json.loads(arquivo.read())
+                except ValueError:
+                    estado = {}
+            candidatos[entrada.path] = entrada.name
+            if estado.get('estado') == 'aguardando_confirmacao_pagamento' and estado.get('pending_event_id'):
+                pendentes[entrada.path] = estado['pending_event_id']
+
+        # Pagamento pendente ainda válido: a conversa fica
+        vivos = db_reservas_pendentes(list(set(pendentes.values())))
+        removidos = []
+        carimbo = datetime.now().strftime('%Y%m%d%H%M%S')
+        for caminho, nome in candidatos.items():
+            if pendentes.get(caminho) in vivos:
+                continue
+            chat_id = unquote(nome[:-len('.estado')])
+            with self._trava(chat_id):
+                try:
+                    if os.stat(caminho).st_mtime >= limite:
+                        continue # Voltou a ter atividade durante a varredura
+                    if arquivar:
+                        os.replace(caminho, os.path.join(self.pasta_arquivo, f"{nome}.{carimbo}"))
+                    else:
+                        os.remove(caminho)
+                except FileNotFoundError:
+                    continue
+            removidos.append(chat_id)
+        return removidos
+
+
+# ==============================================================================
+# --- ESCOLHA DO ARMAZENAMENTO ---
+# ==============================================================================
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def criar_store(backend: str = None, pasta: str = None) -> StateStore:
+    """Cria o armazenamento pedido (padrão: variáveis ESTADO_BACKEND / ESTADO_PASTA)."""
+    backend = backend or os.environ.get('ESTADO_BACKEND', BACKEND_PADRAO)
+    if backend == 'sqlite':
+        return SQLiteStateStore()
+    if backend == 'arquivo':
+        return ArquivoStateStore(pasta or os.environ.get('ESTADO_PASTA', PASTA_PADRAO))
+    raise ValueError(f"ESTADO_BACKEND desconhecido: {backend}")
+
+
+def obter_store() -> StateStore:
+    """Armazenamento de estados do processo (criado na primeira chamada)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = criar_store()
+    return _store
@@ -0,0 +1,141 @@
+# estoque.py
+# Modelo de estoque: quantas unidades de cada brinquedo existem, quanto um
+# carrinho consome e em que dias/horários as unidades reservadas ainda cabem.
+# As chaves são os NOMES do catálogo, então um item que aparece num combo e
+# também como avulso (ex: "Kart Elétrico") conta como o mesmo estoque.
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+
+from catalogo import (
+    ITENS_BRINQUEDOS_G,
+    ITENS_KIT_BABY,
+    ITENS_BRINQUEDOS_M,
+    ITENS_BRINQUEDOS_P,
+    CATALOGO_AVULSOS
+)
+
+# ==============================================================================
+# --- CONFIGURAÇÃO DO ESTOQUE ---
+# ==============================================================================
+# Todo item do catálogo tem ESTOQUE_PADRAO unidades, a menos que esteja listado abaixo.
+ESTOQUE_PADRAO = 1
+ESTOQUE_ITENS = {
+    # "Pelúcia Motorizada": 3, # <-- Exemplo: itens com mais de uma unidade
+}
+
+# Tempo em que o item fica fora do depósito: a festa (4h) mais entrega/montagem e recolhimento
+DURACAO_FESTA = timedelta(hours=4)
+MARGEM_LOGISTICA = timedelta(hours=2)
+
+FORMATO_INSTANTE = '%Y-%m-%dT%H:%M'
+
+# Todos os nomes conhecidos (usado para avisar de itens fora do catálogo)
+ITENS_CATALOGO = set(ITENS_BRINQUEDOS_G + ITENS_KIT_BABY + ITENS_BRINQUEDOS_M + ITENS_BRINQUEDOS_P) | {
+    item['nome'] for item in CATALOGO_AVULSOS
+}
+
+
+def estoque_do_item(nome: str) -> int:
+    """Quantas unidades do item existem."""
+    return ESTOQUE_ITENS.get(nome, ESTOQUE_PADRAO)
+
+
+def itens_do_carrinho(carrinho: list) -> dict:
+    """
+    Converte o carrinho em {nome_do_item: quantidade}.
+    Combos são abertos nos brinquedos escolhidos em cada etapa.
+    """
+    itens = {}
+    for item in carrinho:
+        if 'descricao_custom' in item:
+            nomes = [nome for escolhidos in item['descricao_custom'].values() for nome in escolhidos]
+        else:
+            nomes = [item['nome']]
+        for nome in nomes:
+            if nome not in ITENS_CATALOGO:
+                print(f"AVISO: Item '{nome}' não está no catálogo; usando estoque padrão ({ESTOQUE_PADRAO}).")
+            itens[nome] = itens.get(nome, 0) + 1
+    return itens
+
+
+def intervalo_de_uso(data_evento: str, horario_evento: str):
+    """Intervalo [inicio, fim) em que os itens de uma festa ficam fora do depósito."""
+    hora, minuto = map(int, horario_evento.split(':'))
+    inicio_festa = datetime.combine(date.fromisoformat(data_evento), time(hora, minuto))
+    inicio = inicio_festa - MARGEM_LOGISTICA
+    fim = inicio_festa + DURACAO_FESTA + MARGEM_LOGISTICA
+    return inicio.strftime(FORMATO_INSTANTE), fim.strftime(FORMATO_INSTANTE)
+
+
+def intervalo_do_dia(dia: date):
+    """Intervalo [inicio, fim) que cobre o dia inteiro."""
+    inicio = datetime.combine(dia, time.min)
+    return inicio.strftime(FORMATO_INSTANTE), (inicio + timedelta(days=1)).strftime(FORMATO_INSTANTE)
+
+
+# ==============================================================================
+# --- ÍNDICE DE INTERVALOS (QUANTIDADE EM USO AO LONGO DO TEMPO) ---
+# ==============================================================================
+
+def construir_degraus(intervalos: list):
+    """
+    Converte as reservas de um item [(inicio, fim, quantidade)] numa função em degraus:
+    retorna (instantes, niveis), onde niveis[i] é a quantidade em uso a partir de instantes[i].
+    O fim é exclusivo: uma festa que termina às 14:00 não conflita com outra que começa às 14:00.
+    """
+    mudancas = []
+    for inicio, fim, quantidade in intervalos:
+        mudancas.append((inicio, quantidade))
+        mudancas.append((fim, -quantidade))
+    mudancas.sort() # No mesmo instante, as saídas (negativas) vêm antes das entradas
+
+    instantes, niveis = [], []
+    nivel = 0
+    for instante, delta in mudancas:
+        nivel += delta
+        if instantes and instantes[-1] == instante:
+            niveis[-1] = nivel
+        else:
+            instantes.append(instante)
+            niveis.append(nivel)
+    return instantes, niveis
+
+
+def pico_no_intervalo(degraus, inicio: str, fim: str) -> int:
+    """Maior quantidade em uso dentro de [inicio, fim) (busca binária + varredura local)."""
+    instantes, niveis = degraus
+    i = bisect_right(instantes, inicio) - 1
+    pico = niveis[i] if i >= 0 else 0
+    i += 1
+    while i < len(instantes) and instantes[i] < fim:
+        pico = max(pico, niveis[i])
+        i += 1
+    return pico
+
+
+def cabe_no_intervalo(itens: dict, ocupacoes: dict, inicio: str, fim: str) -> bool:
+    """True se todas as quantidades pedidas cabem no estoque durante [inicio, fim)."""
+    for nome, quantidade in itens.items():
+        intervalos = ocupacoes.get(nome)
+        em_uso = pico_no_intervalo(construir_degraus(intervalos), inicio, fim) if intervalos else 0
+        if em_uso + quantidade > estoque_do_item(nome):
+            return False
+    return True
+
+
+def dias_que_cabem(itens: dict, ocupacoes: dict, dias: list) -> set:
+    """
+    Dos 'dias' (date), retorna as datas ISO em que o carrinho cabe no estoque.
+    Como o horário ainda não foi escolhido, o dia só entra se couber no dia inteiro.
+    Os degraus de cada item são montados uma vez e consultados para todos os dias.
+    """
+    degraus = {nome: construir_degraus(intervalos) for nome, intervalos in ocupacoes.items() if intervalos}
+    livres = set()
+    for dia in dias:
+        inicio, fim = intervalo_do_dia(dia)
+        if all(
+            (pico_no_intervalo(degraus[nome], inicio, fim) if nome in degraus else 0) + quantidade <= estoque_do_item(nome)
+            for nome, quantidade in itens.items()
+        ):
+            livres.add(dia.isoformat())
+    return livres
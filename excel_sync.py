@@ -4,8 +4,8 @@ from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
 import database
 import os
-import json
 import re 
+from catalogo import formatar_reais
 from datetime import datetime
 
 ARQUIVO_EXCEL = "gestão de custo.xlsx"
@@ -19,29 +19,23 @@ def formatar_cpf(cpf_numeros: str) -> str:
     return f"{cpf_numeros[0:3]}.{cpf_numeros[3:6]}.{cpf_numeros[6:9]}-{cpf_numeros[9:11]}"
 
 # --- (FUNÇÃO HELPER) ---
-def formatar_itens_para_excel(itens_json: str) -> str:
-    """Converte o JSON de itens em uma string legível."""
-    try:
-        lista_itens = json.loads(itens_json)
-        itens_formatados = []
-        
-        for item in lista_itens:
-            nome = item.get('nome', 'Item desconhecido')
-            preco = item.get('preco', 'R$ 0,00')
-            
-            itens_formatados.append(f"• {nome} ({preco})")
-            
-            if 'descricao_custom' in item:
-                for etapa, brinquedos in item['descricao_custom'].items():
-                    if brinquedos: 
-                        brinquedos_str = ", ".join(brinquedos)
-                        itens_formatados.append(f"  └ {etapa}: {brinquedos_str}")
-                        
-        return "\n".join(itens_formatados)
-        
-    except Exception as e:
-        print(f"Erro ao formatar JSON de itens: {e}")
-        return itens_json 
+def formatar_itens_para_excel(itens: list) -> str:
+    """Converte os itens da venda [(nome, preco_centavos, etapa)] em uma string legível."""
+    itens_formatados = []
+    etapa_anterior = None
+    for nome, preco_centavos, etapa in itens:
+        if etapa:
+            # Brinquedos escolhidos num combo (o preço está na linha do combo), agrupados por etapa
+            if etapa == etapa_anterior:
+                itens_formatados[-1] += f", {nome}"
+            else:
+                itens_formatados.append(f"  └ {etapa}: {nome}")
+        elif preco_centavos is not None:
+            itens_formatados.append(f"• {nome} (R$ {formatar_reais(preco_centavos / 100)})")
+        else:
+            itens_formatados.append(f"• {nome}")
+        etapa_anterior = etapa
+    return "\n".join(itens_formatados)
 
 def formatar_planilha(ws):
     """Aplica formatação de cabeçalho e ajusta colunas."""
@@ -134,6 +128,7 @@ def sincronizar_db_para_excel():
     try:
         # 1. Buscar dados do DB (agora com status de pagamento)
         vendas_db = database.buscar_todas_vendas()
+        itens_por_venda = database.db_itens_das_vendas() # (NOVO) Itens em linhas: sem decodificar JSON
         
         # ... (Seu código para criar planilha vazia se não houver dados) ...
         if not vendas_db:
@@ -198,7 +193,7 @@ def sincronizar_db_para_excel():
                     data_evento_obj = data_evento_str 
             
             cpf_formatado = formatar_cpf(venda[5])
-            itens_formatados = formatar_itens_para_excel(venda[7])
+            itens_formatados = formatar_itens_para_excel(itens_por_venda.get(venda[0], []))
             
             row_data = [
                 venda[0],  # A: ID BD
@@ -0,0 +1,123 @@
+# execucao.py
+# Pool de threads limitado para o trabalho bloqueante do bot (máquina de estados com
+# Google Maps / Mercado Pago síncronos, sqlite, estados de conversa), fora do loop de eventos.
+# Antes, parte disso rodava direto no loop (um cliente esperando o Maps travava todos) e o
+# resto ia para o executor padrão do asyncio, sem limite configurável e sem medição.
+#  - em_thread(funcao, ...) roda a função no pool e mede a espera na fila e o tempo de execução;
+#  - o pool também vira o executor padrão do loop (asyncio.to_thread usa o mesmo limite);
+#  - metricas() devolve profundidade da fila, threads ocupadas e percentis da espera.
+# O tamanho vem de BOT_POOL_THREADS (padrão 16).
+import asyncio
+import contextvars
+import functools
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+POOL_THREADS = int(os.environ.get('BOT_POOL_THREADS', '16'))
+AMOSTRAS_GUARDADAS = 2000 # Últimas esperas/execuções usadas nos percentis
+
+_executor = None
+_executor_lock = threading.Lock()
+_metricas_lock = threading.Lock()
+_em_fila = 0
+_em_execucao = 0
+_maior_fila = 0
+_total = 0
+_esperas_ms = deque(maxlen=AMOSTRAS_GUARDADAS)
+_execucoes_ms = deque(maxlen=AMOSTRAS_GUARDADAS)
+
+
+def obter_executor() -> ThreadPoolExecutor:
+    """Pool do processo (criado na primeira chamada)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=POOL_THREADS, thread_name_prefix='bot-pool')
+    return _executor
+
+
+def _executar_medindo(enfileirado_em: float, funcao):
+    """Roda na thread do pool: registra quanto a tarefa esperou e quanto levou."""
+    global _em_fila, _em_execucao
+    inicio = time.perf_counter()
+    with _metricas_lock:
+        _em_fila -= 1
+        _em_execucao += 1
+        _esperas_ms.append((inicio - enfileirado_em) * 1000)
+    try:
+        return funcao()
+    finally:
+        with _metricas_lock:
+            _em_execucao -= 1
+            _execucoes_ms.append((time.perf_counter() - inicio) * 1000)
+
+
+async def em_thread(funcao, *args, **kwargs):
+    """Como asyncio.to_thread, mas no pool limitado e com métricas."""
+    global _em_fila, _maior_fila, _total
+    contexto = contextvars.copy_context()
+    chamada = functools.partial(contexto.run, funcao, *args, **kwargs)
+    with _metricas_lock:
+        _em_fila += 1
+        _total += 1
+        _maior_fila = max(_maior_fila, _em_fila)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obter_executor(), _executar_medindo, time.perf_counter(), chamada)
+
+
+def usar_como_executor_padrao(loop: asyncio.AbstractEventLoop = None):
+    """Faz o asyncio.to_thread/run_in_executor(None, ...) do loop usar o mesmo pool limitado."""
+    (loop or asyncio.get_running_loop()).set_default_executor(obter_executor())
+
+
+def _percentis(amostras) -> tuple:
+    if len(amostras) < 2:
+        valor = amostras[0] if amostras else 0.0
+        return valor, valor
+    cortes = statistics.quantiles(amostras, n=100, method='inclusive')
+    return cortes[49], cortes[98]
+
+
+def metricas() -> dict:
+    """Retrato atual do pool: fila, ocupação e percentis (ms) da espera e da execução."""
+    global _maior_fila
+    with _metricas_lock:
+        esperas = list(_esperas_ms)
+        execucoes = list(_execucoes_ms)
+        retrato = {
+            'threads': POOL_THREADS,
+            'em_fila': _em_fila,
+            'em_execucao': _em_execucao,
+            'maior_fila': _maior_fila,
+            'total': _total
+        }
+        _maior_fila = _em_fila # O pico é por período de relatório
+    retrato['espera_p50_ms'], retrato['espera_p99_ms'] = _percentis(esperas)
+    retrato['execucao_p50_ms'], retrato['execucao_p99_ms'] = _percentis(execucoes)
+    return retrato
+
+
+def formatar_metricas(retrato: dict = None) -> str:
+    """Linha de log com as métricas do pool."""
+    m = retrato or metricas()
+    return (
+        f"[Pool] {m['em_execucao']}/{m['threads']} threads ocupadas | fila {m['em_fila']} (pico {m['maior_fila']}) | "
+        f"espera p50 {m['espera_p50_ms']:.1f} ms p99 {m['espera_p99_ms']:.1f} ms | "
+        f"execução p50 {m['execucao_p50_ms']:.1f} ms p99 {m['execucao_p99_ms']:.1f} ms | {m['total']} tarefas"
+    )
+
+
+async def registrar_metricas_periodicamente(intervalo_segundos: float = 60):
+    """Tarefa do loop: imprime as métricas do pool a cada intervalo (só quando houve trabalho)."""
+    ultimo_total = -1
+    while True:
+        await asyncio.sleep(intervalo_segundos)
+        retrato = metricas()
+        if retrato['total'] != ultimo_total:
+            print(formatar_metricas(retrato))
+            ultimo_total = retrato['total']
@@ -0,0 +1,270 @@
+# fila_envio.py
+# Fila de saída das mensagens para o Telegram, com limite de taxa.
+# Antes não havia freio nenhum: o bot mandava fotos em sequência e o image_server fazia um
+# requests.post direto, então uma rajada (várias confirmações de pagamento, muitos clientes
+# vendo o catálogo) batia no limite do Telegram e o 429 só ia para o log, com a mensagem perdida.
+#  - um balde de fichas global (~30 mensagens/s, o limite do Telegram por bot) e um por chat
+#    (~1 mensagem/s, com uma pequena rajada);
+#  - a vez de cada chat é FIFO: as mensagens de um chat saem na ordem em que foram pedidas,
+#    mesmo quando uma delas precisa ser repetida;
+#  - 429: espera o retry_after devolvido (pausando o balde do chat) e tenta de novo; erro de rede
+#    ou 5xx: tenta de novo com espera exponencial e jitter. Nos send*, só o erro de conexão
+#    (pedido que nem saiu) é repetido: depois de um timeout ou 5xx a mensagem pode ter chegado.
+# No bot, LimitadorDeEnvio entra como rate_limiter da Application (vale para todo send_*).
+# No image_server, chamar_api_telegram() faz o mesmo para a API HTTP.
+# Os baldes são do processo: bot e image_server no mesmo processo (modo webhook) dividem o limite.
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import requests
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import config
+from despacho import VezDoChat
+
+MENSAGENS_POR_SEGUNDO = 30 # Global, por bot
+MENSAGENS_POR_SEGUNDO_POR_CHAT = 1
+RAJADA_POR_CHAT = 4 # Ex: álbum + foto avulsa + mensagem com os botões sem esperar
+TENTATIVAS = 5
+ESPERA_BASE_SEGUNDOS = 0.5 # Espera exponencial entre tentativas (com jitter)
+ESPERA_MAXIMA_SEGUNDOS = 10
+TIMEOUT_HTTP_SEGUNDOS = 10
+MAXIMO_BALDES_DE_CHAT = 5000 # Acima disso, os baldes de chats parados são descartados
+# Métodos que criam mensagem: depois de um timeout ou 5xx, a mensagem pode já ter saído
+METODOS_DE_ENVIO = ('send', 'forward', 'copy')
+
+
+class BaldeDeFichas:
+    """
+    Balde de fichas seguro entre threads. reservar() tira as fichas na hora (o saldo pode
+    ficar negativo) e diz quanto esperar: quem pediu antes sai antes, sem precisar de fila.
+    """
+
+    def __init__(self, por_segundo: float, rajada: float):
+        self.por_segundo = por_segundo
+        self.rajada = rajada
+        self.fichas = rajada
+        self.atualizado = time.monotonic() # No futuro enquanto o balde está pausado (429)
+        self._lock = threading.Lock()
+
+    def _reabastecer(self, agora: float):
+        if agora > self.atualizado:
+            self.fichas = min(self.rajada, self.fichas + (agora - self.atualizado) * self.por_segundo)
+            self.atualizado = agora
+
+    def reservar(self, custo: float = 1) -> float:
+        """Tira 'custo' fichas e retorna os segundos de espera até poder enviar."""
+        with self._lock:
+            agora = time.monotonic()
+            self._reabastecer(agora)
+            self.fichas -= custo
+            return max(0.0, self.atualizado - agora) + max(0.0, -self.fichas) / self.por_segundo
+
+    def pausar(self, segundos: float):
+        """Nada sai (nem reabastece) nos próximos 'segundos' (retry_after do Telegram)."""
+        with self._lock:
+            agora = time.monotonic()
+            self._reabastecer(agora)
+            self.fichas = min(self.fichas, 0)
+            self.atualizado = max(self.atualizado, agora + segundos)
+
+    def parado(self) -> bool:
+        """Cheio e sem uso: pode ser descartado."""
+        with self._lock:
+            self._reabastecer(time.monotonic())
+            return self.fichas >= self.rajada
+
+
+_balde_global = BaldeDeFichas(MENSAGENS_POR_SEGUNDO, MENSAGENS_POR_SEGUNDO)
+_baldes_chat = {}
+_baldes_lock = threading.Lock()
+_estatisticas = {'enviadas': 0, 'limite_429': 0, 'repetidas': 0, 'desistencias': 0}
+_estatisticas_lock = threading.Lock()
+
+
+def _balde_do_chat(chat_id) -> BaldeDeFichas:
+    with _baldes_lock:
+        balde = _baldes_chat.get(chat_id)
+        if balde is None:
+            if len(_baldes_chat) >= MAXIMO_BALDES_DE_CHAT:
+                for parado in [c for c, b in _baldes_chat.items() if b.parado()]:
+                    del _baldes_chat[parado]
+            balde = _baldes_chat[chat_id] = BaldeDeFichas(MENSAGENS_POR_SEGUNDO_POR_CHAT, RAJADA_POR_CHAT)
+        return balde
+
+
+def _contar(chave: str):
+    with _estatisticas_lock:
+        _estatisticas[chave] += 1
+
+
+def estatisticas() -> dict:
+    """Contadores do processo: enviadas, 429 recebidos, tentativas repetidas e desistências."""
+    with _estatisticas_lock:
+        return dict(_estatisticas)
+
+
+def _reservar(chat_id) -> float:
+    """
+    Segundos de espera até a vez no limite global e no do chat. Cada chamada custa uma ficha:
+    um sendMediaGroup (até 10 fotos) conta como uma mensagem só no limite do Telegram.
+    Sem chat_id, só o limite global vale.
+    """
+    espera = _balde_global.reservar()
+    if chat_id is None:
+        return espera
+    return max(espera, _balde_do_chat(chat_id).reservar())
+
+
+def _espera_do_429(chat_id, retry_after: float) -> float:
+    """
+    Pausa pelo retry_after só o balde do chat que levou o 429 (os outros chats seguem);
+    o global só para quando o pedido não era de um chat. Retorna a espera (com jitter) antes de repetir.
+    """
+    _contar('limite_429')
+    if chat_id is None:
+        _balde_global.pausar(retry_after)
+    else:
+        _balde_do_chat(chat_id).pausar(retry_after)
+    return retry_after + random.uniform(0, ESPERA_BASE_SEGUNDOS)
+
+
+def _espera_exponencial(tentativa: int) -> float:
+    """Jitter completo: sorteia entre 0 e base * 2^tentativa (limitado)."""
+    return random.uniform(0, min(ESPERA_MAXIMA_SEGUNDOS, ESPERA_BASE_SEGUNDOS * 2 ** tentativa))
+
+
+def _repetir_pode_duplicar(metodo: str, erro) -> bool:
+    """
+    True se o pedido pode ter chegado ao Telegram e repetir criaria outra mensagem. Nos send*
+    só é seguro repetir erro de conexão (o pedido nem saiu); timeout de leitura e 5xx não.
+    O PTB guarda o erro do httpx em __cause__ (5xx vem sem causa).
+    """
+    if not metodo.startswith(METODOS_DE_ENVIO):
+        return False
+    causa = erro.__cause__ if isinstance(erro, NetworkError) else erro
+    return not isinstance(causa, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, requests.ConnectionError))
+
+
+def _segundos(retry_after) -> float:
+    """O retry_after do PTB pode vir em segundos ou como timedelta."""
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+# ==============================================================================
+# --- BOT (python-telegram-bot): rate_limiter da Application ---
+# ==============================================================================
+_filas_envio = {} # chat_id -> vez na fila de envio (separada da ordem dos handlers)
+
+
+class LimitadorDeEnvio(BaseRateLimiter):
+    """Passa toda chamada do bot com chat_id pelos baldes, em ordem por chat e com repetição."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None: # getUpdates, setWebhook, answerCallbackQuery...
+            return await callback(*args, **kwargs)
+
+        async with VezDoChat(str(chat_id), filas=_filas_envio):
+            for tentativa in range(TENTATIVAS):
+                await asyncio.sleep(_reservar(str(chat_id)))
+                try:
+                    resultado = await callback(*args, **kwargs)
+                    _contar('enviadas')
+                    return resultado
+                except RetryAfter as e:
+                    espera = _espera_do_429(str(chat_id), _segundos(e.retry_after))
+                    erro = e
+                except BadRequest:
+                    raise # Pedido inválido: repetir não adianta
+                except NetworkError as e:
+                    if _repetir_pode_duplicar(endpoint, e):
+                        _contar('desistencias')
+                        raise
+                    espera = _espera_exponencial(tentativa)
+                    erro = e
+                if tentativa == TENTATIVAS - 1:
+                    break
+                _contar('repetidas')
+                print(f"[Fila de envio] {endpoint} para {chat_id} falhou ({erro}). Nova tentativa em {espera:.1f}s.")
+                await asyncio.sleep(espera)
+        _contar('desistencias')
+        raise erro
+
+
+# ==============================================================================
+# --- IMAGE_SERVER (síncrono): API HTTP do Telegram ---
+# ==============================================================================
+_vez_sincrona_cond = threading.Condition()
+_senhas = {} # chat_id -> [próxima senha a entregar, senha sendo atendida]
+
+
+@contextmanager
+def _vez_sincrona(chat_id):
+    """Fila FIFO por chat entre threads (senha de atendimento)."""
+    with _vez_sincrona_cond:
+        senhas = _senhas.setdefault(chat_id, [0, 0])
+        minha = senhas[0]
+        senhas[0] += 1
+        while senhas[1] != minha:
+            _vez_sincrona_cond.wait()
+    try:
+        yield
+    finally:
+        with _vez_sincrona_cond:
+            senhas[1] += 1
+            if senhas[1] == senhas[0]:
+                del _senhas[chat_id] # Ninguém mais esperando
+            _vez_sincrona_cond.notify_all()
+
+
+def chamar_api_telegram(metodo: str, payload: dict):
+    """
+    POST na API HTTP do Telegram respeitando os limites e a ordem do chat.
+    Retorna o JSON da resposta (ok ou erro definitivo) ou None se desistiu.
+    """
+    url = f"https://api.telegram.org/bot{config.TELEGRAM_TOKEN}/{metodo}"
+    chat_id = str(payload['chat_id']) if payload.get('chat_id') is not None else None
+    with _vez_sincrona(chat_id):
+        for tentativa in range(TENTATIVAS):
+            time.sleep(_reservar(chat_id))
+            try:
+                resposta = requests.post(url, json=payload, timeout=TIMEOUT_HTTP_SEGUNDOS)
+                dados = resposta.json()
+            except (requests.RequestException, ValueError) as e:
+                if _repetir_pode_duplicar(metodo, e):
+                    _contar('desistencias')
+                    print(f"ERRO: {metodo} para {chat_id} falhou depois de enviado ({e}). Não repete para não duplicar a mensagem.")
+                    return None
+                espera = _espera_exponencial(tentativa)
+                motivo = str(e)
+            else:
+                if dados.get('ok'):
+                    _contar('enviadas')
+                    return dados
+                if resposta.status_code == 429:
+                    espera = _espera_do_429(chat_id, dados.get('parameters', {}).get('retry_after', 1))
+                elif resposta.status_code >= 500 and not metodo.startswith(METODOS_DE_ENVIO):
+                    espera = _espera_exponencial(tentativa)
+                else:
+                    return dados # 400/403: repetir não adianta (5xx num send*: pode duplicar)
+                motivo = dados.get('description', resposta.status_code)
+            if tentativa == TENTATIVAS - 1:
+                break
+            _contar('repetidas')
+            print(f"[Fila de envio] {metodo} para {chat_id} falhou ({motivo}). Nova tentativa em {espera:.1f}s.")
+            time.sleep(espera)
+    _contar('desistencias')
+    print(f"ERRO: {metodo} para {chat_id} não foi entregue após {TENTATIVAS} tentativas.")
+    return None
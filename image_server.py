@@ -1,13 +1,16 @@
 # image_server.py (Agora também é o Servidor de Webhooks)
 from flask import Flask, send_from_directory, request, abort
 import os
+import atexit
 import json # <-- Importa JSON
-import requests # Para enviar a msg de volta ao Telegram
 
 # Nossas importações de lógica
 import config
 import mercadopago
 import logic # <-- Importa todo o nosso cérebro
+from estado_cache import carregar_estado, atualizar_estado # (NOVO) Estados compartilhados com o bot
+import webhook_telegram # (NOVO) Bot do Telegram em modo webhook (opcional)
+from fila_envio import chamar_api_telegram # (NOVO) Envio com limite de taxa e novas tentativas
 
 # Configura o SDK do MP (necessário para verificar o pagamento)
 sdk = mercadopago.SDK(config.MP_ACCESS_TOKEN)
@@ -71,20 +74,26 @@ def webhook_mercadopago():
                 print(f"[Webhook MP] PAGAMENTO APROVADO para chat_id: {numero_cliente}, event_id: {event_id}")
 
                 # --- 4. EXECUTAR A LÓGICA DE FINALIZAÇÃO ---
-                logic.user_states = logic.carregar_estados()
+                # (NOVO) O estado vem do armazenamento compartilhado (o bot roda em outro processo)
+                estado_info = carregar_estado(numero_cliente)
                 
-                estado_cliente = logic.user_states.get(numero_cliente, {}).get('estado')
+                estado_cliente = estado_info.get('estado')
                 
                 # (ATUALIZADO) Apenas confirma se o evento BATER com o salvo
-                pending_event_id = logic.user_states.get(numero_cliente, {}).get('pending_event_id')
+                pending_event_id = estado_info.get('pending_event_id')
                 
                 if estado_cliente == 'aguardando_confirmacao_pagamento' and pending_event_id == event_id:
                 
                     # (ATUALIZADO) Passa o event_id para a lógica final
-                    resposta_dict = logic.finalizar_reserva_pos_pagamento({}, numero_cliente, event_id)
+                    resposta_dict, estado_final = logic.finalizar_reserva_pos_pagamento({}, numero_cliente, event_id, estado_info)
                     
-                    # Salva o estado (que foi alterado por 'finalizar_reserva...')
-                    logic.salvar_estados()
+                    # (NOVO) Limpa o estado com compare-and-swap: se o cliente mandou outra mensagem
+                    # nesse meio tempo, só zera se ele ainda estiver aguardando ESTE pagamento
+                    if estado_final.get('estado') is None:
+                        atualizar_estado(
+                            numero_cliente,
+                            lambda estado: estado_final if estado.get('pending_event_id') == event_id else estado
+                        )
                     
                     # --- 5. ENVIAR A MENSAGEM DE CONFIRMAÇÃO ---
                     texto_confirmacao = resposta_dict.get('body', 'Erro ao gerar texto de confirmação.')
@@ -104,24 +113,54 @@ def webhook_mercadopago():
     return "Notificação recebida.", 200
 
 
+# --- Rota 3 (NOVA): Updates do Telegram (modo webhook do bot) ---
+@app.route(webhook_telegram.CAMINHO_WEBHOOK, methods=['POST'])
+def webhook_telegram_updates():
+    """
+    Recebe os updates do Telegram e entrega para o bot (que roda neste processo).
+    Só aceita se o cabeçalho secreto bater com o registrado no set_webhook.
+    """
+    if not webhook_telegram.webhook_ativo():
+        abort(404)
+    if not webhook_telegram.segredo_valido(request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')):
+        print("[Webhook Telegram] Requisição com token secreto inválido. Recusada.")
+        abort(403)
+    dados = request.get_json(silent=True)
+    if not dados:
+        abort(400)
+    try:
+        if not webhook_telegram.entregar_update(dados):
+            return "Bot indisponível", 503 # O Telegram tenta de novo
+    except Exception as e:
+        print(f"ERRO ao entregar update do Telegram: {e}")
+        return "Erro ao entregar update", 500
+    return "", 200
+
+
 def enviar_mensagem_telegram_direto(chat_id: str, texto: str):
     """
     Função simples para enviar uma mensagem pelo Telegram
     usando a API HTTP, sem depender do 'bot_telegram.py'.
+    (ATUALIZADO) Passa pela fila de envio: respeita os limites e repete em 429/erro de rede.
     """
     try:
-        url = f"https://api.telegram.org/bot{config.TELEGRAM_TOKEN}/sendMessage"
         payload = {
             "chat_id": int(chat_id), # API do Telegram espera um INT
             "text": texto,
             "parse_mode": "Markdown" # Para o texto ficar formatado (com *negrito*)
         }
-        response = requests.post(url, json=payload)
-        print(f"[Envio Direto] Resposta da API Telegram: {response.json()}")
+        resposta = chamar_api_telegram("sendMessage", payload)
+        print(f"[Envio Direto] Resposta da API Telegram: {resposta}")
     except Exception as e:
         print(f"ERRO ao enviar mensagem direta para {chat_id}: {e}")
 
 
+# --- (NOVO) Modo webhook: o bot sobe junto com o servidor (também no gunicorn) ---
+if webhook_telegram.webhook_ativo():
+    webhook_telegram.iniciar_bot_webhook()
+    atexit.register(webhook_telegram.parar_bot_webhook)
+
+
 if __name__ == '__main__':
     print(f"Servidor de imagens e Webhooks rodando. Servindo da pasta: {IMAGE_DIR}")
     # Roda na porta 5000, acessível pelo ngrok
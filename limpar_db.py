@@ -15,11 +15,12 @@ def limpar_tabela_vendas():
         cursor = conn.cursor()
 
         print(f"Conectado ao '{DB_NAME}'. Limpando a tabela 'vendas'...")
+        cursor.execute("DELETE FROM venda_itens") # (NOVO) Itens das vendas
         cursor.execute("DELETE FROM vendas")
         
         print("Resetando o contador de ID (autoincrement)...")
         # Reseta o contador para que o próximo ID seja 1
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name='vendas'")
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name IN ('vendas', 'venda_itens')")
         
         conn.commit()
         conn.close()
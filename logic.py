@@ -1,18 +1,20 @@
 # logic.py
 import locale
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 import calendar
 import googlemaps
 import math 
 import re 
-import json 
 import threading 
+import asyncio
 
 from agenda import (
     verificar_horarios_disponiveis,
     marcar_horario,
     verificar_dias_disponiveis,
+    mapa_disponibilidade,
+    dias_livres_do_mapa,
     buscar_eventos_por_cpf, 
     cancelar_evento,       
     remarcar_evento,
@@ -24,11 +26,19 @@ from database import (
     registrar_venda,
     cancelar_venda_por_id,
     atualizar_data_horario_venda,
-    atualizar_status_pagamento,
+    db_itens_da_reserva,
+    db_distancia_da_reserva,
 )
 
+# --- (NOVO) Estoque por item ---
+from estoque import itens_do_carrinho
+
 from pagamento import criar_link_pagamento_sinal
 
+# --- (NOVO) Leituras da Agenda sem travar o loop do bot ---
+import agenda_async
+from execucao import em_thread # (NOVO) Pool limitado e medido para a parte síncrona
+
 # --- (NOVOS IMPORTS) ---
 import excel_sync       # Importa o módulo de sync
 import email_sender     # Importa o novo módulo de email
@@ -43,7 +53,9 @@ from catalogo import (
     CATALOGO_COMBOS,
     DEFINICOES_COMBOS,
     CATALOGO_AVULSOS_CATEGORIZADO,
-    CATALOGO_AVULSOS  # Lista única de avulsos
+    CATALOGO_AVULSOS,  # Lista única de avulsos
+    formatar_reais,
+    opcoes_da_etapa
 )
 # ------------------------------------
 
@@ -125,17 +137,6 @@ def iniciar_sincronizacao_excel():
     sync_thread.start()
 # -----------------------------------------------------------
 
-def formatar_reais(valor: float) -> str:
-    """Formata um valor float para o padrão R$ X.XXX,XX"""
-    try:
-        formatado_en = f"{valor:,.2f}"
-        temp_swap = formatado_en.replace(',', '_')
-        com_virgula = temp_swap.replace('.', ',')
-        formatado_br = com_virgula.replace('_', '.')
-        return formatado_br
-    except Exception:
-        return f"{valor:.2f}"
-
 def formatar_cpf(cpf_numeros: str) -> str:
     """Formata uma string de 11 dígitos de CPF para XXX.XXX.XXX-XX."""
     if not cpf_numeros or len(cpf_numeros) != 11 or not cpf_numeros.isdigit():
@@ -439,21 +440,47 @@ def obter_opcoes_etapa_atual(combo_info):
     """
     Retorna uma lista com todos os nomes de itens disponíveis para a etapa atual.
     """
-    etapa_definicao = DEFINICOES_COMBOS[combo_info['tipo_combo_id']]['etapas'][combo_info['etapa_idx']]
-    ids_categorias = etapa_definicao['id_cat']
-    
-    opcoes = []
-    
-    if 1 in ids_categorias:
-        opcoes.extend(ITENS_BRINQUEDOS_G)
-    if 4 in ids_categorias:
-        opcoes.extend(ITENS_KIT_BABY)
-    if 2 in ids_categorias:
-        opcoes.extend(ITENS_BRINQUEDOS_M)
-    if 3 in ids_categorias:
-        opcoes.extend(ITENS_BRINQUEDOS_P)
-    
-    return opcoes
+    return opcoes_da_etapa(combo_info['tipo_combo_id'], combo_info['etapa_idx'])
+
+MAX_EVENTOS_EXIBIDOS = 10
+
+def opcoes_de_reservas(eventos: list) -> list:
+    """Botões numerados da lista de reservas (as que sumiram desde a busca continuam no mesmo número)."""
+    menu_opcoes_eventos = []
+    for i, evento in enumerate(eventos[:MAX_EVENTOS_EXIBIDOS]):
+        if evento.get('indisponivel'):
+            titulo_evento = "Reserva indisponível (cancelada ou expirada)"
+        else:
+            start_obj = datetime.fromisoformat(evento['start'].get('dateTime'))
+            dia_formatado = start_obj.strftime("%d/%m/%Y")
+            hora_formatada = start_obj.strftime("%H:%M")
+            titulo_evento = f"{evento.get('summary', 'Reserva')} ({dia_formatado} às {hora_formatada})"
+        menu_opcoes_eventos.append({"id": str(i + 1), "titulo": f"*{i + 1}* - {titulo_evento}"})
+    menu_opcoes_eventos.append({"id": "voltar", "titulo": "🔙 Voltar"})
+    return menu_opcoes_eventos
+
+# ==============================================================================
+# --- (NOVO) ENTRADA ASSÍNCRONA (LOOP DO BOT) ---
+# ==============================================================================
+
+# Estados cuja próxima resposta consulta a disponibilidade (menu de meses, dias, horários ou a reserva)
+ESTADOS_COM_DISPONIBILIDADE = {
+    'confirmando_cpf', 'mostrando_reserva_e_opcoes',
+    'agendando_pedindo_mes', 'agendando_pedindo_dia', 'agendando_pedindo_hora', 'confirmando_pedido',
+    'remarcando_pedindo_mes', 'remarcando_pedindo_dia', 'remarcando_pedindo_hora', 'confirmando_remarcacao'
+}
+
+async def processar_mensagem_async(mensagem, numero_cliente, estado_info: dict):
+    """
+    (NOVO) Entrada para o loop de eventos do bot.
+    As leituras da Agenda (índice incremental e freeBusy) são feitas antes, pelo cliente
+    assíncrono, sem travar o loop; a máquina de estados, que ainda chama Maps e Mercado
+    Pago de forma síncrona, roda numa thread. Assim várias conversas andam ao mesmo tempo.
+    (NOVO) A thread vem do pool limitado do execucao.py (tamanho configurável, com métricas).
+    """
+    if (estado_info or {}).get('estado') in ESTADOS_COM_DISPONIBILIDADE:
+        await agenda_async.preparar_disponibilidade(*janela_dos_meses(gerar_lista_meses()))
+    return await em_thread(processar_mensagem, mensagem, numero_cliente, estado_info)
 
 # ==============================================================================
 # --- LÓGICA PRINCIPAL (PROCESSAR MENSAGEM) ---
@@ -832,30 +859,16 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
             estado_info['lista_eventos_gerenciar'] = eventos_encontrados
             estado_info['estado'] = 'selecionando_reserva_para_gerenciar'
             
-            MAX_EVENTOS_EXIBIDOS = 10 
-            eventos_para_exibir = eventos_encontrados[:MAX_EVENTOS_EXIBIDOS]
-            eventos_nao_exibidos = len(eventos_encontrados) - len(eventos_para_exibir)
+            eventos_nao_exibidos = len(eventos_encontrados) - MAX_EVENTOS_EXIBIDOS
             
             texto_resposta = f"Encontrei *{len(eventos_encontrados)} reservas* futuras neste CPF:\n\n"
-            menu_opcoes_eventos = [] 
-            
-            for i, evento in enumerate(eventos_para_exibir):
-                start_time_str = evento['start'].get('dateTime')
-                start_obj = datetime.fromisoformat(start_time_str)
-                dia_formatado = start_obj.strftime("%d/%m/%Y")
-                hora_formatada = start_obj.strftime("%H:%M")
-                
-                titulo_evento = f"{evento.get('summary', 'Reserva')} ({dia_formatado} às {hora_formatada})"
-                menu_opcoes_eventos.append({"id": str(i + 1), "titulo": f"*{i + 1}* - {titulo_evento}"})
             
             if eventos_nao_exibidos > 0:
                 texto_resposta += f"\n... e mais *{eventos_nao_exibidos}* reservas futuras (exibindo apenas as {MAX_EVENTOS_EXIBIDOS} primeiras). Por favor, escolha entre as opções acima."
             
             texto_resposta += "\nQual reserva você gostaria de gerenciar?"
             resposta['body'] = texto_resposta
-            
-            menu_opcoes_eventos.append({"id": "voltar", "titulo": "🔙 Voltar"})
-            resposta['menu_opcoes'] = menu_opcoes_eventos
+            resposta['menu_opcoes'] = opcoes_de_reservas(eventos_encontrados)
             
             return resposta, estado_info
 
@@ -878,6 +891,11 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
             escolha_num = int(mensagem_lower)
             if 1 <= escolha_num <= len(lista_eventos):
                 evento_escolhido = lista_eventos[escolha_num - 1]
+                if evento_escolhido.get('indisponivel'):
+                    # (NOVO) Cancelada/expirada desde a busca: os outros números continuam valendo
+                    resposta['body'] = "Essa reserva não está mais disponível (foi cancelada ou expirou). 😕 Por favor, escolha outra da lista."
+                    resposta['menu_opcoes'] = opcoes_de_reservas(lista_eventos)
+                    return resposta, estado_info
                 estado_info['evento_para_gerenciar'] = evento_escolhido
                 del estado_info['lista_eventos_gerenciar']
                 estado_info['estado'] = 'mostrando_reserva_e_opcoes'
@@ -906,21 +924,7 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
             texto_erro = "Opção inválida. 😕 Por favor, escolha uma das reservas da lista."
             resposta['body'] = texto_erro
             
-            eventos = estado_info.get('lista_eventos_gerenciar', [])
-            MAX_EVENTOS_EXIBIDOS = 10 
-            eventos_para_exibir = eventos[:MAX_EVENTOS_EXIBIDOS]
-            menu_opcoes_eventos = []
-
-            for i, evento in enumerate(eventos_para_exibir):
-                start_time_str = evento['start'].get('dateTime')
-                start_obj = datetime.fromisoformat(start_time_str)
-                dia_formatado = start_obj.strftime("%d/%m/%Y")
-                hora_formatada = start_obj.strftime("%H:%M")
-                titulo_evento = f"{evento.get('summary', 'Reserva')} ({dia_formatado} às {hora_formatada})"
-                menu_opcoes_eventos.append({"id": str(i + 1), "titulo": f"*{i + 1}* - {titulo_evento}"})
-            
-            menu_opcoes_eventos.append({"id": "voltar", "titulo": "🔙 Voltar"})
-            resposta['menu_opcoes'] = menu_opcoes_eventos
+            resposta['menu_opcoes'] = opcoes_de_reservas(estado_info.get('lista_eventos_gerenciar', []))
 
             return resposta, estado_info
 
@@ -1067,8 +1071,10 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
         
         try:
             horario_obj = datetime.strptime(horario_escolhido, '%H:%M').time()
-            if not (datetime.strptime('08:00', '%H:%M').time() <= horario_obj <= datetime.strptime('17:00', '%H:%M').time()):
-                raise ValueError("Horário fora do intervalo permitido (08:00-17:00)")
+            horario_escolhido = horario_obj.strftime('%H:%M')
+            # (NOVO) Só aceita horários que o planejador de entregas ofereceu
+            if horario_escolhido not in estado_info.get('horarios_cache', []):
+                raise ValueError("Horário sem veículo/equipe disponível")
 
             estado_info['horario_escolhido_novo'] = horario_escolhido
             estado_info['estado'] = 'confirmando_remarcacao'
@@ -1096,9 +1102,8 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
             
             return resposta, estado_info
         except (ValueError, IndexError):
-            resposta['body'] = ("Horário inválido 😕.\n\n"
-                                "Por favor, digite um horário entre as *08:00 e 17:00* no formato HH:MM (ex: `14:30`), ou digite *voltar*.")
-            return resposta, estado_info
+            resposta['body'] = "Horário inválido ou indisponível 😕."
+            return mostrar_horarios_disponiveis(resposta, date.fromisoformat(estado_info.get('dia_obj_novo')), estado_info)
 
     elif estado_atual == 'confirmando_remarcacao':
         if mensagem_lower == 'sim':
@@ -1131,6 +1136,7 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
                         "Vamos tentar de novo:"
                     )
                     estado_info['estado'] = 'remarcando_pedindo_dia'
+                    estado_info.pop('disponibilidade', None) # O retrato ficou velho
                     ano, mes = estado_info.get('ano_novo'), estado_info.get('mes_novo')
                     return mostrar_dias_disponiveis(resposta, ano, mes, numero_cliente, estado_info)
             
@@ -1397,8 +1403,10 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
 
         try:
             horario_obj = datetime.strptime(horario_escolhido, '%H:%M').time()
-            if not (datetime.strptime('08:00', '%H:%M').time() <= horario_obj <= datetime.strptime('17:00', '%H:%M').time()):
-                raise ValueError("Horário fora do intervalo permitido (08:00-17:00)")
+            horario_escolhido = horario_obj.strftime('%H:%M')
+            # (NOVO) Só aceita horários que o planejador de entregas ofereceu
+            if horario_escolhido not in estado_info.get('horarios_cache', []):
+                raise ValueError("Horário sem veículo/equipe disponível")
 
             estado_info['horario_escolhido'] = horario_escolhido
             estado_info['estado'] = 'confirmando_pedido'
@@ -1459,9 +1467,8 @@ def processar_mensagem(mensagem, numero_cliente, estado_info: dict):
             
             return resposta, estado_info
         except (ValueError, IndexError):
-            resposta['body'] = ("Horário inválido 😕.\n\n"
-                                "Por favor, digite um horário entre as *08:00 e 17:00* no formato HH:MM (ex: `14:30`), ou digite *voltar*.")
-            return resposta, estado_info
+            resposta['body'] = "Horário inválido ou indisponível 😕."
+            return mostrar_horarios_disponiveis(resposta, date.fromisoformat(estado_info.get('dia_obj')), estado_info)
 
     # --- Fluxo: Confirmação Final (ATUALIZADO) ---
     elif estado_atual == 'confirmando_pedido':
@@ -1523,15 +1530,77 @@ def gerar_lista_meses():
         mes_atual += relativedelta(months=1)
     return meses
 
+# (NOVO) Validade do retrato de disponibilidade guardado na conversa.
+# A reserva final é sempre decidida pelo claim atômico, então um retrato um pouco velho é seguro.
+VALIDADE_RETRATO_DISPONIBILIDADE = timedelta(minutes=30)
+
+def janela_dos_meses(meses_info):
+    """(NOVO) Primeiro e último dia cobertos pela lista de meses do menu."""
+    primeiro = date(meses_info[0]['ano'], meses_info[0]['mes'], 1)
+    ultimo_mes = meses_info[-1]
+    ultimo = date(ultimo_mes['ano'], ultimo_mes['mes'], calendar.monthrange(ultimo_mes['ano'], ultimo_mes['mes'])[1])
+    return primeiro, ultimo
+
+def itens_para_disponibilidade(estado_info):
+    """
+    (NOVO) Itens ({nome: quantidade}) que precisam caber no estoque e a reserva que
+    não deve ser contada (na remarcação, a própria reserva sendo movida).
+    """
+    if (estado_info.get('estado') or '').startswith('remarcando'):
+        event_id = estado_info.get('evento_para_gerenciar', {}).get('id')
+        return db_itens_da_reserva(event_id), event_id
+    return itens_do_carrinho(estado_info.get('carrinho', [])), None
+
+def carregar_disponibilidade(estado_info, meses_info):
+    """
+    (NOVO) Busca de uma só vez a disponibilidade dos 12 meses do menu para os itens
+    do pedido e guarda o retrato (um bitmap por mês) no estado da conversa.
+    Reaproveita o retrato enquanto válido e feito para os mesmos itens.
+    Retorna o dicionário {'AAAA-MM': bitmap} ou None se a consulta falhar.
+    """
+    primeiro, ultimo = janela_dos_meses(meses_info)
+    itens, ignorar_id = itens_para_disponibilidade(estado_info)
+
+    retrato = estado_info.get('disponibilidade')
+    if retrato and retrato.get('inicio') == primeiro.isoformat() and retrato.get('itens') == itens and retrato.get('ignorar_id') == ignorar_id:
+        if datetime.now() - datetime.fromisoformat(retrato['gerado_em']) < VALIDADE_RETRATO_DISPONIBILIDADE:
+            return retrato['meses']
+
+    try:
+        meses = mapa_disponibilidade(primeiro, ultimo, itens, ignorar_id)
+    except Exception as e:
+        print(f"Erro ao carregar a disponibilidade dos meses: {e}")
+        estado_info.pop('disponibilidade', None)
+        return None
+
+    estado_info['disponibilidade'] = {
+        'inicio': primeiro.isoformat(),
+        'gerado_em': datetime.now().isoformat(),
+        'itens': itens,
+        'ignorar_id': ignorar_id,
+        'meses': meses
+    }
+    return meses
+
 def mostrar_meses_disponiveis(resposta, numero_cliente, estado_info):
     meses_info = gerar_lista_meses()
     estado_info['meses_cache'] = meses_info
+    disponibilidade = carregar_disponibilidade(estado_info, meses_info)
     texto_meses = "🗓️ *Escolha o Mês*\n\nPara qual mês você gostaria de reservar?\n"
     
     menu_opcoes_meses = []
     for i, info in enumerate(meses_info):
         nome_mes_manual = nomes_meses.get(info['mes'], f"Mês {info['mes']}")
         nome_formatado = f"{nome_mes_manual} de {info['ano']}"
+        # (NOVO) Mostra quantos dias livres o mês ainda tem
+        if disponibilidade is not None:
+            livres = disponibilidade.get(f"{info['ano']}-{info['mes']:02d}", '').count('1')
+            if livres == 0:
+                nome_formatado += " (esgotado)"
+            elif livres == 1:
+                nome_formatado += " (1 dia livre)"
+            else:
+                nome_formatado += f" ({livres} dias livres)"
         menu_opcoes_meses.append({"id": str(i + 1), "titulo": nome_formatado})
 
     menu_opcoes_meses.append({"id": "voltar", "titulo": "🔙 Voltar"})
@@ -1543,7 +1612,13 @@ def mostrar_meses_disponiveis(resposta, numero_cliente, estado_info):
 
 def mostrar_dias_disponiveis(resposta, ano, mes, numero_cliente, estado_info):
     try:
-        dias_livres = verificar_dias_disponiveis(ano, mes) 
+        # (NOVO) Usa o retrato carregado no menu de meses; só consulta de novo se não houver
+        bitmap = estado_info.get('disponibilidade', {}).get('meses', {}).get(f"{ano}-{mes:02d}")
+        if bitmap is not None:
+            hoje = date.today()
+            dias_livres = [dia for dia in dias_livres_do_mapa(bitmap) if date(ano, mes, dia) >= hoje]
+        else:
+            dias_livres = verificar_dias_disponiveis(ano, mes, *itens_para_disponibilidade(estado_info))
         estado_info['dias_cache'] = dias_livres
         nome_mes_manual = nomes_meses.get(mes, f"Mês {mes}")
         nome_formatado = f"{nome_mes_manual} de {ano}"
@@ -1566,15 +1641,48 @@ def mostrar_dias_disponiveis(resposta, ano, mes, numero_cliente, estado_info):
         resposta['body'] = "Ocorreu um erro ao buscar os dias disponíveis. Tente novamente ou digite *voltar*."
     return resposta, estado_info
 
+def parametros_logistica(estado_info):
+    """
+    (NOVO) Distância (km, só ida) do endereço da festa e a reserva que não deve ser
+    contada (na remarcação, a própria reserva sendo movida).
+    """
+    if (estado_info.get('estado') or '').startswith('remarcando'):
+        event_id = estado_info.get('evento_para_gerenciar', {}).get('id')
+        return db_distancia_da_reserva(event_id), event_id
+    return estado_info.get('distancia_km'), None
+
 def mostrar_horarios_disponiveis(resposta, dia_obj: date, estado_info):
     try:
         dia_formatado = dia_obj.strftime("%d/%m/%Y")
+        # (NOVO) Horários reais: só onde há veículo e equipe para entregar e recolher
+        horarios_livres = verificar_horarios_disponiveis(dia_obj, *parametros_logistica(estado_info))
+        estado_info['horarios_cache'] = horarios_livres
+
+        if not horarios_livres:
+            texto_horarios = (
+                f"Poxa, não temos mais horários de entrega disponíveis em *{dia_formatado}*. 😕\n\n"
+                "Por favor, digite *voltar* e escolha outro dia."
+            )
+            if resposta.get('body'):
+                texto_horarios = resposta['body'] + "\n\n" + texto_horarios
+            resposta['body'] = texto_horarios
+            resposta['quick_replies'] = ['voltar']
+            return resposta, estado_info
+
+        horarios_formatados = [f"`{horario}`" for horario in horarios_livres]
+        linhas_horarios = []
+        for i in range(0, len(horarios_formatados), 5):
+            linhas_horarios.append("   ".join(horarios_formatados[i:i+5]))
+
         texto_horarios = (
             f"⏰ *Escolha o Horário para {dia_formatado}*\n\n"
             "Nossos valores incluem a locação por até *4 horas de festa*.\n\n"
-            "Você pode agendar a *chegada* dos brinquedos a qualquer hora entre as *08:00 e as 17:00*.\n\n"
-            "Por favor, digite o horário desejado no formato HH:MM (ex: `14:00`), ou digite *voltar*."
+            "Estes são os horários de *chegada* dos brinquedos disponíveis:\n\n"
+            + "\n".join(linhas_horarios) +
+            "\n\nPor favor, digite o horário desejado (ex: `14:00`), ou digite *voltar*."
         )
+        if resposta.get('body'):
+            texto_horarios = resposta['body'] + "\n\n" + texto_horarios
         resposta['body'] = texto_horarios
     except Exception as e:
         print(f"Erro em mostrar_horarios_disponiveis: {e}")
@@ -1621,8 +1729,6 @@ def iniciar_reserva_pendente(resposta, numero_cliente, estado_info):
             else:
                 itens_formatado_lista.append(f"- {item['nome']}")
         itens_formatado_agenda = "\n".join(itens_formatado_lista)
-        
-        itens_para_db = json.dumps(carrinho, ensure_ascii=False)
 
         # 4. Tenta marcar na Agenda como PENDENTE
         print(f"Tentando marcar PENDENTE na Agenda para {numero_cliente}...")
@@ -1634,12 +1740,16 @@ def iniciar_reserva_pendente(resposta, numero_cliente, estado_info):
             itens_formatado_agenda, 
             endereco_evento, 
             valor_total_geral,
-            status_pagamento='PENDENTE' 
+            status_pagamento='PENDENTE',
+            chat_id=numero_cliente,
+            itens=itens_do_carrinho(carrinho),
+            distancia_km=estado_info.get('distancia_km')
         )
         
         if not sucesso_agenda:
             resposta['body'] = f"Oh, que pena! 😕 O dia *{dia_obj.strftime('%d/%m')}* foi reservado por outra pessoa no último segundo.\n\nVamos tentar de novo:"
             estado_info['estado'] = 'agendando_pedindo_dia'
+            estado_info.pop('disponibilidade', None) # O retrato ficou velho
             ano, mes = estado_info.get('ano'), estado_info.get('mes')
             return mostrar_dias_disponiveis(resposta, ano, mes, numero_cliente, estado_info)
 
@@ -1652,7 +1762,7 @@ def iniciar_reserva_pendente(resposta, numero_cliente, estado_info):
             nome=nome_cliente,
             cpf=cpf_cliente,
             endereco=endereco_evento,
-            itens_json=itens_para_db,
+            carrinho=carrinho,
             faturamento=valor_total_geral,
             custo_op=custo_dos_itens,
             lucro=lucro_liquido,
@@ -1708,22 +1818,28 @@ def finalizar_reserva_pos_pagamento(resposta, numero_cliente, event_id, estado_i
     """
     PASSO 2 DO AGENDAMENTO:
     Chamado pelo Webhook DEPOIS que o pagamento é APROVADO.
-    Confirma a reserva na Agenda e no DB.
+    Confirma a reserva no DB e na Agenda.
     """
     try:
-        # 1. Confirma na Agenda Google
-        sucesso_agenda = confirmar_pagamento_evento(event_id)
+        # 1. Confirma no DB (livro e venda); a Agenda é atualizada em segundo plano
+        resultado_reserva = confirmar_pagamento_evento(event_id)
         
-        if not sucesso_agenda:
-            raise Exception(f"Webhook não conseguiu confirmar o evento {event_id} na agenda.")
+        if resultado_reserva == 'ESTORNAR':
+            # Pago depois de expirar e o dia já foi ocupado: não confirma, o sinal é devolvido
+            resposta['body'] = (
+                "Recebemos o seu pagamento, mas a sua pré-reserva já tinha expirado e a data "
+                "não está mais disponível. 😕\n\n"
+                "O valor do sinal será *estornado*. Entraremos em contato para combinar outra data, "
+                "se você quiser."
+            )
+            return resposta, {'estado': None, 'carrinho': [], 'frete_valor': -1.0}
+        if not resultado_reserva:
+            raise Exception(f"Webhook não conseguiu confirmar a reserva {event_id}.")
 
-        # 2. Confirma no Banco de Dados
-        atualizar_status_pagamento(event_id, 'CONFIRMADO')
-        
-        # 3. Dispara a sincronização
+        # 2. Dispara a sincronização
         iniciar_sincronizacao_excel()
             
-        # 4. Responde ao cliente e limpa o estado
+        # 3. Responde ao cliente e limpa o estado
         dia_obj_str = estado_info.get('dia_obj')
         horario_escolhido = estado_info.get('horario_escolhido')
         endereco_evento = estado_info.get('endereco_completo', 'Não informado') 
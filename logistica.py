@@ -0,0 +1,122 @@
+# logistica.py
+# Planejador de capacidade de entregas: veículos, equipes, tempo de viagem
+# (a partir da distancia_km guardada) e janelas de montagem/desmontagem.
+# Cada recurso tem uma lista ordenada de intervalos ocupados; encaixar uma
+# tarefa é uma busca binária nessa lista.
+import math
+from bisect import bisect_left, insort
+from datetime import date, datetime, time, timedelta
+
+from estoque import DURACAO_FESTA
+
+# ==============================================================================
+# --- CONFIGURAÇÃO DA FROTA E DAS EQUIPES ---
+# ==============================================================================
+VEICULOS = ["Veículo 1"]
+EQUIPES = ["Equipe 1"]
+
+VELOCIDADE_MEDIA_KMH = 35 # Média em trânsito urbano
+DISTANCIA_PADRAO_KM = 15.0 # Usada quando a reserva não tem distância salva
+TEMPO_MONTAGEM = timedelta(hours=1)
+TEMPO_DESMONTAGEM = timedelta(hours=1)
+
+# Janela de chegada oferecida ao cliente (mesma regra de antes: 08:00 às 17:00)
+HORARIO_PRIMEIRA_CHEGADA = time(8, 0)
+HORARIO_ULTIMA_CHEGADA = time(17, 0)
+INTERVALO_ENTRE_HORARIOS = timedelta(minutes=30)
+
+
+def tempo_de_viagem(distancia_km) -> timedelta:
+    """Tempo de ida (depósito -> festa), arredondado para cima em blocos de 5 minutos."""
+    if distancia_km is None or distancia_km <= 0:
+        distancia_km = DISTANCIA_PADRAO_KM
+    minutos = distancia_km / VELOCIDADE_MEDIA_KMH * 60
+    return timedelta(minutes=5 * math.ceil(minutos / 5))
+
+
+def tarefas_da_reserva(data_evento: str, horario_evento: str, distancia_km) -> list:
+    """
+    As duas saídas de uma reserva, como intervalos [inicio, fim) em que um veículo
+    e uma equipe ficam ocupados:
+    - entrega: sai do depósito, monta e volta (a montagem termina no início da festa);
+    - recolhimento: sai antes do fim da festa, desmonta e volta.
+    """
+    hora, minuto = map(int, horario_evento.split(':'))
+    inicio_festa = datetime.combine(date.fromisoformat(data_evento), time(hora, minuto))
+    fim_festa = inicio_festa + DURACAO_FESTA
+    viagem = tempo_de_viagem(distancia_km)
+    return [
+        (inicio_festa - TEMPO_MONTAGEM - viagem, inicio_festa + viagem),
+        (fim_festa - viagem, fim_festa + TEMPO_DESMONTAGEM + viagem)
+    ]
+
+
+# ==============================================================================
+# --- AGENDA DE CADA RECURSO (LISTA ORDENADA DE INTERVALOS) ---
+# ==============================================================================
+
+def _esta_livre(ocupados: list, inicio: datetime, fim: datetime) -> bool:
+    """True se [inicio, fim) não cruza nenhum intervalo da lista ordenada 'ocupados'."""
+    i = bisect_left(ocupados, (inicio, fim))
+    if i > 0 and ocupados[i - 1][1] > inicio:
+        return False
+    if i < len(ocupados) and ocupados[i][0] < fim:
+        return False
+    return True
+
+
+def _alocar(agendas: dict, inicio: datetime, fim: datetime):
+    """Coloca a tarefa no primeiro recurso livre e retorna o nome dele (ou None)."""
+    for recurso, ocupados in agendas.items():
+        if _esta_livre(ocupados, inicio, fim):
+            insort(ocupados, (inicio, fim))
+            return recurso
+    return None
+
+
+def montar_agendas(tarefas: list):
+    """
+    Distribui as tarefas já reservadas entre veículos e equipes (em ordem de início,
+    sempre no primeiro recurso livre). Retorna (agenda_veiculos, agenda_equipes).
+    """
+    agenda_veiculos = {veiculo: [] for veiculo in VEICULOS}
+    agenda_equipes = {equipe: [] for equipe in EQUIPES}
+    for inicio, fim in sorted(tarefas):
+        if _alocar(agenda_veiculos, inicio, fim) is None or _alocar(agenda_equipes, inicio, fim) is None:
+            print(f"AVISO: Tarefa de {inicio:%d/%m %H:%M} a {fim:%H:%M} excede a capacidade de veículos/equipes.")
+    return agenda_veiculos, agenda_equipes
+
+
+def cabe_nas_agendas(agenda_veiculos: dict, agenda_equipes: dict, novas_tarefas: list) -> bool:
+    """True se cada nova tarefa encontra um veículo e uma equipe livres (não altera as agendas)."""
+    veiculos = {recurso: list(ocupados) for recurso, ocupados in agenda_veiculos.items()}
+    equipes = {recurso: list(ocupados) for recurso, ocupados in agenda_equipes.items()}
+    for inicio, fim in novas_tarefas:
+        if _alocar(veiculos, inicio, fim) is None or _alocar(equipes, inicio, fim) is None:
+            return False
+    return True
+
+
+def cabe_na_logistica(tarefas_existentes: list, novas_tarefas: list) -> bool:
+    """Responde "dá para entregar?" para as tarefas de uma nova reserva."""
+    return cabe_nas_agendas(*montar_agendas(tarefas_existentes), novas_tarefas)
+
+
+def horarios_livres(dia: date, distancia_km, tarefas_existentes: list, agora: datetime = None) -> list:
+    """
+    Horários de chegada ('HH:MM') do dia em que a entrega e o recolhimento cabem
+    na frota e nas equipes. Se o dia for hoje, a equipe ainda precisa ter tempo de sair.
+    """
+    agora = agora or datetime.now()
+    agenda_veiculos, agenda_equipes = montar_agendas(tarefas_existentes)
+
+    horarios = []
+    candidato = datetime.combine(dia, HORARIO_PRIMEIRA_CHEGADA)
+    ultimo = datetime.combine(dia, HORARIO_ULTIMA_CHEGADA)
+    while candidato <= ultimo:
+        horario = candidato.strftime('%H:%M')
+        novas_tarefas = tarefas_da_reserva(dia.isoformat(), horario, distancia_km)
+        if novas_tarefas[0][0] > agora and cabe_nas_agendas(agenda_veiculos, agenda_equipes, novas_tarefas):
+            horarios.append(horario)
+        candidato += INTERVALO_ENTRE_HORARIOS
+    return horarios
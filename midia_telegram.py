@@ -0,0 +1,94 @@
+# midia_telegram.py
+# Cache dos file_id das imagens do catálogo enviadas ao Telegram.
+# Antes, cada send_photo(photo=url) fazia o Telegram baixar de novo o PNG pelo BASE_URL
+# (túnel do ngrok): lento e gastando banda do túnel a cada visualização do catálogo.
+# Agora o primeiro envio bem-sucedido guarda o file_id devolvido pelo Telegram no SQLite
+# (tabela telegram_file_ids), com a chave caminho da imagem + hash do conteúdo. Os próximos
+# envios mandam só o file_id. Se o arquivo mudar no disco, o hash muda e a imagem volta a
+# ir pela URL (e o file_id novo substitui o antigo).
+#  - preparar_fotos(urls): o que mandar no 'photo' de cada URL (file_id ou a própria URL);
+#  - registrar_file_ids(...): guarda os file_ids dos envios feitos pela URL;
+#  - esquecer_file_ids(...): descarta file_ids que o Telegram recusou.
+# As três funções fazem I/O de disco e sqlite: no bot, chame pelo em_thread.
+import hashlib
+import os
+import threading
+from urllib.parse import urlparse, unquote
+
+from database import db_obter_file_ids, db_salvar_file_ids, db_remover_file_ids
+
+PASTA_IMAGENS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image') # A mesma do image_server.py
+PREFIXO_ROTA_IMAGENS = '/image/'
+
+_hashes = {} # caminho -> (mtime_ns, tamanho, hash): só relê o arquivo se ele mudou
+_hashes_lock = threading.Lock()
+
+
+def _caminho_da_url(url: str):
+    """Caminho relativo (dentro de PASTA_IMAGENS) de uma URL servida pelo image_server, ou None."""
+    caminho_url = unquote(urlparse(url).path)
+    if not caminho_url.startswith(PREFIXO_ROTA_IMAGENS):
+        return None
+    relativo = os.path.normpath(caminho_url[len(PREFIXO_ROTA_IMAGENS):])
+    if relativo.startswith('..') or os.path.isabs(relativo):
+        return None
+    return relativo.replace(os.sep, '/')
+
+
+def _hash_do_arquivo(relativo: str):
+    """sha256 do conteúdo da imagem (None se o arquivo não existe)."""
+    completo = os.path.join(PASTA_IMAGENS, relativo)
+    try:
+        info = os.stat(completo)
+    except OSError:
+        return None
+    with _hashes_lock:
+        guardado = _hashes.get(relativo)
+    if guardado and guardado[0] == info.st_mtime_ns and guardado[1] == info.st_size:
+        return guardado[2]
+    sha = hashlib.sha256()
+    with open(completo, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(65536), b''):
+            sha.update(bloco)
+    with _hashes_lock:
+        _hashes[relativo] = (info.st_mtime_ns, info.st_size, sha.hexdigest())
+    return sha.hexdigest()
+
+
+def preparar_fotos(urls: list) -> list:
+    """
+    Para cada URL, retorna (foto, chave, do_cache):
+     - foto: o file_id guardado (se a imagem não mudou) ou a própria URL;
+     - chave: (caminho, hash) da imagem local, ou None se a URL não é do image_server;
+     - do_cache: True se 'foto' é um file_id.
+    """
+    chaves = []
+    for url in urls:
+        relativo = _caminho_da_url(url)
+        hash_conteudo = _hash_do_arquivo(relativo) if relativo else None
+        chaves.append((relativo, hash_conteudo) if hash_conteudo else None)
+
+    file_ids = db_obter_file_ids({chave[0]: chave[1] for chave in chaves if chave})
+    fotos = []
+    for url, chave in zip(urls, chaves):
+        file_id = file_ids.get(chave[0]) if chave else None
+        fotos.append((file_id or url, chave, file_id is not None))
+    return fotos
+
+
+def registrar_file_ids(envios: list):
+    """
+    Guarda os file_ids dos envios feitos pela URL. 'envios' é uma lista de (chave, mensagem)
+    com a chave vinda do preparar_fotos e a Message devolvida pelo Telegram.
+    """
+    itens = []
+    for chave, mensagem in envios:
+        if chave is None or mensagem is None or not mensagem.photo:
+            continue
+        itens.append((chave[0], chave[1], mensagem.photo[-1].file_id)) # Maior resolução
+    db_salvar_file_ids(itens)
+
+
+def esquecer_file_ids(chaves: list):
+    """Descarta os file_ids dessas chaves (o Telegram não aceitou): o próximo envio vai pela URL."""
+    db_remover_file_ids([chave[0] for chave in chaves if chave])
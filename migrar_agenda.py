@@ -0,0 +1,8 @@
+# migrar_agenda.py
+# Migração única: move CPF e status das chaves na descrição dos eventos
+# (CPF_KEY::...::END_CPF / STATUS_KEY::...::END_STATUS) para extendedProperties.
+from agenda import migrar_eventos_para_extended_properties
+
+if __name__ == '__main__':
+    print("Migrando eventos da Agenda Google para extendedProperties...")
+    migrar_eventos_para_extended_properties()
@@ -0,0 +1,113 @@
+# stress_estados.py
+# Teste de estresse dos armazenamentos de estado (estado_store.py) com vários PROCESSOS.
+# Cada processo faz ler-alterar-gravar em chats sorteados: soma 1 no contador do chat
+# e no seu próprio contador dentro do estado. Com o compare-and-swap, ao final cada
+# contador tem que bater exatamente com o número de operações feitas (nenhuma
+# atualização perdida). Com --sem-cas (grava sem conferir a versão lida) as perdas aparecem.
+# Roda numa pasta temporária (não toca no financeiro.db).
+#
+# Uso: python stress_estados.py [--backend sqlite arquivo] [--processos 8] [--chats 20] [--operacoes 500] [--sem-cas]
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import database
+from estado_store import criar_store, ConflitoDeVersao
+
+
+def _trabalhador(indice: int, backend: str, pasta: str, chats: int, operacoes: int, sem_cas: bool, resultados):
+    """Um processo: 'operacoes' incrementos em chats sorteados. Envia (feitos por chat, conflitos, segundos)."""
+    database.DB_NAME = os.path.join(pasta, 'estados.db')
+    store = criar_store(backend, pasta)
+    sorteio = random.Random(indice)
+    feitos = Counter()
+    conflitos = 0
+    inicio = time.perf_counter()
+    for _ in range(operacoes):
+        chat_id = f"chat-{sorteio.randrange(chats)}"
+        while True:
+            estado_json, versao = store.ler(chat_id)
+            estado = json.loads(estado_json) if estado_json else {'estado': 'stress', 'contador': 0, 'por_processo': {}}
+            estado['contador'] += 1
+            estado['por_processo'][str(indice)] = estado['por_processo'].get(str(indice), 0) + 1
+            if sem_cas:
+                versao = store.versao(chat_id) # Confere a versão de AGORA, não a lida: corrida clássica
+            try:
+                store.comparar_e_gravar(chat_id, json.dumps(estado), versao)
+                break
+            except ConflitoDeVersao:
+                conflitos += 1
+        feitos[chat_id] += 1
+    resultados.put((indice, dict(feitos), conflitos, time.perf_counter() - inicio))
+
+
+def executar_stress(backend: str, processos: int, chats: int, operacoes: int, sem_cas: bool) -> int:
+    """Roda o teste num backend e retorna quantas atualizações se perderam."""
+    pasta = tempfile.mkdtemp(prefix=f'stress_estados_{backend}_')
+    database.DB_NAME = os.path.join(pasta, 'estados.db')
+    database.inicializar_banco()
+    database.fechar_conexao() # Os processos filhos abrem as suas
+
+    resultados = multiprocessing.Queue()
+    trabalhadores = [
+        multiprocessing.Process(target=_trabalhador, args=(i, backend, pasta, chats, operacoes, sem_cas, resultados))
+        for i in range(processos)
+    ]
+    inicio = time.perf_counter()
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    respostas = [resultados.get() for _ in trabalhadores]
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    total_segundos = time.perf_counter() - inicio
+
+    esperado = Counter()
+    esperado_por_processo = {}
+    conflitos = 0
+    for indice, feitos, conflitos_processo, _ in respostas:
+        esperado.update(feitos)
+        esperado_por_processo[indice] = feitos
+        conflitos += conflitos_processo
+
+    store = criar_store(backend, pasta)
+    perdidas = 0
+    for chat_id, quantidade in esperado.items():
+        estado_json, _ = store.ler(chat_id)
+        estado = json.loads(estado_json)
+        perdidas += quantidade - estado['contador']
+        for indice, feitos in esperado_por_processo.items():
+            perdidas_processo = feitos.get(chat_id, 0) - estado['por_processo'].get(str(indice), 0)
+            if perdidas_processo and not sem_cas:
+                print(f"  ERRO: {chat_id} perdeu {perdidas_processo} atualizações do processo {indice}")
+
+    total = processos * operacoes
+    print(
+        f"  {backend:<8} {'sem CAS' if sem_cas else 'com CAS'}: {total} operações em {total_segundos:.2f}s "
+        f"({total / total_segundos:.0f} op/s), {conflitos} conflitos repetidos, {perdidas} atualizações perdidas"
+    )
+    return perdidas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estresse multiprocesso dos armazenamentos de estado (compare-and-swap).")
+    parser.add_argument('--backend', nargs='+', default=['sqlite', 'arquivo'], choices=['sqlite', 'arquivo'])
+    parser.add_argument('--processos', type=int, default=8)
+    parser.add_argument('--chats', type=int, default=20, help="Poucos chats = muita disputa pelo mesmo chat")
+    parser.add_argument('--operacoes', type=int, default=500, help="Operações por processo")
+    parser.add_argument('--sem-cas', action='store_true', help="Grava sem conferir a versão lida (mostra as perdas)")
+    args = parser.parse_args()
+
+    print(f"=== {args.processos} processos x {args.operacoes} operações em {args.chats} chats ===")
+    total_perdidas = sum(
+        executar_stress(backend, args.processos, args.chats, args.operacoes, args.sem_cas)
+        for backend in args.backend
+    )
+    if total_perdidas and not args.sem_cas:
+        print("FALHOU: houve atualizações perdidas com o compare-and-swap.")
+        sys.exit(1)
@@ -0,0 +1,39 @@
+# conftest.py
+# Os módulos do bot ficam na raiz do projeto (sem pacote): os testes importam de lá.
+# O agenda.py é importado apontando para o calendario_fake.py, sem credenciais e sem rede.
+import os
+import socket
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def _porta_livre() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='session')
+def calendario_fake():
+    """Sobe o calendario_fake.py numa thread e retorna o módulo (as agendas ficam em _agendas)."""
+    pytest.importorskip('flask')
+    porta = _porta_livre()
+    # O endereço precisa estar definido ANTES de importar o agenda (é lido na importação do agenda_cliente)
+    os.environ['CALENDAR_API_URL'] = f"http://127.0.0.1:{porta}/calendar/v3/"
+    import calendario_fake as modulo
+    servidor = modulo.iniciar_em_thread(porta)
+    yield modulo
+    servidor.shutdown()
+
+
+@pytest.fixture(scope='session')
+def agenda(calendario_fake):
+    """O módulo agenda, falando com o calendario_fake.py."""
+    pytest.importorskip('googleapiclient')
+    pytest.importorskip('dateutil')
+    import agenda as modulo
+    return modulo
@@ -0,0 +1,186 @@
+# test_freebusy.py
+# Motor do freeBusy do agenda.py: união dos intervalos, conversão em dias no fuso da agenda,
+# divisão da janela e a consulta completa contra o calendario_fake.py.
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+FUSO = ZoneInfo('America/Sao_Paulo')
+
+
+def _local(ano, mes, dia, hora=0, minuto=0):
+    return datetime(ano, mes, dia, hora, minuto, tzinfo=FUSO)
+
+
+@pytest.fixture
+def agenda_equipe(calendario_fake, agenda):
+    """Agenda 'equipe-teste' vazia no servidor falso (e o cache do freeBusy limpo)."""
+    calendar_id = 'equipe-teste'
+    with calendario_fake._lock:
+        calendario_fake._agendas[calendar_id] = {}
+    agenda._limpar_cache_freebusy()
+    yield calendar_id
+    with calendario_fake._lock:
+        calendario_fake._agendas.pop(calendar_id, None)
+    agenda._limpar_cache_freebusy()
+
+
+def _adicionar_evento(calendario_fake, calendar_id, inicio: datetime, fim: datetime, **extras):
+    evento = {
+        'id': f"ev{len(calendario_fake._agendas[calendar_id])}",
+        'status': 'confirmed',
+        'start': {'dateTime': inicio.isoformat()},
+        'end': {'dateTime': fim.isoformat()},
+        **extras
+    }
+    with calendario_fake._lock:
+        calendario_fake._agendas[calendar_id][evento['id']] = evento
+
+
+# ==============================================================================
+# --- _unir_intervalos ---
+# ==============================================================================
+
+def test_unir_intervalos_junta_os_que_se_encostam(agenda):
+    intervalos = [
+        (_local(2030, 1, 1, 10), _local(2030, 1, 1, 12)),
+        (_local(2030, 1, 1, 12), _local(2030, 1, 1, 14)),
+    ]
+    assert agenda._unir_intervalos(intervalos) == [(_local(2030, 1, 1, 10), _local(2030, 1, 1, 14))]
+
+
+def test_unir_intervalos_junta_sobrepostos_e_contidos_fora_de_ordem(agenda):
+    intervalos = [
+        (_local(2030, 1, 1, 13), _local(2030, 1, 1, 18)),
+        (_local(2030, 1, 1, 10), _local(2030, 1, 1, 14)),
+        (_local(2030, 1, 1, 15), _local(2030, 1, 1, 16)), # Dentro do primeiro
+    ]
+    assert agenda._unir_intervalos(intervalos) == [(_local(2030, 1, 1, 10), _local(2030, 1, 1, 18))]
+
+
+def test_unir_intervalos_mantem_separados_os_disjuntos(agenda):
+    intervalos = [
+        (_local(2030, 1, 2, 10), _local(2030, 1, 2, 12)),
+        (_local(2030, 1, 1, 10), _local(2030, 1, 1, 12)),
+    ]
+    assert agenda._unir_intervalos(intervalos) == sorted(intervalos)
+
+
+def test_unir_intervalos_compara_fusos_diferentes_pelo_instante(agenda):
+    # 15:00Z = 12:00 em São Paulo: encosta no fim do primeiro intervalo
+    intervalos = [
+        (_local(2030, 1, 1, 10), _local(2030, 1, 1, 12)),
+        (datetime(2030, 1, 1, 15, tzinfo=timezone.utc), datetime(2030, 1, 1, 16, tzinfo=timezone.utc)),
+    ]
+    unidos = agenda._unir_intervalos(intervalos)
+    assert len(unidos) == 1
+    assert unidos[0][1] == _local(2030, 1, 1, 13)
+
+
+def test_unir_intervalos_vazio(agenda):
+    assert agenda._unir_intervalos([]) == []
+
+
+# ==============================================================================
+# --- _dias_dos_intervalos ---
+# ==============================================================================
+
+def test_dias_dos_intervalos_atravessando_a_meia_noite(agenda):
+    intervalos = [(_local(2030, 1, 1, 23), _local(2030, 1, 2, 1))]
+    assert agenda._dias_dos_intervalos(intervalos) == {'2030-01-01', '2030-01-02'}
+
+
+def test_dias_dos_intervalos_fim_na_meia_noite_e_exclusivo(agenda):
+    intervalos = [(_local(2030, 1, 1, 18), _local(2030, 1, 2, 0))]
+    assert agenda._dias_dos_intervalos(intervalos) == {'2030-01-01'}
+
+
+def test_dias_dos_intervalos_usa_o_fuso_da_agenda(agenda):
+    # 01:00Z do dia 2 ainda é 22:00 do dia 1 em São Paulo (UTC-3)
+    intervalos = [(datetime(2030, 1, 2, 1, tzinfo=timezone.utc), datetime(2030, 1, 2, 2, tzinfo=timezone.utc))]
+    assert agenda._dias_dos_intervalos(intervalos) == {'2030-01-01'}
+
+
+def test_dias_dos_intervalos_varios_dias_inteiros(agenda):
+    intervalos = [(_local(2030, 1, 1), _local(2030, 1, 4))]
+    assert agenda._dias_dos_intervalos(intervalos) == {'2030-01-01', '2030-01-02', '2030-01-03'}
+
+
+# ==============================================================================
+# --- _dividir_janela / _partes_da_janela ---
+# ==============================================================================
+
+def test_dividir_janela_em_partes_contiguas(agenda):
+    inicio = _local(2030, 1, 1)
+    fim = inicio + agenda.JANELA_MAX_FREEBUSY * 2 + timedelta(days=20)
+    partes = agenda._dividir_janela(inicio, fim)
+    assert len(partes) == 3
+    assert partes[0][0] == inicio and partes[-1][1] == fim
+    for (_, fim_anterior), (inicio_seguinte, _) in zip(partes, partes[1:]):
+        assert fim_anterior == inicio_seguinte
+    assert all(parte_fim - parte_inicio <= agenda.JANELA_MAX_FREEBUSY for parte_inicio, parte_fim in partes)
+
+
+def test_dividir_janela_multiplo_exato_nao_cria_parte_vazia(agenda):
+    inicio = _local(2030, 1, 1)
+    partes = agenda._dividir_janela(inicio, inicio + agenda.JANELA_MAX_FREEBUSY * 2)
+    assert len(partes) == 2
+
+
+def test_dividir_janela_vazia(agenda):
+    assert agenda._dividir_janela(_local(2030, 1, 1), _local(2030, 1, 1)) == []
+
+
+def test_partes_da_janela_cobre_os_dias_inteiros_no_fuso_da_agenda(agenda):
+    partes = agenda._partes_da_janela(date(2030, 1, 1), date(2030, 1, 1))
+    assert partes == [(_local(2030, 1, 1), _local(2030, 1, 2))]
+
+
+def test_partes_da_janela_longa(agenda):
+    partes = agenda._partes_da_janela(date(2030, 1, 1), date(2030, 12, 31))
+    assert partes[0][0] == _local(2030, 1, 1)
+    assert partes[-1][1] == _local(2031, 1, 1)
+    assert len(partes) == 5 # 365 dias em partes de 90
+
+
+# ==============================================================================
+# --- dias_ocupados_nos_calendarios (contra o calendario_fake.py) ---
+# ==============================================================================
+
+def test_dias_ocupados_nos_calendarios(calendario_fake, agenda, agenda_equipe):
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 3, 10, 14), _local(2030, 3, 10, 18))
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 3, 12, 22), _local(2030, 3, 13, 2))
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 3, 15, 10), _local(2030, 3, 15, 12), status='cancelled')
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 3, 16, 10), _local(2030, 3, 16, 12), transparency='transparent')
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 4, 1, 10), _local(2030, 4, 1, 12)) # Fora da janela
+
+    dias = agenda.dias_ocupados_nos_calendarios(date(2030, 3, 1), date(2030, 3, 31), [agenda_equipe])
+    assert dias == {'2030-03-10', '2030-03-12', '2030-03-13'}
+
+
+def test_dias_ocupados_janela_dividida(calendario_fake, agenda, agenda_equipe):
+    # Um evento em cada ponta de uma janela maior que JANELA_MAX_FREEBUSY
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 1, 1, 10), _local(2030, 1, 1, 12))
+    _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 12, 31, 20), _local(2030, 12, 31, 23))
+
+    dias = agenda.dias_ocupados_nos_calendarios(date(2030, 1, 1), date(2030, 12, 31), [agenda_equipe])
+    assert dias == {'2030-01-01', '2030-12-31'}
+
+
+def test_dias_ocupados_une_varias_agendas(calendario_fake, agenda, agenda_equipe):
+    outra = 'equipe-teste-2'
+    with calendario_fake._lock:
+        calendario_fake._agendas[outra] = {}
+    try:
+        _adicionar_evento(calendario_fake, agenda_equipe, _local(2030, 5, 5, 10), _local(2030, 5, 5, 12))
+        _adicionar_evento(calendario_fake, outra, _local(2030, 5, 6, 10), _local(2030, 5, 6, 12))
+        dias = agenda.dias_ocupados_nos_calendarios(date(2030, 5, 1), date(2030, 5, 31), [agenda_equipe, outra])
+        assert dias == {'2030-05-05', '2030-05-06'}
+    finally:
+        with calendario_fake._lock:
+            calendario_fake._agendas.pop(outra, None)
+
+
+def test_dias_ocupados_sem_agendas(agenda):
+    assert agenda.dias_ocupados_nos_calendarios(date(2030, 1, 1), date(2030, 1, 31), []) == set()
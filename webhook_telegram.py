@@ -0,0 +1,112 @@
+# webhook_telegram.py
+# Modo webhook do bot do Telegram, dentro do image_server.py (sem run_polling).
+# No polling, o bot mantinha uma conexão de long-poll aberta e cada mensagem esperava o
+# próximo ciclo de getUpdates. No webhook, o Telegram faz um POST em
+# {BASE_URL}/webhook/telegram para cada update, no mesmo servidor (e na mesma URL pública)
+# que já serve as imagens e recebe o Mercado Pago.
+#  - a Application roda numa thread com o seu próprio loop asyncio (handlers, pool, métricas);
+#  - a rota do Flask confere o cabeçalho X-Telegram-Bot-Api-Secret-Token e só entrega
+#    o update na update_queue da Application; a resposta ao Telegram sai na hora.
+# Use UM worker do gunicorn nesse modo (ex: gunicorn -w 1 --threads 8 image_server:app):
+# cada worker teria o seu bot e a ordem por chat (despacho.py) vale dentro de um processo.
+import asyncio
+import hmac
+import threading
+
+from telegram import Update
+
+import config
+
+CAMINHO_WEBHOOK = '/webhook/telegram'
+TIMEOUT_ENTREGA_SEGUNDOS = 5
+
+_loop = None
+_application = None
+_thread = None
+_pronto = threading.Event()
+_parar = None # asyncio.Event criado dentro do loop do bot
+
+
+def webhook_ativo() -> bool:
+    """O modo webhook está ligado no config.py?"""
+    return bool(getattr(config, 'TELEGRAM_USAR_WEBHOOK', False))
+
+
+def _segredo() -> str:
+    segredo = getattr(config, 'TELEGRAM_WEBHOOK_SECRET', '')
+    if not segredo:
+        raise RuntimeError("Defina TELEGRAM_WEBHOOK_SECRET no config.py para usar o modo webhook.")
+    return segredo
+
+
+async def _rodar_bot():
+    """Ciclo de vida da Application no modo webhook (equivalente ao que o run_webhook faria)."""
+    global _application, _parar
+    from bot_telegram import criar_aplicacao, iniciar_tarefas_de_fundo # Import local: bot_telegram importa muita coisa
+
+    _parar = asyncio.Event()
+    _application = criar_aplicacao()
+    await _application.initialize()
+    if _application.post_init:
+        await _application.post_init(_application)
+    await _application.bot.set_webhook(
+        url=f"{config.BASE_URL}{CAMINHO_WEBHOOK}",
+        secret_token=_segredo(),
+        allowed_updates=Update.ALL_TYPES
+    )
+    await _application.start()
+    iniciar_tarefas_de_fundo()
+    print(f"Bot do Telegram em modo webhook: {config.BASE_URL}{CAMINHO_WEBHOOK}")
+    _pronto.set()
+    try:
+        await _parar.wait()
+    finally:
+        await _application.stop()
+        if _application.post_shutdown:
+            await _application.post_shutdown(_application)
+        await _application.shutdown()
+
+
+def _thread_do_bot():
+    global _loop
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    try:
+        _loop.run_until_complete(_rodar_bot())
+    except Exception as e:
+        print(f"ERRO CRÍTICO no bot (modo webhook): {e}")
+    finally:
+        _pronto.set() # Não deixa quem espera travado se a inicialização falhou
+        _loop.close()
+
+
+def iniciar_bot_webhook(timeout_segundos: float = 30) -> bool:
+    """Sobe a Application numa thread e registra o webhook no Telegram (uma vez por processo)."""
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_thread_do_bot, name='bot-telegram-webhook', daemon=True)
+        _thread.start()
+    _pronto.wait(timeout_segundos)
+    return _application is not None and _application.running
+
+
+def parar_bot_webhook():
+    """Para a Application (grava os estados pendentes no post_shutdown)."""
+    if _loop is not None and _parar is not None and _thread.is_alive():
+        _loop.call_soon_threadsafe(_parar.set)
+        _thread.join(timeout=30)
+
+
+def segredo_valido(token_recebido: str) -> bool:
+    """Compara o X-Telegram-Bot-Api-Secret-Token em tempo constante."""
+    return bool(token_recebido) and hmac.compare_digest(token_recebido.encode(), _segredo().encode())
+
+
+def entregar_update(dados: dict) -> bool:
+    """Converte o JSON recebido e o põe na update_queue da Application. False se o bot não está rodando."""
+    if _application is None or not _application.running:
+        return False
+    update = Update.de_json(dados, _application.bot)
+    futuro = asyncio.run_coroutine_threadsafe(_application.update_queue.put(update), _loop)
+    futuro.result(timeout=TIMEOUT_ENTREGA_SEGUNDOS)
+    return True